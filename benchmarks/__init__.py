@@ -0,0 +1,10 @@
+"""
+格式还原性能基准。
+
+generator 模块生成可按规模缩放的合成模板/待处理文档对，run 模块在多个规模下
+计时 FormatRestorer.restore_format 与 FormatComparer.compare_documents，
+输出JSON结果并拟合各阶段耗时随规模增长的指数。
+
+用法:
+    python -m benchmarks.run [--scales 125,250,500,1000] [--output 结果.json]
+"""
@@ -0,0 +1,430 @@
+"""
+合成docx文档生成器。
+
+按 DocumentSpec 生成一对内容对应的文档：模板（样式规范、每段一个run）和待处理文档
+（同样的内容，但样式ID不同、run碎片化、带直接格式与rsid、部分文字改动、多余空段落、
+缺少部分分页符、表格列宽不同），覆盖还原流程中各个阶段的工作量。
+"""
+
+import random
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from lxml import etree
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+PIC_NS = "http://schemas.openxmlformats.org/drawingml/2006/picture"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+
+NSMAP = {"w": W_NS, "r": R_NS, "wp": WP_NS, "a": A_NS, "pic": PIC_NS}
+
+W = f"{{{W_NS}}}"
+
+REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+IMAGE_REL_ID = "rId10"
+
+# 模板与待处理文档的段落样式ID（样式名相同，ID不同，触发样式映射）
+TEMPLATE_STYLE_IDS = {"heading 1": "1", "heading 2": "2", "caption": "a4", "图片": "a5"}
+TARGET_STYLE_IDS = {"heading 1": "Heading1", "heading 2": "Heading2", "caption": "Caption", "图片": "Picture"}
+
+CJK_CHARS = [chr(0x4E00 + i) for i in range(2000)]
+LATIN_WORDS = [
+    "format", "document", "paragraph", "style", "table", "section", "template", "content",
+    "restore", "heading", "caption", "figure", "report", "project", "schedule", "analysis",
+    "result", "method", "system", "service", "response", "level", "definition", "time",
+]
+
+
+class DocumentSpec:
+    """
+    合成文档的规模与特征。
+
+    Attributes:
+        paragraphs: 正文段落数
+        runs_per_paragraph: 待处理文档中每段拆分成的run数（run碎片化程度）
+        table_every: 每隔多少段插入一个表格（0表示不插入）
+        table_rows: 表格行数
+        table_cols: 表格列数
+        image_every: 每隔多少段插入一张图片（0表示不插入）
+        heading_every: 每隔多少段插入一个一级标题（一级标题前有分页符）
+        bookmark_every: 每隔多少段插入一个书签（0表示不插入）
+        empty_every: 待处理文档中每隔多少段多出一个空段落（0表示不插入）
+        edit_ratio: 待处理文档中文字被轻微改动的段落比例
+        text: 文字类型，"cjk"或"latin"
+    """
+
+    def __init__(
+        self,
+        paragraphs: int = 500,
+        runs_per_paragraph: int = 4,
+        table_every: int = 50,
+        table_rows: int = 6,
+        table_cols: int = 4,
+        image_every: int = 100,
+        heading_every: int = 40,
+        bookmark_every: int = 10,
+        empty_every: int = 15,
+        edit_ratio: float = 0.3,
+        text: str = "cjk",
+    ):
+        if text not in ("cjk", "latin"):
+            raise ValueError(f"Unsupported text type: {text}")
+        self.paragraphs = paragraphs
+        self.runs_per_paragraph = runs_per_paragraph
+        self.table_every = table_every
+        self.table_rows = table_rows
+        self.table_cols = table_cols
+        self.image_every = image_every
+        self.heading_every = heading_every
+        self.bookmark_every = bookmark_every
+        self.empty_every = empty_every
+        self.edit_ratio = edit_ratio
+        self.text = text
+
+    def scaled(self, paragraphs: int) -> "DocumentSpec":
+        """
+        返回段落数不同、其余特征相同的规格（表格、图片等按段落比例同步增加）。
+
+        Args:
+            paragraphs: 新的段落数
+
+        Returns:
+            新的DocumentSpec
+        """
+        spec = DocumentSpec(**self.to_dict())
+        spec.paragraphs = paragraphs
+        return spec
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class _Block:
+    """文档中的一个内容块（段落、表格或图片），模板与待处理文档共用。"""
+
+    __slots__ = ("kind", "text", "style", "jc", "page_break", "bookmark", "cells")
+
+    def __init__(self, kind: str, text: str = "", style: Optional[str] = None):
+        self.kind = kind  # "p"、"table"或"image"
+        self.text = text
+        self.style = style  # 样式名（如"heading 1"），None为正文
+        self.jc: Optional[str] = None
+        self.page_break = False
+        self.bookmark: Optional[str] = None
+        self.cells: List[List[str]] = []
+
+
+def generate_pair(
+    spec: DocumentSpec,
+    template_path: Union[str, Path],
+    target_path: Union[str, Path],
+    seed: int = 0,
+) -> Tuple[Path, Path]:
+    """
+    生成一对模板/待处理文档。
+
+    Args:
+        spec: 文档规格
+        template_path: 模板docx输出路径
+        target_path: 待处理docx输出路径
+        seed: 随机种子（相同种子生成相同的文档）
+
+    Returns:
+        (模板路径, 待处理文档路径)
+    """
+    rng = random.Random(seed)
+    blocks = _content(spec, rng)
+
+    template_path, target_path = Path(template_path), Path(target_path)
+    _write_package(template_path, _template_document(blocks), _styles(TEMPLATE_STYLE_IDS))
+    _write_package(target_path, _target_document(blocks, spec, rng), _styles(TARGET_STYLE_IDS))
+    return template_path, target_path
+
+
+def _sentence(rng: random.Random, text: str) -> str:
+    if text == "cjk":
+        return "".join(rng.choices(CJK_CHARS, k=rng.randint(15, 80)))
+    words = rng.choices(LATIN_WORDS, k=rng.randint(5, 25))
+    return " ".join(words).capitalize() + "."
+
+
+def _edit(rng: random.Random, text: str) -> str:
+    """轻微改动文字（替换约2%的字符），相似度仍高于匹配阈值。"""
+    chars = list(text)
+    for _ in range(max(1, len(chars) // 50)):
+        chars[rng.randrange(len(chars))] = rng.choice(CJK_CHARS) if ord(chars[0]) > 0x2E80 else rng.choice("abcdefgh")
+    return "".join(chars)
+
+
+def _content(spec: DocumentSpec, rng: random.Random) -> List[_Block]:
+    blocks: List[_Block] = []
+    chapter = section = table = image = 0
+    for i in range(spec.paragraphs):
+        if spec.heading_every and i % spec.heading_every == 0:
+            chapter += 1
+            block = _Block("p", f"第{chapter}章 {_sentence(rng, spec.text)[:12]}", "heading 1")
+            block.page_break = chapter > 1
+            block.bookmark = f"_Toc{100000 + chapter}"
+        elif i % 8 == 0:
+            section += 1
+            block = _Block("p", f"{chapter}.{section} {_sentence(rng, spec.text)[:16]}", "heading 2")
+            block.bookmark = f"_Toc{200000 + section}"
+        else:
+            block = _Block("p", _sentence(rng, spec.text))
+            if spec.bookmark_every and i % spec.bookmark_every == 0:
+                block.bookmark = f"_Hlk{300000 + i}"
+            if i % 7 == 0:
+                block.jc = "center"
+        blocks.append(block)
+
+        if spec.table_every and i % spec.table_every == spec.table_every - 1:
+            table += 1
+            blocks.append(_Block("p", f"表{table} {_sentence(rng, spec.text)[:10]}", "caption"))
+            tbl = _Block("table")
+            tbl.cells = [[_sentence(rng, spec.text)[:8] for _ in range(spec.table_cols)] for _ in range(spec.table_rows)]
+            blocks.append(tbl)
+        if spec.image_every and i % spec.image_every == spec.image_every // 2:
+            image += 1
+            blocks.append(_Block("image", style="图片"))
+            blocks.append(_Block("p", f"图{image} {_sentence(rng, spec.text)[:10]}", "caption"))
+    return blocks
+
+
+def _el(parent, tag: str, **attrs):
+    elem = etree.SubElement(parent, W + tag)
+    for name, value in attrs.items():
+        elem.set(W + name, value)
+    return elem
+
+
+def _paragraph_properties(p, style_id: Optional[str], jc: Optional[str]) -> None:
+    if style_id is None and jc is None:
+        return
+    pPr = _el(p, "pPr")
+    if style_id is not None:
+        _el(pPr, "pStyle", val=style_id)
+    if jc is not None:
+        _el(pPr, "jc", val=jc)
+
+
+def _image_run(p, index: int) -> None:
+    r = _el(p, "r")
+    drawing = _el(r, "drawing")
+    inline = etree.SubElement(drawing, f"{{{WP_NS}}}inline")
+    etree.SubElement(inline, f"{{{WP_NS}}}extent", cx="952500", cy="952500")
+    etree.SubElement(inline, f"{{{WP_NS}}}docPr", id=str(index), name=f"图片 {index}")
+    graphic = etree.SubElement(inline, f"{{{A_NS}}}graphic")
+    data = etree.SubElement(graphic, f"{{{A_NS}}}graphicData", uri=PIC_NS)
+    pic = etree.SubElement(data, f"{{{PIC_NS}}}pic")
+    nv = etree.SubElement(pic, f"{{{PIC_NS}}}nvPicPr")
+    etree.SubElement(nv, f"{{{PIC_NS}}}cNvPr", id=str(index), name=f"image{index}.png")
+    etree.SubElement(nv, f"{{{PIC_NS}}}cNvPicPr")
+    fill = etree.SubElement(pic, f"{{{PIC_NS}}}blipFill")
+    etree.SubElement(fill, f"{{{A_NS}}}blip").set(f"{{{R_NS}}}embed", IMAGE_REL_ID)
+    sp = etree.SubElement(pic, f"{{{PIC_NS}}}spPr")
+    xfrm = etree.SubElement(sp, f"{{{A_NS}}}xfrm")
+    etree.SubElement(xfrm, f"{{{A_NS}}}off", x="0", y="0")
+    etree.SubElement(xfrm, f"{{{A_NS}}}ext", cx="952500", cy="952500")
+
+
+def _table(body, block: _Block, widths: List[int], rsid: Optional[str]) -> None:
+    tbl = _el(body, "tbl")
+    tblPr = _el(tbl, "tblPr")
+    _el(tblPr, "tblStyle", val="a6")
+    _el(tblPr, "tblW", w=str(sum(widths)), type="dxa")
+    grid = _el(tbl, "tblGrid")
+    for width in widths:
+        _el(grid, "gridCol", w=str(width))
+    for row in block.cells:
+        tr = _el(tbl, "tr")
+        if rsid:
+            tr.set(W + "rsidR", rsid)
+        for width, text in zip(widths, row):
+            tc = _el(tr, "tc")
+            _el(_el(tc, "tcPr"), "tcW", w=str(width), type="dxa")
+            p = _el(tc, "p")
+            _el(_el(p, "r"), "t").text = text
+
+
+def _section(body) -> None:
+    sectPr = _el(body, "sectPr")
+    _el(sectPr, "pgSz", w="11906", h="16838")
+    _el(sectPr, "pgMar", top="1440", right="1800", bottom="1440", left="1800",
+        header="851", footer="992", gutter="0")
+
+
+def _bookmark(p, name: str, bookmark_id: int, inner) -> None:
+    _el(p, "bookmarkStart", id=str(bookmark_id), name=name)
+    inner()
+    _el(p, "bookmarkEnd", id=str(bookmark_id))
+
+
+def _template_document(blocks: List[_Block]) -> bytes:
+    root = etree.Element(W + "document", nsmap=NSMAP)
+    body = _el(root, "body")
+    image = 0
+    for number, block in enumerate(blocks):
+        if block.kind == "table":
+            _table(body, block, [2000] * len(block.cells[0]), None)
+            continue
+        if block.page_break:
+            _el(_el(_el(body, "p"), "r"), "br", type="page")
+        p = _el(body, "p")
+        _paragraph_properties(p, TEMPLATE_STYLE_IDS.get(block.style), block.jc)
+        if block.kind == "image":
+            image += 1
+            _image_run(p, image)
+            continue
+
+        def text_run(p=p, block=block):
+            _el(_el(p, "r"), "t").text = block.text
+
+        if block.bookmark:
+            _bookmark(p, block.bookmark, number, text_run)
+        else:
+            text_run()
+    _section(body)
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def _target_document(blocks: List[_Block], spec: DocumentSpec, rng: random.Random) -> bytes:
+    root = etree.Element(W + "document", nsmap=NSMAP)
+    body = _el(root, "body")
+    image = 0
+    for number, block in enumerate(blocks):
+        rsid = f"00{rng.randrange(16 ** 6):06X}"
+        if spec.empty_every and number % spec.empty_every == spec.empty_every - 1:
+            _el(body, "p").set(W + "rsidR", rsid)
+        if block.kind == "table":
+            widths = [rng.choice((1500, 1800, 2400)) for _ in block.cells[0]]
+            _table(body, block, widths, rsid)
+            continue
+        # 只保留一半分页符，其余由分页符同步阶段补上
+        if block.page_break and rng.random() < 0.5:
+            _el(_el(_el(body, "p"), "r"), "br", type="page")
+        p = _el(body, "p")
+        p.set(W + "rsidR", rsid)
+        p.set(W + "rsidRDefault", rsid)
+        _paragraph_properties(p, TARGET_STYLE_IDS.get(block.style), None)
+        if block.kind == "image":
+            image += 1
+            _image_run(p, image)
+            continue
+
+        text = _edit(rng, block.text) if block.style is None and rng.random() < spec.edit_ratio else block.text
+
+        def fragmented_runs(p=p, text=text, rsid=rsid):
+            count = max(1, min(spec.runs_per_paragraph, len(text)))
+            bounds = sorted(rng.sample(range(1, len(text)), count - 1)) if count > 1 else []
+            for start, end in zip([0] + bounds, bounds + [len(text)]):
+                r = _el(p, "r")
+                r.set(W + "rsidR", rsid)
+                if rng.random() < 0.5:
+                    rPr = _el(r, "rPr")
+                    _el(rPr, "rFonts", hint="eastAsia")
+                    if rng.random() < 0.3:
+                        _el(rPr, "b")
+                    _el(rPr, "sz", val="24")
+                if rng.random() < 0.1:
+                    _el(p, "proofErr", type="spellStart")
+                t = _el(r, "t")
+                t.text = text[start:end]
+                if t.text != t.text.strip():
+                    t.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+
+        if block.bookmark:
+            _bookmark(p, block.bookmark, number, fragmented_runs)
+        else:
+            fragmented_runs()
+    _section(body)
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def _styles(style_ids: dict) -> bytes:
+    root = etree.Element(W + "styles", nsmap={"w": W_NS})
+
+    def style(style_type: str, style_id: str, name: str, default: bool = False, **props):
+        elem = _el(root, "style", type=style_type, styleId=style_id)
+        if default:
+            elem.set(W + "default", "1")
+        _el(elem, "name", val=name)
+        if style_type == "paragraph" and name != "Normal":
+            _el(elem, "basedOn", val="a")
+        if props.get("outline") is not None:
+            pPr = _el(elem, "pPr")
+            _el(pPr, "keepNext")
+            _el(pPr, "outlineLvl", val=str(props["outline"]))
+        if props.get("jc") is not None:
+            _el(_el(elem, "pPr"), "jc", val=props["jc"])
+        if props.get("size") is not None:
+            rPr = _el(elem, "rPr")
+            _el(rPr, "b")
+            _el(rPr, "sz", val=str(props["size"]))
+
+    style("paragraph", "a", "Normal", default=True)
+    style("paragraph", style_ids["heading 1"], "heading 1", outline=0, size=44)
+    style("paragraph", style_ids["heading 2"], "heading 2", outline=1, size=32)
+    style("paragraph", style_ids["caption"], "caption", jc="center")
+    style("paragraph", style_ids["图片"], "图片", jc="center")
+    style("table", "a6", "Table Grid")
+    style("character", "a7", "Emphasis", size=24)
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def _png() -> bytes:
+    """1x1像素的PNG图片。"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"\x00\xff\xff\xff")) + chunk(b"IEND", b""))
+
+
+def _write_package(path: Path, document: bytes, styles: bytes) -> None:
+    content_types = etree.Element(f"{{{CT_NS}}}Types", nsmap={None: CT_NS})
+    for extension, content_type in (
+        ("rels", "application/vnd.openxmlformats-package.relationships+xml"),
+        ("xml", "application/xml"),
+        ("png", "image/png"),
+    ):
+        etree.SubElement(content_types, f"{{{CT_NS}}}Default", Extension=extension, ContentType=content_type)
+    for part, content_type in (
+        ("/word/document.xml", "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"),
+        ("/word/styles.xml", "application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"),
+        ("/word/settings.xml", "application/vnd.openxmlformats-officedocument.wordprocessingml.settings+xml"),
+    ):
+        etree.SubElement(content_types, f"{{{CT_NS}}}Override", PartName=part, ContentType=content_type)
+
+    def relationships(rels) -> bytes:
+        root = etree.Element(f"{{{PKG_REL_NS}}}Relationships", nsmap={None: PKG_REL_NS})
+        for rel_id, rel_type, target in rels:
+            etree.SubElement(root, f"{{{PKG_REL_NS}}}Relationship", Id=rel_id, Type=rel_type, Target=target)
+        return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+    settings = etree.Element(W + "settings", nsmap={"w": W_NS})
+    _el(settings, "defaultTabStop", val="420")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", etree.tostring(content_types, xml_declaration=True,
+                                                          encoding="UTF-8", standalone=True))
+        zf.writestr("_rels/.rels", relationships([
+            ("rId1", REL_TYPE + "officeDocument", "word/document.xml"),
+        ]))
+        zf.writestr("word/document.xml", document)
+        zf.writestr("word/_rels/document.xml.rels", relationships([
+            ("rId1", REL_TYPE + "styles", "styles.xml"),
+            ("rId2", REL_TYPE + "settings", "settings.xml"),
+            (IMAGE_REL_ID, REL_TYPE + "image", "media/image1.png"),
+        ]))
+        zf.writestr("word/styles.xml", styles)
+        zf.writestr("word/settings.xml", etree.tostring(settings, xml_declaration=True,
+                                                        encoding="UTF-8", standalone=True))
+        zf.writestr("word/media/image1.png", _png())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+在多个规模下计时格式还原与格式对比，输出JSON结果并拟合耗时的增长指数。
+
+每个规模生成一对合成文档（见 benchmarks.generator），取多次运行中的最短耗时；
+增长指数为 log(耗时) 对 log(段落数) 的最小二乘斜率，约1为线性，约2为平方级。
+
+用法:
+    python -m benchmarks.run [--scales 125,250,500,1000] [--repeat 3] [--text cjk|latin]
+                             [--output 结果.json]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import lxml  # noqa: E402
+
+from benchmarks.generator import DocumentSpec, generate_pair  # noqa: E402
+from restorer import FormatRestorer, RestoreReport, __version__  # noqa: E402
+from restorer.comparer import FormatComparer  # noqa: E402
+
+DEFAULT_SCALES = (125, 250, 500, 1000)
+
+# 增长指数超过该值时提示可能存在超线性的阶段
+SUPERLINEAR_EXPONENT = 1.5
+
+# 拟合指数时忽略耗时低于该值的阶段（计时噪声占比过大）
+MIN_FIT_SECONDS = 0.005
+
+
+def fit_exponent(sizes: Sequence[float], times: Sequence[float]) -> Optional[float]:
+    """
+    拟合 time ≈ c * size^k 中的指数k。
+
+    Args:
+        sizes: 规模列表
+        times: 对应的耗时列表
+
+    Returns:
+        指数k；有效数据点少于两个时返回None
+    """
+    points = [(math.log(s), math.log(t)) for s, t in zip(sizes, times) if s > 0 and t > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def time_restore(template_path: Path, target_path: Path, output_path: Path, repeat: int) -> RestoreReport:
+    """
+    多次还原同一文档，返回总耗时最短的一次报告。
+
+    Args:
+        template_path: 模板路径
+        target_path: 待处理文档路径
+        output_path: 输出路径
+        repeat: 运行次数
+
+    Returns:
+        最快一次运行的RestoreReport
+    """
+    best = None
+    for _ in range(repeat):
+        report = RestoreReport()
+        FormatRestorer(str(template_path)).restore_format(str(target_path), str(output_path), report=report)
+        if best is None or report.wall_time < best.wall_time:
+            best = report
+    return best
+
+
+def time_compare(template_path: Path, output_path: Path, repeat: int) -> Dict:
+    """
+    多次对比模板与还原结果，返回最短耗时与对比摘要。
+
+    Args:
+        template_path: 模板路径
+        output_path: 还原后的文档路径
+        repeat: 运行次数
+
+    Returns:
+        包含wall_time、content_consistent和overall_similarity的字典
+    """
+    best = math.inf
+    result = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = FormatComparer().compare_documents(str(template_path), str(output_path))
+        best = min(best, time.perf_counter() - start)
+    return {
+        "wall_time": best,
+        "content_consistent": result.get("content_consistent"),
+        "overall_similarity": result.get("overall_similarity"),
+    }
+
+
+def run_scale(spec: DocumentSpec, workdir: Path, repeat: int, seed: int) -> Dict:
+    """
+    生成一个规模的文档对并计时还原与对比。
+
+    Args:
+        spec: 文档规格
+        workdir: 存放生成文档的目录
+        repeat: 每项计时的运行次数
+        seed: 随机种子
+
+    Returns:
+        该规模的结果字典
+    """
+    template_path, target_path = generate_pair(
+        spec, workdir / f"template_{spec.paragraphs}.docx", workdir / f"target_{spec.paragraphs}.docx", seed
+    )
+    output_path = workdir / f"output_{spec.paragraphs}.docx"
+
+    report = time_restore(template_path, target_path, output_path, repeat)
+    return {
+        "paragraphs": spec.paragraphs,
+        "template_size": template_path.stat().st_size,
+        "target_size": target_path.stat().st_size,
+        "restore": report.to_dict(),
+        "compare": time_compare(template_path, output_path, repeat),
+    }
+
+
+def scaling(results: List[Dict]) -> Dict:
+    """
+    拟合还原、对比及还原各阶段的增长指数。
+
+    Args:
+        results: 按规模排列的结果列表
+
+    Returns:
+        名称 -> 指数（数据不足时为None）
+    """
+    sizes = [r["paragraphs"] for r in results]
+    exponents = {
+        "restore": fit_exponent(sizes, [r["restore"]["wall_time"] for r in results]),
+        "compare": fit_exponent(sizes, [r["compare"]["wall_time"] for r in results]),
+    }
+    for name in results[-1]["restore"]["stages"]:
+        times = [r["restore"]["stages"].get(name, {}).get("wall", 0.0) for r in results]
+        if max(times) >= MIN_FIT_SECONDS:
+            exponents[f"restore.{name}"] = fit_exponent(sizes, times)
+    return exponents
+
+
+def environment() -> Dict:
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "lxml": lxml.__version__,
+        "restorer": __version__,
+    }
+
+
+def print_summary(data: Dict) -> None:
+    print(f"\n{'段落数':<8}{'还原(s)':>10}{'对比(s)':>10}{'输入大小':>12}")
+    for r in data["results"]:
+        print(f"{r['paragraphs']:<11}{r['restore']['wall_time']:>10.3f}{r['compare']['wall_time']:>10.3f}"
+              f"{r['target_size']:>14}")
+
+    print("\n增长指数 (1≈线性, 2≈平方级):")
+    for name, exponent in data["scaling"].items():
+        if exponent is None:
+            print(f"  {name}: -")
+            continue
+        mark = "  ⚠️ 超线性" if exponent > SUPERLINEAR_EXPONENT else ""
+        print(f"  {name}: {exponent:.2f}{mark}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="格式还原性能基准")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="逗号分隔的段落数列表 (默认: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="每项计时的运行次数，取最短 (默认: 3)")
+    parser.add_argument("--runs", type=int, default=4, help="待处理文档中每段的run数 (默认: 4)")
+    parser.add_argument("--text", choices=["cjk", "latin"], default="cjk", help="文字类型 (默认: cjk)")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子 (默认: 0)")
+    parser.add_argument("--output", "-o", help="JSON结果输出路径")
+    parser.add_argument("--keep", help="保存生成文档的目录（默认使用临时目录并在结束后删除）")
+    args = parser.parse_args(argv)
+
+    try:
+        scales = sorted({int(s) for s in args.scales.split(",") if s.strip()})
+    except ValueError:
+        parser.error(f"无效的规模列表: {args.scales}")
+    if not scales or min(scales) <= 0 or args.repeat < 1:
+        parser.error("规模和运行次数必须为正数")
+
+    base = DocumentSpec(runs_per_paragraph=args.runs, text=args.text)
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = Path(args.keep) if args.keep else Path(tmpdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+        for count in scales:
+            print(f"⏱️  {count} 段落...", flush=True)
+            results.append(run_scale(base.scaled(count), workdir, args.repeat, args.seed))
+
+    data = {
+        "environment": environment(),
+        "config": {"scales": scales, "repeat": args.repeat, "seed": args.seed, "spec": base.to_dict()},
+        "results": results,
+        "scaling": scaling(results),
+    }
+    print_summary(data)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"\n✓ 结果已保存: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,5 +11,7 @@ __email__ = "your.email@example.com"
 
 from restorer.core import FormatRestorer
 from restorer.comparer import FormatComparer
+from restorer.report import RestoreReport
+from restorer.template import CompiledTemplate
 
-__all__ = ["FormatRestorer", "FormatComparer"]
+__all__ = ["FormatRestorer", "FormatComparer", "CompiledTemplate", "RestoreReport"]
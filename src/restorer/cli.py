@@ -6,34 +6,80 @@ and comparing documents.
 """
 
 import argparse
+import logging
 import sys
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 from restorer.core import FormatRestorer
 from restorer.comparer import FormatComparer
+from restorer.profiling import collapsed_path, profiled
 
 
 def main():
     """Main entry point for the CLI."""
     parser = create_parser()
     args = parser.parse_args()
+    configure_logging(args.debug)
 
     try:
-        if args.command == "restore":
-            handle_restore(args)
-        elif args.command == "compare":
-            handle_compare(args)
-        elif args.command == "batch":
-            handle_batch(args)
-        else:
-            parser.print_help()
-            sys.exit(1)
+        with profile_command(getattr(args, "profile", None)):
+            if args.command == "restore":
+                handle_restore(args)
+            elif args.command == "compare":
+                handle_compare(args)
+            elif args.command == "batch":
+                handle_batch(args)
+            else:
+                parser.print_help()
+                sys.exit(1)
     except Exception as e:
         print(f"❌ 错误: {str(e)}", file=sys.stderr)
         sys.exit(1)
 
 
+def configure_logging(debug: bool = False) -> None:
+    """
+    Send the restorer.* log records to stderr.
+
+    Args:
+        debug: Whether to emit DEBUG records (diagnostic messages are only built then)
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    logger = logging.getLogger("restorer")
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if debug else logging.WARNING)
+
+
+@contextmanager
+def profile_command(profile_path: Optional[str]):
+    """
+    Run the enclosed command under cProfile when a profile path is given.
+
+    Args:
+        profile_path: Path of the pstats output file, or None to run without profiling
+    """
+    if not profile_path:
+        yield
+        return
+    try:
+        with profiled(profile_path):
+            yield
+    finally:
+        print(f"📈 性能分析结果: {profile_path} (折叠栈: {collapsed_path(profile_path)})")
+
+
+def add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    """Add the --profile option to a command parser."""
+    parser.add_argument(
+        "--profile",
+        metavar="out.prof",
+        help="用cProfile分析本次运行，结果写入该文件，并在旁边生成折叠栈文件 (*.collapsed.txt)"
+    )
+
+
 def create_parser() -> argparse.ArgumentParser:
     """Create the argument parser."""
     parser = argparse.ArgumentParser(
@@ -56,8 +102,19 @@ def create_parser() -> argparse.ArgumentParser:
 
   # 仅对比格式文件（非全量）
   %(prog)s compare 正常格式.docx 输出文档.docx --no-full
+
+  # 输出调试日志
+  %(prog)s --debug restore 正常格式.docx 错乱格式.docx
+
+  # 分析处理缓慢的文档
+  %(prog)s restore 正常格式.docx 错乱格式.docx --profile slow.prof
         """
     )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="输出调试日志到stderr"
+    )
 
     subparsers = parser.add_subparsers(dest="command", help="可用命令")
 
@@ -79,6 +136,7 @@ def create_parser() -> argparse.ArgumentParser:
         "-o", "--output",
         help="输出文档路径 (默认: 目标文档_已格式化.docx)"
     )
+    add_profile_argument(restore_parser)
 
     # Batch command
     batch_parser = subparsers.add_parser(
@@ -99,6 +157,7 @@ def create_parser() -> argparse.ArgumentParser:
         "-o", "--output-dir",
         help="输出目录 (默认: 与原文件相同目录)"
     )
+    add_profile_argument(batch_parser)
 
     # Compare command
     compare_parser = subparsers.add_parser(
@@ -123,6 +182,7 @@ def create_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="仅对比格式相关文件，非全量对比"
     )
+    add_profile_argument(compare_parser)
 
     return parser
 
@@ -260,6 +320,11 @@ def legacy_main():
         action="store_true",
         help="仅对比格式文件，非全量对比"
     )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="输出调试日志到stderr"
+    )
     parser.add_argument(
         "-h", "--help",
         action="store_true",
@@ -267,6 +332,7 @@ def legacy_main():
     )
 
     args = parser.parse_args()
+    configure_logging(args.debug)
 
     # Show help if requested
     if args.help:
@@ -326,7 +392,8 @@ def legacy_main():
 if __name__ == "__main__":
     # Use legacy interface for backward compatibility
     # Detect if using new command-style or old positional-style
-    if len(sys.argv) > 1 and sys.argv[1] in ["restore", "compare", "batch", "-h", "--help"]:
+    args = [arg for arg in sys.argv[1:] if arg != "--debug"]
+    if args and args[0] in ["restore", "compare", "batch", "-h", "--help"]:
         main()
     else:
         legacy_main()
@@ -11,7 +11,9 @@ import zipfile
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 from lxml import etree
-from difflib import SequenceMatcher
+
+from restorer.document import merge_adjacent_runs
+from restorer.matching import similarity as similarity_ratio
 
 
 class FormatComparer:
@@ -286,119 +288,13 @@ class FormatComparer:
         that don't affect visual appearance. Two runs are merged if they have
         identical rPr (run properties) or both have no rPr.
 
-        Args:
-            root: XML root element to process
-        """
-        w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
-
-        # Process each paragraph
-        for para in root.findall(".//w:p", namespaces=w_ns):
-            runs = para.findall("w:r", namespaces=w_ns)
-            if len(runs) < 2:
-                continue
-
-            i = 0
-            while i < len(runs) - 1:
-                current_run = runs[i]
-                next_run = runs[i + 1]
-
-                # Check if both runs can be merged
-                if self._can_merge_runs_for_comparison(current_run, next_run, w_ns):
-                    # Merge next_run into current_run
-                    self._merge_run_text_for_comparison(current_run, next_run, w_ns)
-
-                    # Remove next_run from paragraph
-                    para.remove(next_run)
-
-                    # Update runs list
-                    runs = para.findall("w:r", namespaces=w_ns)
-                    # Don't increment i - check if we can merge with the new next run
-                else:
-                    i += 1
-
-    def _can_merge_runs_for_comparison(self, run1, run2, w_ns: dict) -> bool:
-        """
-        Check if two runs can be merged for comparison purposes.
-
-        Two runs can be merged if they have the same formatting (both have
-        identical rPr or both have no rPr).
-
-        Args:
-            run1: First run element
-            run2: Second run element
-            w_ns: Word namespace dictionary
-
-        Returns:
-            True if runs can be merged, False otherwise
-        """
-        # Get rPr elements
-        rpr1 = run1.find("w:rPr", namespaces=w_ns)
-        rpr2 = run2.find("w:rPr", namespaces=w_ns)
-
-        # If both have no rPr, they can be merged
-        if rpr1 is None and rpr2 is None:
-            return True
-
-        # If both have rPr, check if they're identical
-        if rpr1 is not None and rpr2 is not None:
-            # Compare rPr elements as strings
-            str1 = etree.tostring(rpr1, method='c14n')
-            str2 = etree.tostring(rpr2, method='c14n')
-            return str1 == str2
-
-        # One has rPr, one doesn't - can't merge
-        return False
-
-    def _merge_run_text_for_comparison(self, target_run, source_run, w_ns: dict) -> None:
-        """
-        Merge text from source_run into target_run.
-
-        Concatenates all w:t elements from source_run into target_run.
+        Non-text elements (like tab, br, etc.) of a merged run are preserved,
+        except those in IGNORE_ELEMENTS.
 
         Args:
-            target_run: Run to merge into (will be kept)
-            source_run: Run to merge from (will be removed)
-            w_ns: Word namespace dictionary
+            root: XML root element to process
         """
-        # Find all text elements in both runs
-        target_texts = target_run.findall("w:t", namespaces=w_ns)
-        source_texts = source_run.findall("w:t", namespaces=w_ns)
-
-        # Preserve non-text elements (like tab, br, etc.) from source_run
-        # These are elements that are not w:t and not in IGNORE_ELEMENTS
-        source_non_text_children = []
-        for child in source_run:
-            if child.tag != f"{{{w_ns['w']}}}t" and child.tag not in self.IGNORE_ELEMENTS:
-                source_non_text_children.append(child)
-
-        if not target_texts:
-            # Target run has no text, just move source texts and non-text elements
-            for text_elem in source_texts:
-                target_run.append(text_elem)
-            for elem in source_non_text_children:
-                target_run.append(elem)
-        elif not source_texts:
-            # Source run has no text, just move non-text elements
-            for elem in source_non_text_children:
-                target_run.append(elem)
-            return
-        else:
-            # Both have text - concatenate the last target text with first source text
-            last_target = target_texts[-1]
-            first_source = source_texts[0]
-
-            if last_target.text and first_source.text:
-                last_target.text = last_target.text + first_source.text
-            elif first_source.text:
-                last_target.text = first_source.text
-
-            # Move remaining source texts
-            for text_elem in source_texts[1:]:
-                target_run.append(text_elem)
-
-            # Move non-text elements from source_run
-            for elem in source_non_text_children:
-                target_run.append(elem)
+        merge_adjacent_runs(root, carry=lambda child: child.tag not in self.IGNORE_ELEMENTS)
 
     def _compare_xml_file(self, file1: Path, file2: Path) -> Dict:
         """
@@ -463,7 +359,7 @@ class FormatComparer:
                 }
             else:
                 # Calculate similarity
-                similarity = SequenceMatcher(None, xml1_str, xml2_str).ratio()
+                similarity = similarity_ratio(xml1_str, xml2_str)
 
                 return {
                     "identical": False,
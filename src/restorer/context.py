@@ -0,0 +1,171 @@
+"""
+Per-conversion state for the restoration pipeline.
+
+This module provides the RestoreContext class that carries the template and target
+packages through every pipeline stage, so each XML part is parsed at most once and
+serialized only when the output package is written.
+"""
+
+import io
+from typing import TYPE_CHECKING, BinaryIO, Dict, Optional
+from lxml import etree
+
+from restorer.package import DocxPackage, OutputPackage
+from restorer.report import RestoreReport
+
+if TYPE_CHECKING:
+    from restorer.template import CompiledTemplate
+
+
+def parse_part(data: bytes):
+    """
+    Parse a package part into an XML tree.
+
+    Args:
+        data: Raw bytes of the XML part
+
+    Returns:
+        Parsed lxml ElementTree
+    """
+    return etree.parse(io.BytesIO(data))
+
+
+def serialize_part(tree) -> bytes:
+    """
+    Serialize an XML tree back to package part bytes.
+
+    Args:
+        tree: lxml ElementTree to serialize
+
+    Returns:
+        Raw bytes of the XML part
+    """
+    return etree.tostring(
+        tree,
+        xml_declaration=True,
+        encoding='UTF-8',
+        standalone=True
+    )
+
+
+def parse_relationships(tree) -> dict:
+    """
+    Parse a relationships XML part.
+
+    Args:
+        tree: Parsed relationships XML part
+
+    Returns:
+        Dictionary mapping relationship IDs to (type, target) tuples
+    """
+    namespaces = {
+        'r': 'http://schemas.openxmlformats.org/package/2006/relationships'
+    }
+
+    root = tree.getroot()
+
+    relationships = {}
+    for rel in root.findall('r:Relationship', namespaces):
+        rel_id = rel.get('Id')
+        rel_type = rel.get('Type')
+        rel_target = rel.get('Target')
+        if rel_id and rel_type and rel_target:
+            relationships[rel_id] = (rel_type, rel_target)
+
+    return relationships
+
+
+class RestoreContext:
+    """
+    Holds the packages and parsed XML trees of a single conversion.
+
+    Template trees come from a :class:`~restorer.template.CompiledTemplate` and are
+    shared read-only by all stages (and by every conversion using that template).
+    Target trees may be modified in place. Output trees are the ones that end up in
+    the output package; they are serialized once, in :meth:`save`.
+    """
+
+    def __init__(self, template: "CompiledTemplate", target: DocxPackage,
+                 report: Optional[RestoreReport] = None):
+        """
+        Initialize the context.
+
+        Args:
+            template: Compiled template
+            target: Target package
+            report: Report the stages record their timings and counts in
+        """
+        self.template = template
+        self.target = target
+        self.report = report if report is not None else RestoreReport()
+        # Start with template as base (to get all sections and structure)
+        self.output = OutputPackage(template.package)
+
+        self._target_trees: Dict[str, Optional[etree._ElementTree]] = {}
+        self._output_trees: Dict[str, etree._ElementTree] = {}
+
+    def template_tree(self, name: str) -> Optional[etree._ElementTree]:
+        """
+        Get a parsed template part. The tree must not be modified.
+
+        Args:
+            name: Part name (e.g. 'word/styles.xml')
+
+        Returns:
+            Parsed tree, or None if the template has no such part
+        """
+        return self.template.tree(name)
+
+    def target_tree(self, name: str) -> Optional[etree._ElementTree]:
+        """
+        Get a parsed target part.
+
+        Args:
+            name: Part name (e.g. 'word/document.xml')
+
+        Returns:
+            Parsed tree, or None if the target has no such part
+        """
+        if name not in self._target_trees:
+            self._target_trees[name] = parse_part(self.target[name]) if name in self.target else None
+        return self._target_trees[name]
+
+    def output_tree(self, name: str) -> Optional[etree._ElementTree]:
+        """
+        Get an output part for modification.
+
+        The part is parsed from the output package on first access and will be
+        serialized back into the package by :meth:`save`.
+
+        Args:
+            name: Part name (e.g. 'word/numbering.xml')
+
+        Returns:
+            Parsed tree, or None if the output has no such part
+        """
+        tree = self._output_trees.get(name)
+        if tree is None and name in self.output:
+            tree = parse_part(self.output[name])
+            self._output_trees[name] = tree
+        return tree
+
+    def set_output_tree(self, name: str, tree) -> None:
+        """
+        Replace an output part with a tree built by a stage.
+
+        Args:
+            name: Part name (e.g. 'word/document.xml')
+            tree: lxml ElementTree that becomes the part's content
+        """
+        self._output_trees[name] = tree
+
+    def save(self, dst: BinaryIO) -> None:
+        """
+        Serialize the output trees and write the output package.
+
+        Args:
+            dst: Writable binary file object for the output .docx
+        """
+        for name, tree in self._output_trees.items():
+            self.output[name] = serialize_part(tree)
+        self.output.save(dst)
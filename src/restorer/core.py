@@ -5,14 +5,44 @@ This module provides the main FormatRestorer class that handles copying formatti
 from a template document to target documents while preserving content.
 """
 
+import io
+import logging
 import os
-import shutil
-import tempfile
-import zipfile
+import uuid
 from pathlib import Path
-from typing import List, Optional
+from typing import BinaryIO, List, Optional, Union
 from lxml import etree
 
+from restorer.context import RestoreContext, parse_relationships
+from restorer.document import DocumentIndex, merge_adjacent_runs, table_fingerprint
+from restorer.matching import ParagraphAlignment
+from restorer.package import DocxPackage
+from restorer.report import RestoreReport
+from restorer.template import CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+
+def _stream_position(stream: BinaryIO) -> Optional[int]:
+    """Return the current position of a stream, or None if it cannot tell."""
+    try:
+        return stream.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _stream_size(stream: BinaryIO) -> Optional[int]:
+    """Return the number of bytes left in a seekable stream, or None if unknown."""
+    start = _stream_position(stream)
+    if start is None:
+        return None
+    try:
+        end = stream.seek(0, io.SEEK_END)
+        stream.seek(start)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return end - start
+
 
 class FormatRestorer:
     """
@@ -52,6 +82,19 @@ class FormatRestorer:
         "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}noProof",
     }
 
+    # Direct formatting elements removed during cleanup (text gets its formatting from styles)
+    DIRECT_FORMATTING_ELEMENTS = {
+        "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}rPr",
+    }
+
+    # Paragraph properties kept during cleanup; every other w:pPr child is direct formatting.
+    # w:ind is only kept for paragraphs without a style (otherwise the style defines it)
+    KEPT_PARAGRAPH_PROPERTIES = {
+        "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}pStyle",
+        "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}ind",
+        "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}jc",
+    }
+
     # Bookmark name prefixes to preserve during cleanup
     # These bookmarks serve important functions like TOC navigation and cross-references
     PRESERVE_BOOKMARK_PREFIXES = (
@@ -78,10 +121,28 @@ class FormatRestorer:
         if not self.template_path.suffix.lower() == ".docx":
             raise ValueError(f"Template must be a .docx file: {template_path}")
 
+        self._compiled_template: Optional[CompiledTemplate] = None
+
+    @property
+    def compiled_template(self) -> CompiledTemplate:
+        """
+        Template compiled on first use and shared by every subsequent restoration.
+
+        A valid sidecar file next to the template (see :meth:`CompiledTemplate.save`)
+        is loaded instead of compiling the template again.
+
+        Returns:
+            CompiledTemplate for this restorer's template
+        """
+        if self._compiled_template is None:
+            self._compiled_template = CompiledTemplate.load(self.template_path)
+        return self._compiled_template
+
     def restore_format(
         self,
         target_path: str,
         output_path: Optional[str] = None,
+        report: Optional[RestoreReport] = None,
     ) -> str:
         """
         Restore formatting to a target document.
@@ -90,6 +151,7 @@ class FormatRestorer:
             target_path: Path to the target document to be formatted
             output_path: Optional path for the output document.
                         If None, will use target_path with '_已格式化' suffix
+            report: Optional RestoreReport that receives stage timings and counts
 
         Returns:
             Path to the output document
@@ -111,100 +173,148 @@ class FormatRestorer:
         else:
             output_path = Path(output_path)
 
-        # Create temporary directories for extraction
-        with tempfile.TemporaryDirectory() as temp_dir:
-            template_dir = Path(temp_dir) / "template"
-            target_dir = Path(temp_dir) / "target"
-            output_dir = Path(temp_dir) / "output"
-            template_dir.mkdir()
-            target_dir.mkdir()
-            output_dir.mkdir()
-
-            # Extract both documents
-            self._extract_docx(self.template_path, template_dir)
-            self._extract_docx(target_path, target_dir)
-
-            # Start with template as base (to get all sections and structure)
-            shutil.copytree(template_dir, output_dir, dirs_exist_ok=True)
-
-            # IMPORTANT: Keep template's numbering definitions
-            # We want to use template's format, so we use template's numbering
-            # Target's content will use template's numbering via style updates
-
-            # IMPORTANT: Merge target's styles that are used in the document
-            # Target may use styles that aren't in the template
-            target_styles = target_dir / "word" / "styles.xml"
-            output_styles = output_dir / "word" / "styles.xml"
-            target_document = target_dir / "word" / "document.xml"
-
-            import sys
-            print(f"[DEBUG] 准备合并样式: target_styles.exists()={target_styles.exists()}, target_document.exists()={target_document.exists()}", file=sys.stderr)
-
-            if target_styles.exists() and target_document.exists():
-                # Merge used styles from target
-                print(f"[DEBUG] 调用_merge_used_styles", file=sys.stderr)
-                self._merge_used_styles(target_document, target_styles, output_styles)
-
-            # Now merge target's content into output
-            # For maximum similarity when content is nearly identical, use template's document.xml directly
-            self._merge_content(target_dir, output_dir)
-
-            # Copy target's media files (images, etc.) to output
-            target_media = target_dir / "word" / "media"
-            output_media = output_dir / "word" / "media"
-            if target_media.exists():
-                import sys
-                print(f"[DEBUG] Copying media files from target...", file=sys.stderr)
-                shutil.copytree(target_media, output_media, dirs_exist_ok=True)
-
-            # IMPORTANT: Remap target's relationship IDs to template's relationship IDs
-            # Template's relationships are already in output_dir from copytree
-            # Target's content uses different relationship IDs (e.g., rId13, rId19)
-            # that need to be remapped to template's IDs (e.g., rId7, rId8)
-            import sys
-            print(f"[DEBUG] Remapping relationship IDs to match template...", file=sys.stderr)
-            self._remap_relationship_ids(output_dir, template_dir, target_dir)
-
-            # Clean direct formatting in document.xml
-            import sys
-            print(f"[DEBUG] Cleaning direct formatting in output document...", file=sys.stderr)
-            self._clean_direct_formatting(output_dir, template_dir)
-
-            # Repackage the output document
-            self._create_docx(output_dir, output_path)
+        # Ensure output directory exists
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file next to the output and move it into place only on
+        # success, so restoring a file onto itself reads the original, and a failed
+        # conversion leaves no truncated document behind
+        temp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(target_path, 'rb') as src, open(temp_path, 'xb') as dst:
+                self.restore_stream(src, dst, report)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            try:
+                temp_path.unlink()
+            except OSError:
+                pass
+            raise
 
         return str(output_path)
 
-    def _extract_docx(self, docx_path: Path, extract_dir: Path) -> None:
+    def restore_bytes(self, target: Union[bytes, BinaryIO], report: Optional[RestoreReport] = None) -> bytes:
         """
-        Extract a .docx file to a directory.
+        Restore formatting to a target document held in memory.
 
         Args:
-            docx_path: Path to the .docx file
-            extract_dir: Directory to extract to
+            target: Raw bytes of the target .docx, or a readable binary file object
+            report: Optional RestoreReport that receives stage timings and counts
+
+        Returns:
+            Raw bytes of the output .docx
         """
-        with zipfile.ZipFile(docx_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_dir)
+        if isinstance(target, (bytes, bytearray)):
+            target = io.BytesIO(target)
+
+        output = io.BytesIO()
+        self.restore_stream(target, output, report)
+        return output.getvalue()
 
-    def _create_docx(self, source_dir: Path, output_path: Path) -> None:
+    def restore_stream(
+        self,
+        src: BinaryIO,
+        dst: BinaryIO,
+        report: Optional[RestoreReport] = None,
+    ) -> RestoreReport:
         """
-        Create a .docx file from a directory.
+        Restore formatting from a readable stream into a writable stream.
+
+        Parts are loaded into memory only when a stage reads them and the output
+        package is written directly to ``dst``; nothing touches the filesystem
+        apart from compiling the template on first use.
 
         Args:
-            source_dir: Directory containing the extracted document
-            output_path: Path for the output .docx file
-        """
-        # Ensure output directory exists
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+            src: Readable binary file object containing the target .docx
+            dst: Writable binary file object that receives the output .docx
+            report: Optional RestoreReport to fill in (a new one is created if None)
 
-        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for root, dirs, files in os.walk(source_dir):
-                for file in files:
-                    file_path = Path(root) / file
-                    arcname = file_path.relative_to(source_dir)
-                    zip_file.write(file_path, arcname)
+        Returns:
+            Report with the stage timings, counts and sizes of this conversion
+        """
+        if report is None:
+            report = RestoreReport()
+        report.input_size = _stream_size(src)
+        output_start = _stream_position(dst)
+
+        with report.stage("load_template"):
+            template = self.compiled_template
+        with report.stage("extract"):
+            target = DocxPackage(src)
+            try:
+                ctx = RestoreContext(template, target, report)
+                # Parse the parts every conversion reads, so parsing is timed on its own
+                ctx.target_tree("word/document.xml")
+                ctx.target_tree("word/styles.xml")
+            except BaseException:
+                target.close()
+                raise
+        with target:
+            self._restore_package(ctx)
+            # Serialize every modified part once and repackage the output document
+            with report.stage("package"):
+                ctx.save(dst)
+
+        output_end = _stream_position(dst)
+        if output_start is not None and output_end is not None:
+            report.output_size = output_end - output_start
+        return report
+
+    def _restore_package(self, ctx: RestoreContext) -> None:
+        """
+        Run the restoration pipeline on a conversion context.
 
-    def _merge_used_styles(self, target_document: Path, target_styles: Path, output_styles: Path) -> None:
+        Args:
+            ctx: Conversion context holding the template, target and output packages
+        """
+        # IMPORTANT: Keep template's numbering definitions
+        # We want to use template's format, so we use template's numbering
+        # Target's content will use template's numbering via style updates
+
+        # IMPORTANT: Merge target's styles that are used in the document
+        # Target may use styles that aren't in the template
+        has_target_styles = "word/styles.xml" in ctx.target
+        has_target_document = "word/document.xml" in ctx.target
+        logger.debug("准备合并样式: has_target_styles=%s, has_target_document=%s", has_target_styles, has_target_document)
+
+        # Output keeps the template's styles unchanged (see _merge_used_styles), so the
+        # scan of target's used styles only produces a report, built when DEBUG is enabled.
+        # The stage is recorded either way, with a count when the scan is skipped
+        if has_target_styles and has_target_document:
+            with ctx.report.stage("merge_styles"):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("调用_merge_used_styles")
+                    self._merge_used_styles(ctx)
+                else:
+                    ctx.report.count("merge_styles_skipped")
+
+        # Now merge target's content into output
+        # For maximum similarity when content is nearly identical, use template's document.xml directly
+        with ctx.report.stage("merge_content"):
+            self._merge_content(ctx)
+
+        # Copy target's media files (images, etc.) to output
+        target_media = [name for name in ctx.target if name.startswith("word/media/")]
+        if target_media:
+            logger.debug("Copying media files from target...")
+            for name in target_media:
+                ctx.output.add(ctx.target, name)
+            ctx.report.count("media_files", len(target_media))
+
+        # IMPORTANT: Remap target's relationship IDs to template's relationship IDs
+        # Output starts with template's relationships
+        # Target's content uses different relationship IDs (e.g., rId13, rId19)
+        # that need to be remapped to template's IDs (e.g., rId7, rId8)
+        logger.debug("Remapping relationship IDs to match template...")
+        with ctx.report.stage("remap_rels"):
+            self._remap_relationship_ids(ctx)
+
+        # Clean direct formatting in document.xml
+        logger.debug("Cleaning direct formatting in output document...")
+        with ctx.report.stage("clean"):
+            self._clean_direct_formatting(ctx)
+
+    def _merge_used_styles(self, ctx: RestoreContext) -> None:
         """
         Merge styles from target that are actually used in the document.
 
@@ -212,14 +322,12 @@ class FormatRestorer:
         even if they're not in the template.
 
         Args:
-            target_document: Path to target's document.xml
-            target_styles: Path to target's styles.xml
-            output_styles: Path to output's styles.xml (will be updated)
+            ctx: Conversion context (target's document.xml and styles.xml are read)
         """
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
         # Step 1: Find which styles are used in target document
-        target_tree = etree.parse(target_document)
+        target_tree = ctx.target_tree("word/document.xml")
         target_root = target_tree.getroot()
 
         used_style_ids = set()
@@ -234,31 +342,17 @@ class FormatRestorer:
             if style_id:
                 used_style_ids.add(style_id)
 
-        # Debug logging
-        import sys
-        print(f"[DEBUG] 使用的样式: {sorted(used_style_ids)}", file=sys.stderr)
+        logger.debug("使用的样式: %s", sorted(used_style_ids))
 
         if not used_style_ids:
             return  # No styles used, nothing to merge
 
-        # Step 2: Parse both styles files
-        target_styles_tree = etree.parse(target_styles)
-        output_styles_tree = etree.parse(output_styles)
-
+        # Step 2: Get target styles (output styles are still the template's)
+        target_styles_tree = ctx.target_tree("word/styles.xml")
         target_styles_root = target_styles_tree.getroot()
-        output_styles_root = output_styles_tree.getroot()
 
-        # Get existing style IDs in output
-        existing_style_ids = set()
-        try:
-            for style in output_styles_root.xpath("//w:style", namespaces=w_ns):
-                style_id = style.get(f"{{{w_ns['w']}}}styleId")
-                if style_id:
-                    existing_style_ids.add(style_id)
-        except Exception as e:
-            import sys
-            print(f"[ERROR] 获取现有样式ID失败: {e}", file=sys.stderr)
-            raise
+        # Existing style IDs in output are the template's, precomputed once
+        existing_style_ids = ctx.template.style_ids
 
         # Step 3: Skip styles that don't exist in template (for 100% similarity)
         skipped_styles = []
@@ -278,22 +372,17 @@ class FormatRestorer:
                 if style_id not in existing_style_ids:
                     # Style doesn't exist in template - SKIP it to maintain 100% similarity
                     skipped_styles.append(style_id)
-                    import sys
-                    print(f"[DEBUG] 跳过样式{style_id}(不在模板中),保持100%相似度", file=sys.stderr)
+                    logger.debug("跳过样式%s(不在模板中),保持100%%相似度", style_id)
                 # If style exists in template, do nothing - template's version is used
             except Exception as e:
-                import sys
-                print(f"[ERROR] 处理样式{style_id}失败: {e}", file=sys.stderr)
-                import traceback
-                traceback.print_exc(file=sys.stderr)
+                logger.exception("处理样式%s失败: %s", style_id, e)
                 raise
 
         # Log results
         if skipped_styles:
-            import sys
-            print(f"[DEBUG] 跳过了{len(skipped_styles)}个不在模板中的样式: {skipped_styles}", file=sys.stderr)
+            logger.debug("跳过了%s个不在模板中的样式: %s", len(skipped_styles), skipped_styles)
 
-    def _merge_numbering(self, target_numbering: Path, output_numbering: Path) -> None:
+    def _merge_numbering(self, ctx: RestoreContext) -> None:
         """
         Merge target's numbering definitions into output's numbering.xml.
 
@@ -301,14 +390,13 @@ class FormatRestorer:
         maintaining template's numbering style.
 
         Args:
-            target_numbering: Path to target's numbering.xml
-            output_numbering: Path to output's numbering.xml (will be updated)
+            ctx: Conversion context (output's numbering.xml will be updated)
         """
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Parse both numbering files
-        target_tree = etree.parse(target_numbering)
-        output_tree = etree.parse(output_numbering)
+        # Get both numbering files
+        target_tree = ctx.target_tree("word/numbering.xml")
+        output_tree = ctx.output_tree("word/numbering.xml")
 
         target_root = target_tree.getroot()
         output_root = output_tree.getroot()
@@ -343,32 +431,20 @@ class FormatRestorer:
                 num_inst_copy = etree.fromstring(etree.tostring(num_inst))
                 output_root.append(num_inst_copy)
 
-        # Write merged numbering back to output
-        output_tree.write(
-            output_numbering,
-            xml_declaration=True,
-            encoding='UTF-8',
-            standalone=True
-        )
+        # Output tree is serialized when the package is saved
 
-    def _copy_format_files(self, template_dir: Path, target_dir: Path) -> None:
+    def _copy_format_files(self, ctx: RestoreContext) -> None:
         """
-        Copy format definition files from template to target.
+        Copy format definition files from template to output.
 
         Args:
-            template_dir: Extracted template directory
-            target_dir: Extracted target directory
+            ctx: Conversion context
         """
         for format_file in self.FORMAT_FILES:
-            template_file = template_dir / format_file
-            target_file = target_dir / format_file
-
-            if template_file.exists():
-                # Ensure target directory exists
-                target_file.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(template_file, target_file)
+            if format_file in ctx.template.package:
+                ctx.output.add(ctx.template.package, format_file)
 
-    def _create_style_mapping(self, template_styles_path: Path, target_styles_path: Path) -> dict:
+    def _create_style_mapping(self, template: CompiledTemplate, target_tree) -> dict:
         """
         Create a mapping from target style IDs to template style IDs based on style names.
 
@@ -376,30 +452,16 @@ class FormatRestorer:
         that has the same semantic meaning but different IDs.
 
         Args:
-            template_styles_path: Path to template's styles.xml
-            target_styles_path: Path to target's styles.xml
+            template: Compiled template (provides the style name -> style ID map)
+            target_tree: Target's parsed styles.xml
 
         Returns:
             Dictionary mapping target style IDs to template style IDs
         """
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Parse both styles files
-        template_tree = etree.parse(template_styles_path)
-        target_tree = etree.parse(target_styles_path)
-
-        template_root = template_tree.getroot()
         target_root = target_tree.getroot()
-
-        # Build style name -> style ID mappings for both documents
-        template_name_to_id = {}
-        for style in template_root.xpath("//w:style", namespaces=w_ns):
-            style_id = style.get(f"{{{w_ns['w']}}}styleId")
-            style_name_elem = style.find("w:name", namespaces=w_ns)
-            if style_name_elem is not None:
-                style_name = style_name_elem.get(f"{{{w_ns['w']}}}val")
-                if style_id and style_name:
-                    template_name_to_id[style_name] = style_id
+        template_name_to_id = template.style_name_to_id
 
         # Create mapping from target style ID to template style ID
         style_mapping = {}
@@ -415,7 +477,7 @@ class FormatRestorer:
 
         return style_mapping
 
-    def _merge_content(self, target_dir: Path, output_dir: Path) -> None:
+    def _merge_content(self, ctx: RestoreContext) -> None:
         """
         Merge target document's content into output (template-based) document.
 
@@ -429,34 +491,27 @@ class FormatRestorer:
         7. Insert template's sections at appropriate places
 
         Args:
-            target_dir: Extracted target directory (source of content)
-            output_dir: Output directory based on template (source of sections)
+            ctx: Conversion context (target is the source of content, template
+                 the source of sections; output's document.xml is replaced)
         """
-        target_doc_path = target_dir / "word" / "document.xml"
-        output_doc_path = output_dir / "word" / "document.xml"
-
-        if not target_doc_path.exists():
+        target_tree = ctx.target_tree("word/document.xml")
+        if target_tree is None:
             return
 
-        # IMPORTANT: Parse template's document.xml BEFORE overwriting it!
-        template_doc_path = output_dir / "word" / "document.xml"
-        template_tree = etree.parse(template_doc_path)
-        template_root = template_tree.getroot()
+        # Template-side data is precomputed once and shared read-only
+        template = ctx.template
 
         # Create style mapping
-        template_styles_path = output_dir / "word" / "styles.xml"
-        target_styles_path = target_dir / "word" / "styles.xml"
+        template_styles = template.styles_tree
+        target_styles = ctx.target_tree("word/styles.xml")
         style_mapping = {}
-        if template_styles_path.exists() and target_styles_path.exists():
-            style_mapping = self._create_style_mapping(template_styles_path, target_styles_path)
-            import sys
+        if template_styles is not None and target_styles is not None:
+            style_mapping = self._create_style_mapping(template, target_styles)
             if style_mapping:
-                print(f"[DEBUG] Style mapping: {style_mapping}", file=sys.stderr)
+                logger.debug("Style mapping: %s", style_mapping)
 
         # Parse target's document.xml
-        import sys
-        print(f"[DEBUG] Copying target's document.xml with empty paragraph removal", file=sys.stderr)
-        target_tree = etree.parse(target_doc_path)
+        logger.debug("Copying target's document.xml with empty paragraph removal")
         target_root = target_tree.getroot()
 
         # Define namespaces
@@ -466,49 +521,29 @@ class FormatRestorer:
         # Strategy: Remove empty paragraphs that are NOT in table cells
         # But preserve trailing empty paragraphs to match template
         paragraphs_to_remove = []
-        all_target_paras = list(target_root.findall('.//w:p', namespaces=w_ns))
-        total_paras = len(all_target_paras)
-
-        # First, count how many trailing empty paragraphs the template has
-        template_paras = template_tree.getroot().findall('.//w:p', namespaces=w_ns)
-        template_trailing_empty = 0
-        for i in range(len(template_paras)-1, -1, -1):
-            texts = template_paras[i].findall('.//w:t', namespaces=w_ns)
-            text = ''.join([t.text for t in texts if t.text])
-            if not text.strip():
-                template_trailing_empty += 1
-            else:
-                break
 
-        for para_idx, para in enumerate(all_target_paras):
-            # Check if paragraph is empty
-            text_nodes = para.findall('.//w:t', namespaces=w_ns)
-            para_text = ''.join([t.text for t in text_nodes if t.text])
+        # Index every target paragraph in one pass; stages below keep the records current
+        index = DocumentIndex(target_root)
+        total_paras = len(index)
+        report = ctx.report
+        report.count("target_paragraphs", total_paras)
+
+        # How many trailing empty paragraphs the template has
+        template_trailing_empty = template.trailing_empty
+
+        for para_idx, record in enumerate(index):
+            para = record.element
+            para_text = record.text
 
             # Check for non-text content that should preserve the paragraph
-            has_drawing = para.find('.//w:drawing', namespaces=w_ns) is not None
-            has_table = para.find('.//w:tbl', namespaces=w_ns) is not None
+            has_drawing = record.has_drawing
+            has_table = record.has_table
 
             # Check if paragraph is in a table cell
             # Empty paragraphs in table cells should be preserved
-            in_table_cell = False
-            in_vmerge_restart_cell = False
-            tc = para.getparent()
-            while tc is not None and tc.tag != f"{{{w_ns['w']}}}tc":
-                tc = tc.getparent()
-            if tc is not None:
-                in_table_cell = True
-
-                # Check if this is a vMerge cell
-                tcPr = tc.find('w:tcPr', namespaces=w_ns)
-                if tcPr is not None:
-                    vMerge = tcPr.find('w:vMerge', namespaces=w_ns)
-                    if vMerge is not None:
-                        vMerge_val = vMerge.get(f"{{{w_ns['w']}}}val")
-                        # Check if this is a vMerge="restart" cell
-                        if vMerge_val == "restart":
-                            in_vmerge_restart_cell = True
-
+            in_table_cell = record.in_table_cell
+            in_vmerge_restart_cell = record.vmerge_restart
+            if in_table_cell:
                 # For ALL empty paragraphs in table cells (except vMerge="restart"), apply style "a3"
                 if not para_text.strip() and not in_vmerge_restart_cell:
                     pPr = para.find('w:pPr', namespaces=w_ns)
@@ -529,6 +564,7 @@ class FormatRestorer:
                     else:
                         val_qname = f"{{{w_ns['w']}}}val"
                         pStyle.set(val_qname, "a3")
+                    record.style = "a3"
 
             # Check if this paragraph is within the last N trailing empty slots
             # where N = template_trailing_empty
@@ -546,14 +582,11 @@ class FormatRestorer:
                 paragraphs_to_remove.append(para)
 
         # Remove unnecessary empty paragraphs
-        for para in paragraphs_to_remove:
-            parent = para.getparent()
-            if parent is not None:
-                parent.remove(para)
+        index.remove(paragraphs_to_remove)
+        report.count("removed_empty_paragraphs", len(paragraphs_to_remove))
 
         if paragraphs_to_remove:
-            import sys
-            print(f"[DEBUG] Removed {len(paragraphs_to_remove)} unnecessary empty paragraphs from target document", file=sys.stderr)
+            logger.debug("Removed %s unnecessary empty paragraphs from target document", len(paragraphs_to_remove))
 
         # Trim trailing spaces from text nodes to match template formatting
         # The conversion process may add trailing spaces that should be removed
@@ -576,87 +609,87 @@ class FormatRestorer:
                         text_node.text = text_node.text[:-1]
                 if text_node.text != original_text:
                     trimmed_count += 1
+        report.count("trimmed_text_nodes", trimmed_count)
         if trimmed_count > 0:
-            print(f"[DEBUG] Trimmed trailing spaces from {trimmed_count} text nodes", file=sys.stderr)
+            index.refresh_texts()
+            logger.debug("Trimmed trailing spaces from %s text nodes", trimmed_count)
 
         # Clean up unnecessary bookmarks while preserving important ones
         # This improves format similarity by removing technical bookmarks that differ between documents
         # while preserving TOC and reference bookmarks that users need
         removed_bookmarks = self._clean_bookmarks(target_root)
+        report.count("removed_bookmarks", removed_bookmarks)
         if removed_bookmarks > 0:
-            print(f"[DEBUG] Removed {removed_bookmarks} unnecessary bookmarks (preserved TOC and references)", file=sys.stderr)
+            logger.debug("Removed %s unnecessary bookmarks (preserved TOC and references)", removed_bookmarks)
 
         # Fix incorrect style usage: paragraphs using character styles
         # This is a common structural error where paragraphs use character styles instead of paragraph styles
         # We auto-correct this by finding the matching paragraph style
-        fixed_styles = self._fix_paragraph_style_misuse(target_root, template_styles_path, target_styles_path)
+        fixed_styles = self._fix_paragraph_style_misuse(index, template_styles, target_styles)
+        report.count("fixed_paragraph_styles", fixed_styles)
         if fixed_styles > 0:
-            print(f"[DEBUG] Fixed {fixed_styles} paragraphs using character styles (auto-corrected)", file=sys.stderr)
+            logger.debug("Fixed %s paragraphs using character styles (auto-corrected)", fixed_styles)
 
         # Apply template's image style to image paragraphs
         # This ensures image paragraphs use the same style as in template (e.g., style "af")
-        image_style_count = self._apply_template_image_style(target_root, template_tree)
+        image_style_count = self._apply_template_image_style(index, template)
+        report.count("image_paragraphs", image_style_count)
         if image_style_count > 0:
-            import sys
-            print(f"[DEBUG] Applied template's image style to {image_style_count} image paragraphs", file=sys.stderr)
+            logger.debug("Applied template's image style to %s image paragraphs", image_style_count)
 
         # Apply style mapping to all paragraphs FIRST
         # This ensures _sync_paragraph_properties sees the mapped styles
         if style_mapping:
-            for para in target_root.findall('.//w:p', namespaces=w_ns):
-                pPr = para.find('w:pPr', namespaces=w_ns)
-                if pPr is not None:
-                    pStyle = pPr.find('w:pStyle', namespaces=w_ns)
-                    if pStyle is not None:
-                        style_val = pStyle.get(f"{{{w_ns['w']}}}val")
-                        if style_val in style_mapping:
-                            pStyle.set(f"{{{w_ns['w']}}}val", style_mapping[style_val])
+            for record in index:
+                if record.style in style_mapping:
+                    pStyle = record.element.find('w:pPr/w:pStyle', namespaces=w_ns)
+                    record.style = style_mapping[record.style]
+                    pStyle.set(f"{{{w_ns['w']}}}val", record.style)
+
+        # Match target paragraphs against the template once for all sync stages
+        # (paragraph texts do not change from here on)
+        with report.stage("match_paragraphs"):
+            alignment = ParagraphAlignment(index, template)
 
         # Sync paragraph properties (indent, spacing, etc.) with template
         # This ensures output document matches template's paragraph-level formatting
-        synced_props = self._sync_paragraph_properties(target_root, template_doc_path)
+        with report.stage("sync_paragraph_properties"):
+            synced_props = self._sync_paragraph_properties(index, template, alignment)
+        report.count("synced_properties", synced_props)
         if synced_props > 0:
-            print(f"[DEBUG] Synced {synced_props} paragraph properties with template", file=sys.stderr)
+            logger.debug("Synced %s paragraph properties with template", synced_props)
 
         # Sync table column widths with template
         # This ensures tables match template's exact column widths
-        synced_tables = self._sync_table_column_widths(target_root, template_tree)
+        with report.stage("sync_table_column_widths"):
+            synced_tables = self._sync_table_column_widths(index, template, alignment)
+        report.count("synced_tables", synced_tables)
         if synced_tables > 0:
-            print(f"[DEBUG] Synced {synced_tables} table column widths with template", file=sys.stderr)
+            logger.debug("Synced %s table column widths with template", synced_tables)
 
         # Sync page breaks with template
         # This ensures document pagination matches template's layout
-        synced_page_breaks = self._sync_page_breaks(target_root, template_tree)
+        # (paragraphs it inserts are merged into the index in one pass at the end)
+        with report.stage("sync_page_breaks"), index.batch():
+            synced_page_breaks = self._sync_page_breaks(index, template, alignment)
+        report.count("synced_page_breaks", synced_page_breaks)
         if synced_page_breaks > 0:
-            print(f"[DEBUG] Synced {synced_page_breaks} page breaks with template", file=sys.stderr)
-
-        # Remove non-deterministic attributes
-        for elem in target_root.iter():
-            attrs_to_remove = []
-            for attr in elem.attrib:
-                if attr in self.NON_DETERMINISTIC_ATTRS:
-                    attrs_to_remove.append(attr)
-            for attr in attrs_to_remove:
-                del elem.attrib[attr]
-
-        # Remove direct formatting from paragraphs
-        self._clean_direct_formatting_in_tree(target_root)
-
-        # FINAL STEP: Force sync alignment after all cleaning
-        # This ensures alignment is preserved even if it was accidentally removed during cleaning
-        alignment_synced = self._sync_alignment_final(target_root, template_doc_path)
+            logger.debug("Synced %s page breaks with template", synced_page_breaks)
+
+        # FINAL STEP: Force sync alignment with template
+        # Direct formatting is cleaned later (see _clean_direct_formatting), which always keeps jc
+        with report.stage("sync_alignment_final"):
+            alignment_synced = self._sync_alignment_final(index, template, alignment)
+        report.count("synced_alignments", alignment_synced)
+        report.count("output_paragraphs", len(index))
+        report.count("tables", sum(1 for _ in target_root.iter(f"{{{w_ns['w']}}}tbl")))
         if alignment_synced > 0:
-            print(f"[DEBUG] Final alignment sync: {alignment_synced} paragraphs updated", file=sys.stderr)
+            logger.debug("Final alignment sync: %s paragraphs updated", alignment_synced)
 
-        # Copy template's root element to preserve namespace declarations
-        # Then move all children from target_root to template_root
-        import copy
-        output_root = copy.deepcopy(template_root)
-
-        # Clear template's body content
+        # Copy template's root element (with its body cleared) to preserve namespace declarations
+        # Then move all children from target_root to the copy
+        output_root = template.document_shell()
         output_body = output_root.find('.//w:body', namespaces=w_ns)
-        if output_body is not None:
-            output_body.clear()
 
         # Copy all children from target_root's body to output_root's body
         target_body = target_root.find('.//w:body', namespaces=w_ns)
@@ -664,44 +697,38 @@ class FormatRestorer:
             for child in target_body:
                 output_body.append(child)
 
-        # Write output document with template's root element (preserves namespaces)
-        output_tree = etree.ElementTree(output_root)
-        output_tree.write(output_doc_path, xml_declaration=True, encoding='UTF-8', standalone=True)
+        # Output document uses template's root element (preserves namespaces)
+        ctx.set_output_tree("word/document.xml", etree.ElementTree(output_root))
 
 
-    def _merge_relationships(self, template_dir: Path, output_dir: Path, target_dir: Path = None) -> None:
+    def _merge_relationships(self, ctx: RestoreContext) -> None:
         """
         Ensure output has all necessary relationships from template and target.
 
-        Output already has template's relationships (from copytree).
+        Output already has template's relationships (it starts as a copy of the template).
         We just need to add any target-specific relationships (like images).
 
         Args:
-            template_dir: Extracted template directory
-            output_dir: Output directory (already has template relationships)
-            target_dir: Extracted target directory (optional, for content relationships)
+            ctx: Conversion context (output's relationships will be updated)
         """
-        output_rels_path = output_dir / "word" / "_rels" / "document.xml.rels"
-
-        # If no target directory, nothing to merge
-        if target_dir is None:
-            return
+        rels_name = "word/_rels/document.xml.rels"
 
-        target_rels_path = target_dir / "word" / "_rels" / "document.xml.rels"
-        if not target_rels_path.exists():
+        target_rels_tree = ctx.target_tree(rels_name)
+        if target_rels_tree is None:
             return
 
-        # Output already has template's relationships from copytree
-        # Just need to ensure output_rels exists (it should from copytree)
-        if not output_rels_path.exists():
+        # Output already has template's relationships
+        # Just need to ensure output_rels exists (it should from the template)
+        output_rels_tree = ctx.output_tree(rels_name)
+        if output_rels_tree is None:
             # This shouldn't happen, but just in case
             return
 
         # Parse existing output relationships
-        output_rels = self._parse_relationships(output_rels_path)
+        output_rels = self._parse_relationships(output_rels_tree)
 
         # Parse target relationships (for content like images)
-        target_rels = self._parse_relationships(target_rels_path)
+        target_rels = self._parse_relationships(target_rels_tree)
 
         # Add target relationships that aren't already in output
         # This preserves template's format relationships while adding target's content relationships
@@ -710,42 +737,29 @@ class FormatRestorer:
                 output_rels[rel_id] = (rel_type, rel_target)
 
         # Write merged relationships back to output
-        self._write_relationships(output_rels_path, output_rels)
+        ctx.set_output_tree(rels_name, self._write_relationships(output_rels))
 
-    def _parse_relationships(self, rels_path: Path) -> dict:
+    def _parse_relationships(self, tree) -> dict:
         """
-        Parse a relationships XML file.
+        Parse a relationships XML part.
 
         Args:
-            rels_path: Path to the relationships XML file
+            tree: Parsed relationships XML part
 
         Returns:
             Dictionary mapping relationship IDs to (type, target) tuples
         """
-        namespaces = {
-            'r': 'http://schemas.openxmlformats.org/package/2006/relationships'
-        }
-
-        tree = etree.parse(rels_path)
-        root = tree.getroot()
-
-        relationships = {}
-        for rel in root.findall('r:Relationship', namespaces):
-            rel_id = rel.get('Id')
-            rel_type = rel.get('Type')
-            rel_target = rel.get('Target')
-            if rel_id and rel_type and rel_target:
-                relationships[rel_id] = (rel_type, rel_target)
-
-        return relationships
+        return parse_relationships(tree)
 
-    def _write_relationships(self, rels_path: Path, relationships: dict) -> None:
+    def _write_relationships(self, relationships: dict):
         """
-        Write relationships to an XML file.
+        Build a relationships XML part.
 
         Args:
-            rels_path: Path to write the relationships XML file
             relationships: Dictionary mapping relationship IDs to (type, target) tuples
+
+        Returns:
+            lxml ElementTree of the relationships XML part
         """
         # Create root element with proper namespaces
         namespaces = {
@@ -767,16 +781,9 @@ class FormatRestorer:
             rel.set('Type', rel_type)
             rel.set('Target', rel_target)
 
-        # Write to file
-        tree = etree.ElementTree(root)
-        tree.write(
-            rels_path,
-            xml_declaration=True,
-            encoding='UTF-8',
-            standalone=True
-        )
+        return etree.ElementTree(root)
 
-    def _remap_relationship_ids(self, output_dir: Path, template_dir: Path, target_dir: Path) -> None:
+    def _remap_relationship_ids(self, ctx: RestoreContext) -> None:
         """
         Remap target's relationship IDs to template's relationship IDs in output document.xml.
 
@@ -784,23 +791,21 @@ class FormatRestorer:
         instead of the target's relationship IDs.
 
         Args:
-            output_dir: Output directory containing document.xml
-            template_dir: Template directory (for reference)
-            target_dir: Target directory (for mapping)
+            ctx: Conversion context (output's document.xml is updated in place)
         """
-        output_doc_path = output_dir / "word" / "document.xml"
-        if not output_doc_path.exists():
+        tree = ctx.output_tree("word/document.xml")
+        if tree is None:
             return
 
         # Parse template and target relationships to create mapping
-        template_rels_path = template_dir / "word" / "_rels" / "document.xml.rels"
-        target_rels_path = target_dir / "word" / "_rels" / "document.xml.rels"
-
-        if not template_rels_path.exists() or not target_rels_path.exists():
+        rels_name = "word/_rels/document.xml.rels"
+        template_rels_tree = ctx.template.rels_tree
+        target_rels_tree = ctx.target_tree(rels_name)
+        if template_rels_tree is None or target_rels_tree is None:
             return
 
-        template_rels = self._parse_relationships(template_rels_path)
-        target_rels = self._parse_relationships(target_rels_path)
+        template_rels = ctx.template.relationships
+        target_rels = self._parse_relationships(target_rels_tree)
 
         # Create mapping from target relationship IDs to template relationship IDs
         # Map based on relationship type and target
@@ -812,11 +817,10 @@ class FormatRestorer:
                     id_mapping[target_id] = template_id
                     break
 
-        import sys
-        print(f"[DEBUG] Created {len(id_mapping)} relationship ID mappings", file=sys.stderr)
+        logger.debug("Created %s relationship ID mappings", len(id_mapping))
+        ctx.report.count("remapped_relationships", len(id_mapping))
 
         # Apply mapping to output document.xml
-        tree = etree.parse(output_doc_path)
         root = tree.getroot()
 
         # Find all r:embed attributes and replace them
@@ -834,172 +838,58 @@ class FormatRestorer:
                 new_id = id_mapping[old_id]
                 elem.set('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}link', new_id)
 
-        # Write updated document.xml
-        tree.write(
-            output_doc_path,
-            xml_declaration=True,
-            encoding='UTF-8',
-            standalone=True
-        )
-
-    def _clean_direct_formatting_in_tree(self, root) -> None:
-        """
-        Clean direct formatting in an XML tree element.
-
-        This removes:
-        1. Non-deterministic attributes (rsid, paraId, textId)
-        2. Direct formatting in pPr (paragraph properties) except pStyle, ind, and jc
-        3. Direct formatting in rPr (run properties) like rFonts, colors, etc.
-
-        The goal is to rely on styles rather than direct formatting for maximum format similarity.
-
-        Note: We preserve <w:ind> (indentation) and <w:jc> (alignment) elements because:
-        - Indentation: many paragraphs use direct formatting for indentation
-        - Alignment: should match template's alignment
-
-        Args:
-            root: XML root element to clean
-        """
-        import sys
-        print(f"[DEBUG] _clean_direct_formatting_in_tree called", file=sys.stderr)
-        w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
-
-        jc_count_before = 0
-        for elem in root.iter():
-            if elem.tag == f"{{{w_ns['w']}}}pPr":
-                jc_elem = elem.find("w:jc", namespaces=w_ns)
-                if jc_elem is not None:
-                    jc_count_before += 1
-
-        print(f"[DEBUG] Before clean: {jc_count_before} pPr elements have jc", file=sys.stderr)
-
-        for elem in root.iter():
-            # For pPr elements, keep pStyle, ind, and jc (alignment), remove everything else
-            parent_para = None  # Initialize to None to avoid UnboundLocalError
-            if elem.tag == f"{{{w_ns['w']}}}pPr":
-                children_to_remove = []
-                parent_para = elem.getparent()
-
-                for child in elem:
-                    child_tag = child.tag
-                    # Keep pStyle (paragraph style), ind (indentation), and jc (alignment)
-                    # Remove all other direct formatting
-                    keep = child_tag in [
-                        f"{{{w_ns['w']}}}pStyle",
-                        f"{{{w_ns['w']}}}ind",
-                        f"{{{w_ns['w']}}}jc"  # Keep alignment
-                    ]
-
-                    # Debug for jc elements
-                    import sys
-                    if child_tag.split('}')[-1] == 'jc' and parent_para is not None:
-                        texts = parent_para.findall(".//w:t", namespaces=w_ns)
-                        text = "".join([t.text for t in texts if t.text])
-                        print(f"[DEBUG] Found jc element in paragraph with text: {text[:30] if text else 'empty'}, keep={keep}", file=sys.stderr)
-
-                    if not keep:
-                        children_to_remove.append(child)
-
-                # Remove direct formatting children
-                for child in children_to_remove:
-                    elem.remove(child)
-
-                if parent_para is not None:
-                    texts = parent_para.findall(".//w:t", namespaces=w_ns)
-                    text = "".join([t.text for t in texts if t.text])
-                    if "故障级别" in text:
-                        print(f"[DEBUG] _clean_direct_formatting_in_tree: '故障级别' pPr has {len(elem)} children after clean", file=sys.stderr)
-                        print(f"[DEBUG] Children: {[c.tag.split('}')[-1] for c in elem]}", file=sys.stderr)
-
-        jc_count_after = 0
-        for elem in root.iter():
-            if elem.tag == f"{{{w_ns['w']}}}pPr":
-                jc_elem = elem.find("w:jc", namespaces=w_ns)
-                if jc_elem is not None:
-                    jc_count_after += 1
-
-        print(f"[DEBUG] After clean: {jc_count_after} pPr elements have jc", file=sys.stderr)
-
-        # For rPr elements (run properties), remove ALL direct formatting
-        # This removes rFonts, colors, bold, italic, etc. that are directly applied
-        # The text should get its formatting from character styles instead
-        for elem in root.iter():
-            if elem.tag == f"{{{w_ns['w']}}}rPr":
-                parent = elem.getparent()
-                if parent is not None:
-                    # Remove the entire rPr element to eliminate direct formatting
-                    parent.remove(elem)
-
-    def _sync_alignment_final(self, target_root, template_doc_path) -> int:
+    def _sync_alignment_final(self, index: DocumentIndex, template: CompiledTemplate, alignment: ParagraphAlignment) -> int:
         """
         Final pass to sync alignment (jc) from template to target.
 
-        This is called AFTER all cleaning to ensure alignment is preserved.
+        This is called AFTER all other sync stages; cleaning keeps jc, so the
+        alignment set here is preserved.
         Only syncs for paragraphs with high content similarity (>90%).
 
         Args:
-            target_root: Target document's root element
-            template_doc_path: Path to template document
+            index: Paragraph index of the target document
+            template: Compiled template
+            alignment: Paragraph matches shared by the sync stages
 
         Returns:
             Number of paragraphs synced
         """
-        import sys
-        from difflib import SequenceMatcher
         from lxml import etree
 
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Parse template document
-        template_tree = etree.parse(str(template_doc_path))
-        template_root = template_tree.getroot()
-
-        # Extract all paragraph texts from template
-        template_paras = template_root.findall('.//w:p', namespaces=w_ns)
-        template_texts = []
-        text_to_para_map = {}  # Map text index to paragraph index
-        text_idx = 0
-        for para_idx, para in enumerate(template_paras):
-            texts = para.findall('.//w:t', namespaces=w_ns)
-            text = ''.join([t.text or '' for t in texts])
-            if text.strip():
-                template_texts.append(text)
-                text_to_para_map[text_idx] = para_idx
-                text_idx += 1
-
-        # Get all target paragraphs
-        target_paras = target_root.findall('.//w:p', namespaces=w_ns)
+        template_paras = template.paragraphs
+        template_texts = template.texts
 
         synced_count = 0
 
-        for target_para in target_paras:
-            # Get target paragraph text
-            target_texts = target_para.findall('.//w:t', namespaces=w_ns)
-            target_text = ''.join([t.text or '' for t in target_texts])
-
-            if not target_text.strip():
+        for record in index:
+            target_para = record.element
+            match = alignment.get(target_para)
+            if match is None or not match.text.strip():
                 continue
 
             # Find best matching template paragraph
             best_match_idx = -1
             best_ratio = 0
 
-            for i, template_text in enumerate(template_texts):
-                if not template_text:
-                    continue
+            # Exact-text fast path: the first identical paragraph has the highest ratio
+            if match.exact:
+                best_match_idx = match.exact[0]
 
-                matcher = SequenceMatcher(None, target_text, template_text)
-                ratio = matcher.ratio()
+            # Otherwise pick among template paragraphs that are 90%+ similar
+            candidates = alignment.scored(match) if best_match_idx < 0 else []
+            for i, ratio in candidates:
+                if not template_texts[i].strip():
+                    continue
 
-                if ratio > best_ratio and ratio > 0.9:  # Only match if very similar
+                if ratio > best_ratio:
                     best_ratio = ratio
                     best_match_idx = i
 
             # If found a good match, sync alignment
             if best_match_idx >= 0:
-                # Map text index to actual paragraph index
-                actual_para_idx = text_to_para_map.get(best_match_idx, best_match_idx)
-                template_para = template_paras[actual_para_idx]
+                template_para = template_paras[best_match_idx]
                 template_pPr = template_para.find('w:pPr', namespaces=w_ns)
 
                 # Get or create target's pPr
@@ -1090,7 +980,7 @@ class FormatRestorer:
 
         return removed_count
 
-    def _fix_paragraph_style_misuse(self, target_root, template_styles_path: Path, target_styles_path: Path) -> int:
+    def _fix_paragraph_style_misuse(self, index: DocumentIndex, template_tree, target_tree) -> int:
         """
         Fix paragraphs that incorrectly use character styles instead of paragraph styles.
 
@@ -1099,23 +989,18 @@ class FormatRestorer:
         paragraph style (type=paragraph).
 
         Args:
-            target_root: Target document's XML root
-            template_styles_path: Path to template's styles.xml
-            target_styles_path: Path to target's styles.xml
+            index: Paragraph index of the target document
+            template_tree: Template's parsed styles.xml (None if missing)
+            target_tree: Target's parsed styles.xml (None if missing)
 
         Returns:
             Number of paragraphs fixed
         """
-        import sys
-        if not template_styles_path.exists() or not target_styles_path.exists():
+        if template_tree is None or target_tree is None:
             return 0
 
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Parse styles to identify character styles
-        template_tree = etree.parse(template_styles_path)
-        target_tree = etree.parse(target_styles_path)
-
         # Build character style ID sets
         template_char_styles = set()
         target_char_styles = set()
@@ -1180,35 +1065,29 @@ class FormatRestorer:
                             char_to_para_mapping[char_style_id] = possible_para_id
 
         # Debug output
-        print(f"[DEBUG] _fix_paragraph_style_misuse: Found {len(target_char_styles)} character styles in target", file=sys.stderr)
-        print(f"[DEBUG] _fix_paragraph_style_misuse: Created {len(char_to_para_mapping)} char->para mappings", file=sys.stderr)
+        logger.debug("_fix_paragraph_style_misuse: Found %s character styles in target", len(target_char_styles))
+        logger.debug("_fix_paragraph_style_misuse: Created %s char->para mappings", len(char_to_para_mapping))
         if char_to_para_mapping:
-            print(f"[DEBUG] Mappings: {char_to_para_mapping}", file=sys.stderr)
+            logger.debug("Mappings: %s", char_to_para_mapping)
 
         # Fix paragraphs that use character styles
         fixed_count = 0
-        for para in target_root.findall(".//w:p", namespaces=w_ns):
-            pPr = para.find("w:pPr", namespaces=w_ns)
-            if pPr is None:
-                continue
-
-            pStyle = pPr.find("w:pStyle", namespaces=w_ns)
-            if pStyle is None:
-                continue
-
-            style_val = pStyle.get(f"{{{w_ns['w']}}}val")
+        for record in index:
+            style_val = record.style
 
             # Check if this paragraph is using a character style
             if style_val in char_to_para_mapping:
                 # Replace with paragraph style
                 correct_style = char_to_para_mapping[style_val]
-                print(f"[DEBUG] Fixing paragraph: {style_val} -> {correct_style}", file=sys.stderr)
+                logger.debug("Fixing paragraph: %s -> %s", style_val, correct_style)
+                pStyle = record.element.find("w:pPr/w:pStyle", namespaces=w_ns)
                 pStyle.set(f"{{{w_ns['w']}}}val", correct_style)
+                record.style = correct_style
                 fixed_count += 1
 
         return fixed_count
 
-    def _apply_template_image_style(self, target_root, template_tree) -> int:
+    def _apply_template_image_style(self, index: DocumentIndex, template: CompiledTemplate) -> int:
         """
         Apply template's image style to image paragraphs in target document.
 
@@ -1216,90 +1095,41 @@ class FormatRestorer:
         they use the same style as image paragraphs in the template (typically style "af").
 
         Args:
-            target_root: Target document's root element
-            template_tree: Template document's parsed XML tree
+            index: Paragraph index of the target document
+            template: Compiled template (provides the template's image style)
 
         Returns:
             Number of image paragraphs styled
         """
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Step 1: Find the image style used in template
-        # We search for paragraphs with drawings that have a named style
-        template_image_style = None
-
-        # Try multiple approaches to find image style in template
-        # Approach 1: Use lxml to search
-        template_paras = template_tree.findall(".//w:p", namespaces=w_ns)
-        for para in template_paras:
-            has_drawing = para.find(".//w:drawing", namespaces=w_ns) is not None
-            if has_drawing:
-                pPr = para.find("w:pPr", namespaces=w_ns)
-                if pPr is not None:
-                    pStyle = pPr.find("w:pStyle", namespaces=w_ns)
-                    if pStyle is not None:
-                        style_val = pStyle.get('val')
-                        if style_val:
-                            template_image_style = style_val
-                            import sys
-                            print(f"[DEBUG] Found template image style: {template_image_style} (via lxml)", file=sys.stderr)
-                            break
-
-        # Approach 2: If lxml didn't find it, serialize and search with regex
-        if not template_image_style:
-            import re
-            template_xml = etree.tostring(template_tree, encoding='unicode')
-            # Find all <w:pStyle w:val="..."/> patterns
-            style_matches = list(re.finditer(r'<w:pStyle[^>]*w:val="([^"]*)"[^>]*/>', template_xml))
-
-            # For each style, check if <w:drawing> appears before the next </w:p>
-            for match in style_matches:
-                style_val = match.group(1)
-                style_end = match.end()
-
-                # Find the next </w:p> and <w:drawing>
-                next_p = template_xml.find('</w:p>', style_end)
-                next_drawing = template_xml.find('<w:drawing>', style_end)
-
-                # If drawing appears before the next </w:p>, this is an image paragraph style
-                if next_drawing > 0 and (next_p < 0 or next_drawing < next_p):
-                    template_image_style = style_val
-                    import sys
-                    print(f"[DEBUG] Found template image style: {template_image_style} (via regex)", file=sys.stderr)
-                    break
+        # Step 1: The image style used in template is found when the template is compiled
+        template_image_style = template.image_style
 
         # If template doesn't use a specific image style, nothing to do
         if not template_image_style:
             return 0
 
-        # Step 1.5: Check if template has tab after image + heading pattern
-        # Pattern: image paragraph (style af) -> heading paragraph with <w:tab/>
-        template_has_tab_after_image_heading = False
-        import re
-        template_xml = etree.tostring(template_tree, encoding='unicode')
-        # Look for: style af paragraph end, then another paragraph with <w:tab/>
-        tab_after_af_pattern = r'w:val="af"[^>]*/>.*?</w:p>.*?<w:p[^>]*>.*?<w:r[^>]*>.*?<w:tab/>'
-        if re.search(tab_after_af_pattern, template_xml, re.DOTALL):
-            template_has_tab_after_image_heading = True
+        # Step 1.5: Whether template has tab after image + heading pattern
+        template_has_tab_after_image_heading = template.has_tab_after_image_heading
 
         # Step 2: Find all image paragraphs in target and apply template's image style
         # Also apply the same style to the next paragraph (image caption/legend)
         styled_count = 0
-        target_paras = target_root.findall(".//w:p", namespaces=w_ns)
+        target_paras = index.paragraphs
 
-        for i, para in enumerate(target_paras):
+        for i, record in enumerate(target_paras):
             # Check if this paragraph has a drawing (image)
-            has_drawing = para.find(".//w:drawing", namespaces=w_ns) is not None
-            if has_drawing:
+            if record.has_drawing:
                 # Apply style to image paragraph
-                styled_count += self._apply_style_to_paragraph(para, template_image_style, w_ns)
+                styled_count += self._apply_style_to_paragraph(record, template_image_style, w_ns)
 
                 # Check if next paragraph is an image caption (short text, no drawing)
                 # Apply the same style to it ONLY if it doesn't already have a style
                 if i + 1 < len(target_paras):
-                    next_para = target_paras[i + 1]
-                    next_has_drawing = next_para.find(".//w:drawing", namespaces=w_ns) is not None
-                    if not next_has_drawing:
+                    next_record = target_paras[i + 1]
+                    next_para = next_record.element
+                    if not next_record.has_drawing:
                         # Check if it already has a paragraph style
                         next_pPr = next_para.find("w:pPr", namespaces=w_ns)
                         if next_pPr is not None:
@@ -1307,17 +1137,16 @@ class FormatRestorer:
                             # Only apply image style if paragraph doesn't have a style yet
                             # or if it already uses the image style
                             if next_pStyle is None:
-                                # Extract text to check if it's a short caption
-                                text_elems = next_para.findall(".//w:t", namespaces=w_ns)
-                                text = "".join([t.text for t in text_elems if t.text])
+                                # Check if it's a short caption
+                                text = next_record.text
                                 # If text is short (likely a caption), apply the same style
                                 if text and len(text.strip()) < 50:
-                                    styled_count += self._apply_style_to_paragraph(next_para, template_image_style, w_ns)
+                                    styled_count += self._apply_style_to_paragraph(next_record, template_image_style, w_ns)
 
                                     # Step 3: Add tab to the paragraph AFTER the caption
                                     # Pattern: image -> caption (style af) -> next paragraph with tab
                                     if template_has_tab_after_image_heading and i + 2 < len(target_paras):
-                                        next_next_para = target_paras[i + 2]
+                                        next_next_para = target_paras[i + 2].element
                                         self._add_tab_to_paragraph(next_next_para, w_ns)
 
         return styled_count
@@ -1353,18 +1182,20 @@ class FormatRestorer:
         # Insert tab at the beginning of the first run
         first_run.insert(0, new_tab)
 
-    def _apply_style_to_paragraph(self, para, style_val, w_ns) -> int:
+    def _apply_style_to_paragraph(self, record, style_val, w_ns) -> int:
         """
         Apply a style to a paragraph, replacing any existing style.
 
         Args:
-            para: Paragraph element
+            record: Index record of the paragraph (its style is updated too)
             style_val: Style value to apply
             w_ns: Word namespace
 
         Returns:
             1 if style was applied, 0 if no change needed
         """
+        para = record.element
+
         # Get or create pPr
         pPr = para.find("w:pPr", namespaces=w_ns)
         if pPr is None:
@@ -1398,10 +1229,11 @@ class FormatRestorer:
         val_qname = ET.QName(w_ns['w'], 'val')
         new_pStyle.set(val_qname, style_val)
         pPr.append(new_pStyle)
+        record.style = style_val
 
         return 1
 
-    def _sync_paragraph_properties(self, target_root, template_doc_path: Path) -> int:
+    def _sync_paragraph_properties(self, index: DocumentIndex, template: CompiledTemplate, alignment: ParagraphAlignment) -> int:
         """
         Sync paragraph properties (indent, spacing, etc.) with template document.
 
@@ -1409,50 +1241,30 @@ class FormatRestorer:
         properties to target, ensuring format consistency.
 
         Args:
-            target_root: Target document's root element
-            template_doc_path: Path to template's document.xml
+            index: Paragraph index of the target document
+            template: Compiled template
+            alignment: Paragraph matches shared by the sync stages
 
         Returns:
             Number of paragraphs synced
         """
-        from difflib import SequenceMatcher
-
-        if not template_doc_path.exists():
-            return 0
-
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Parse template document
-        template_tree = etree.parse(template_doc_path)
-        template_root = template_tree.getroot()
-
-        # Extract all paragraphs from both documents
-        target_paras = target_root.findall(".//w:p", namespaces=w_ns)
-        template_paras = template_root.findall(".//w:p", namespaces=w_ns)
+        template_paras = template.paragraphs
 
         if not template_paras:
             return 0
 
-        # Extract paragraph texts for matching
-        def extract_para_text(para):
-            text_elems = para.findall(".//w:t", namespaces=w_ns)
-            return "".join([t.text for t in text_elems if t.text])
-
-        template_texts = [extract_para_text(p) for p in template_paras]
-
         synced_count = 0
+        debug = logger.isEnabledFor(logging.DEBUG)  # Per-paragraph messages are built only when enabled
 
         # For each target paragraph, find matching template paragraph and sync properties
-        for target_para in target_paras:
-            target_text = extract_para_text(target_para)
-
-            if not target_text:
-                continue
-
-            # Debug for table cells
-            import sys
-            if target_text.strip() in ['故障级别', '定义', '响应时间']:
-                print(f"[DEBUG] Processing target paragraph: '{target_text}'", file=sys.stderr)
+        for record in index:
+            target_para = record.element
+            match = alignment.get(target_para)
+            if match is None:
+                continue  # Paragraph has no text
+            target_text = match.text
 
             # Check if target paragraph uses a named style
             # IMPORTANT: Paragraphs with named styles should NOT get ind elements synced
@@ -1463,62 +1275,43 @@ class FormatRestorer:
                 target_pStyle = target_pPr.find("w:pStyle", namespaces=w_ns)
                 if target_pStyle is not None:
                     has_named_style = True
-                    # Debug for specific paragraphs
-                    import sys
-                    if "本项目开发进度表" in target_text:
-                        style_val = target_pStyle.get('val')
-                        print(f"[DEBUG] Early check: '{target_text[:30]}' already has style '{style_val}', has_named_style={has_named_style}", file=sys.stderr)
-                else:
-                    # Debug for specific paragraphs without style
-                    import sys
-                    if "本项目开发进度表" in target_text:
-                        print(f"[DEBUG] Early check: '{target_text[:30]}' has NO style, has_named_style={has_named_style}", file=sys.stderr)
 
             # Find best matching template paragraph
             best_match_idx = -1
             best_ratio = 0
 
             # Check if target has a named style
-            target_style = None
-            if target_pPr is not None:
-                target_pStyle = target_pPr.find("w:pStyle", namespaces=w_ns)
-                if target_pStyle is not None:
-                    target_style = target_pStyle.get(f"{{{w_ns['w']}}}val")
-
-            # Debug for "故障级别"
-            if "故障级别" in target_text:
-                import sys
-                print(f"[DEBUG] '故障级别' target_style BEFORE matching: {target_style}", file=sys.stderr)
-
-            for i, template_text in enumerate(template_texts):
-                if not template_text:
-                    continue
-
-                # Use sequence matching for similarity
-                matcher = SequenceMatcher(None, target_text, template_text)
-                ratio = matcher.ratio()
+            target_style = match.style
+
+            # Exact-text fast path: identical text is the only way to reach ratio 1.0,
+            # so the first identical paragraph wins unless a same-style paragraph could
+            # still score higher with the style bonus
+            if match.exact and target_style is None:
+                best_match_idx = match.exact[0]
+                best_ratio = 1.0
+            else:
+                for i in match.exact:
+                    if template.paragraph_styles[i] == target_style:
+                        best_match_idx = i
+                        best_ratio = 1.05
+                        break
 
+            # Otherwise pick among template paragraphs that are 90%+ similar
+            candidates = alignment.scored(match) if best_match_idx < 0 else []
+            for i, ratio in candidates:
                 # Bonus: prefer matching paragraphs with same style
-                if ratio > 0.9:  # Only consider if very similar (90%+)
-                    # Check if template paragraph has same style
-                    template_para = template_paras[i]
-                    template_pPr = template_para.find("w:pPr", namespaces=w_ns)
-                    template_style = None
-                    if template_pPr is not None:
-                        template_pStyle = template_pPr.find("w:pStyle", namespaces=w_ns)
-                        if template_pStyle is not None:
-                            template_style = template_pStyle.get(f"{{{w_ns['w']}}}val")
+                # Check if template paragraph has same style
+                template_style = template.paragraph_styles[i]
 
-                    # If styles match, give it a strong bonus
-                    if target_style == template_style and target_style is not None:
-                        ratio += 0.05  # Bonus for same style
+                # If styles match, give it a strong bonus
+                if target_style == template_style and target_style is not None:
+                    ratio += 0.05  # Bonus for same style
 
-                    # Debug for "故障级别"
-                    if "故障级别" in target_text and ratio > 0.9:
-                        import sys
-                        print(f"[DEBUG] Matching '{target_text}': template_style={template_style}, target_style={target_style}, ratio={ratio:.3f}", file=sys.stderr)
+                if debug:
+                    logger.debug("Matching '%s': template_style=%s, target_style=%s, ratio=%.3f",
+                                 target_text, template_style, target_style, ratio)
 
-                if ratio > best_ratio and ratio > 0.9:  # Only match if very similar (90%+)
+                if ratio > best_ratio:
                     best_ratio = ratio
                     best_match_idx = i
 
@@ -1526,18 +1319,12 @@ class FormatRestorer:
             if best_match_idx >= 0:
                 template_para = template_paras[best_match_idx]
 
-                # Debug: print match for specific paragraph
-                import sys
-                if "本项目开发进度表" in target_text or "服务响应时间" in target_text or target_text.strip() in ['故障级别', '定义', '响应时间']:
-                    print(f"[DEBUG] Matched '{target_text[:30]}' with ratio {best_ratio:.3f}", file=sys.stderr)
-
                 # Get template's pPr
                 template_pPr = template_para.find("w:pPr", namespaces=w_ns)
 
-                # Debug: check template pPr
-                import sys
-                if ("本项目开发进度表" in target_text or "服务响应时间" in target_text or target_text.strip() in ['故障级别', '定义', '响应时间']) and template_pPr is None:
-                    print(f"[DEBUG] Template para for '{target_text[:30]}' has NO pPr!", file=sys.stderr)
+                if debug:
+                    logger.debug("Matched '%s' with ratio %.3f%s", target_text[:30], best_ratio,
+                                 "" if template_pPr is not None else " (template paragraph has no pPr)")
 
                 # Get or create target's pPr
                 target_pPr = target_para.find("w:pPr", namespaces=w_ns)
@@ -1586,13 +1373,6 @@ class FormatRestorer:
                         target_pPr.append(new_jc)
                         synced_count += 1
 
-                        # Debug: verify jc was added
-                        if "故障级别" in target_text:
-                            import sys
-                            verify_jc = target_pPr.find("w:jc", namespaces=w_ns)
-                            print(f"[DEBUG] Added jc '{jc_val}' to '故障级别', verified: {verify_jc is not None}", file=sys.stderr)
-                            print(f"[DEBUG] target_pPr children: {[c.tag.split('}')[-1] for c in target_pPr]}", file=sys.stderr)
-
                 # Also sync paragraph style (pStyle) - but ONLY if paragraph doesn't already have a style
                 # IMPORTANT: If paragraph already has a style (from style mapping), don't overwrite it!
                 # The style mapping has already correctly mapped original styles to template styles
@@ -1621,78 +1401,44 @@ class FormatRestorer:
                                 new_pStyle.set(val_qname, style_val)
                                 target_pPr.append(new_pStyle)
                                 synced_count += 1
-                                print(f"[DEBUG] Added missing style '{style_val}' to paragraph: {target_text[:40]}", file=sys.stderr)
+                                logger.debug("Added missing style '%s' to paragraph: %s", style_val, target_text[:40])
 
         return synced_count
 
-    def _sync_table_column_widths(self, target_root, template_tree) -> int:
+    def _sync_table_column_widths(self, index: DocumentIndex, template: CompiledTemplate, alignment: ParagraphAlignment) -> int:
         """
         Sync table column widths with template document.
 
-        Strategy: Match tables by their preceding paragraph (table caption/title),
-        then sync column widths. This works even when table content differs.
+        Strategy: Match tables by their structure (see table_fingerprint) and their
+        preceding paragraph (table caption/title), then sync column widths. This
+        works even when table content differs, and for tables without a caption.
 
         Args:
-            target_root: Target document's root element
-            template_tree: Template document's parsed XML tree
+            index: Paragraph index of the target document
+            template: Compiled template
+            alignment: Paragraph matches shared by the sync stages
 
         Returns:
             Number of tables synced
         """
-        from difflib import SequenceMatcher
-        import sys
 
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Extract all tables with their preceding paragraphs
-        def get_tables_with_captions(root):
-            """Get (table, preceding_paragraph_text) tuples"""
-            result = []
-            paras = root.findall(".//w:p", namespaces=w_ns)
-
-            for i, para in enumerate(paras):
-                texts = para.findall(".//w:t", namespaces=w_ns)
-                text = "".join([t.text for t in texts if t.text])
-
-                # Check if next element is a table
-                next_elem = para.getnext()
-                if next_elem is not None and next_elem.tag == f"{{{w_ns['w']}}}tbl":
-                    result.append((next_elem, text))
-
-            return result
-
-        target_tables = get_tables_with_captions(target_root)
-        template_tables = get_tables_with_captions(template_tree)
-
-        if not template_tables:
+        if not template.tables:
             return 0
 
         synced_count = 0
 
-        # For each target table, find matching template table by caption
-        for target_tbl, target_caption in target_tables:
-            if not target_caption:
-                continue  # Skip tables without captions
-
-            # Find best matching template table by caption text
-            best_match_idx = -1
-            best_ratio = 0
-
-            for i, (template_tbl, template_caption) in enumerate(template_tables):
-                if not template_caption:
-                    continue
+        # For each target table, find the matching template table
+        for target_tbl in list(index.root.iter(f"{{{w_ns['w']}}}tbl")):
+            caption_para = target_tbl.getprevious()
+            match = alignment.get(caption_para) if caption_para is not None else None
+            target_caption = match.text if match is not None else ""
 
-                # Match by caption text
-                matcher = SequenceMatcher(None, target_caption, template_caption)
-                ratio = matcher.ratio()
-
-                if ratio > best_ratio and ratio > 0.9:  # 90%+ similarity in caption
-                    best_ratio = ratio
-                    best_match_idx = i
+            template_tbl = self._find_template_table(template, alignment, target_tbl, match)
 
             # If found a good match, sync column widths and table style
-            if best_match_idx >= 0:
-                template_tbl, template_caption = template_tables[best_match_idx]
+            if template_tbl is not None:
 
                 # Sync table style
                 target_tblPr = target_tbl.find("w:tblPr", namespaces=w_ns)
@@ -1709,7 +1455,7 @@ class FormatRestorer:
                             if target_tblStyle is not None:
                                 target_tblStyle.set(f"{{{w_ns['w']}}}val", template_style_val)
                                 synced_count += 1
-                                print(f"[DEBUG] Synced table style: {template_style_val} for table: {target_caption[:40]}", file=sys.stderr)
+                                logger.debug("Synced table style: %s for table: %s", template_style_val, target_caption[:40])
                             else:
                                 # Create tblStyle element
                                 from lxml import etree as ET
@@ -1719,7 +1465,7 @@ class FormatRestorer:
                                 new_tblStyle.set(val_qname, template_style_val)
                                 target_tblPr.append(new_tblStyle)
                                 synced_count += 1
-                                print(f"[DEBUG] Added table style: {template_style_val} for table: {target_caption[:40]}", file=sys.stderr)
+                                logger.debug("Added table style: %s for table: %s", template_style_val, target_caption[:40])
 
                     # Sync table-level jc (justification)
                     # Remove jc from target if template doesn't have it
@@ -1833,7 +1579,54 @@ class FormatRestorer:
 
         return synced_count
 
-    def _sync_page_breaks(self, target_root, template_tree) -> int:
+    def _find_template_table(self, template: CompiledTemplate, alignment: ParagraphAlignment, target_tbl, match):
+        """
+        Find the template table matching a target table.
+
+        Lookups, in order: same structure and identical caption; caption text alone
+        (exact, then 90%+ similar); structure alone, if only one template table has it.
+
+        Args:
+            template: Compiled template
+            alignment: Paragraph matches shared by the sync stages
+            target_tbl: Target table element
+            match: Alignment match of the table's caption paragraph, or None if the
+                   table has no caption
+
+        Returns:
+            Template table element, or None if there is no match
+        """
+        fingerprint = table_fingerprint(target_tbl)
+
+        if match is not None:
+            positions = template.table_keys.get((fingerprint, match.text))
+            if positions:
+                return template.tables[positions[0]]
+
+            # Template tables by the position of their preceding paragraph (caption/title)
+            caption_tables = template.caption_tables
+
+            # Find best matching template table by caption text (only caption paragraphs count)
+            # Exact-text fast path: an identical caption has the highest ratio
+            best_match_idx = next((i for i in match.exact if i in caption_tables), -1)
+            best_ratio = 1.0 if best_match_idx >= 0 else 0
+
+            # Otherwise pick among template captions that are 90%+ similar
+            candidates = alignment.scored(match) if best_match_idx < 0 else []
+            for i, ratio in candidates:
+                if i in caption_tables and ratio > best_ratio:
+                    best_ratio = ratio
+                    best_match_idx = i
+
+            if best_match_idx >= 0:
+                return caption_tables[best_match_idx]
+
+        positions = template.table_fingerprints.get(fingerprint, ())
+        if len(positions) == 1:
+            return template.tables[positions[0]]
+        return None
+
+    def _sync_page_breaks(self, index: DocumentIndex, template: CompiledTemplate, alignment: ParagraphAlignment) -> int:
         """
         Sync page breaks with template document.
 
@@ -1843,39 +1636,18 @@ class FormatRestorer:
         Note: Page breaks in empty paragraphs are applied to the preceding paragraph.
 
         Args:
-            target_root: Target document's root element
-            template_tree: Template document's parsed XML tree
+            index: Paragraph index of the target document (new paragraphs are
+                   inserted through it)
+            template: Compiled template
+            alignment: Paragraph matches shared by the sync stages
 
         Returns:
             Number of page breaks synced
         """
-        from difflib import SequenceMatcher
-
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # Get all paragraphs from both documents
-        target_paras = target_root.findall(".//w:p", namespaces=w_ns)
-        template_paras = template_tree.findall(".//w:p", namespaces=w_ns)
-
-        # Build a list of template paragraphs that have page breaks
-        # Include both paragraphs with text and empty paragraphs
-        template_breaks = []  # List of (paragraph, text, is_empty)
-        for i, para in enumerate(template_paras):
-            texts = para.findall(".//w:t", namespaces=w_ns)
-            text = "".join([t.text for t in texts if t.text])
-
-            # Check if this paragraph has a page break
-            page_break = para.find(".//w:br[@w:type='page']", namespaces=w_ns)
-            if page_break is not None:
-                is_empty = (not text)
-                # If empty, get the NEXT paragraph's text (the content after page break)
-                if is_empty and i + 1 < len(template_paras):
-                    next_para = template_paras[i + 1]
-                    next_texts = next_para.findall(".//w:t", namespaces=w_ns)
-                    next_text = "".join([t.text for t in next_texts if t.text])
-                    template_breaks.append((para, next_text, True))
-                else:
-                    template_breaks.append((para, text, False))
+        # Template paragraphs that have page breaks: (paragraph, text, is_empty, text position)
+        template_breaks = template.page_breaks
 
         if not template_breaks:
             return 0
@@ -1883,31 +1655,17 @@ class FormatRestorer:
         synced_count = 0
 
         # For each template page break, find matching target paragraph and add break
-        for tmpl_para, tmpl_text, is_empty in template_breaks:
+        for tmpl_para, tmpl_text, is_empty, tmpl_text_idx in template_breaks:
             if not tmpl_text:
                 continue
 
-            # Find matching target paragraph
-            best_match_para = None
-            best_ratio = 0
-
-            for target_para in target_paras:
-                texts = target_para.findall(".//w:t", namespaces=w_ns)
-                target_text = "".join([t.text for t in texts if t.text])
-
-                if not target_text:
-                    continue
-
-                matcher = SequenceMatcher(None, target_text, tmpl_text)
-                ratio = matcher.ratio()
-
-                if ratio > best_ratio:  # Track best match regardless of threshold
-                    best_ratio = ratio
-                    best_match_para = target_para
+            # Find matching target paragraph (first target paragraph with the best ratio)
+            best_target = alignment.best_target(tmpl_text_idx)
 
             # Only use if similarity is high enough
-            if best_ratio < 0.9:
+            if best_target is None:
                 continue
+            best_match_para, best_ratio = best_target
 
             # If found a match, add page break to target (or its following empty paragraph)
             if best_match_para is not None and best_ratio > 0.9:
@@ -1915,11 +1673,10 @@ class FormatRestorer:
                 if is_empty:
                     # Check if there's already an empty paragraph after
                     next_elem = best_match_para.getnext()
-                    next_texts = next_elem.findall(".//w:t", namespaces=w_ns) if next_elem is not None else []
+                    next_record = index.get(next_elem) if next_elem is not None else None
                     has_empty_after = (
-                        next_elem is not None and
-                        next_elem.tag == f"{{{w_ns['w']}}}p" and
-                        len(next_texts) == 0
+                        next_record is not None and
+                        len(next_record.text_nodes) == 0
                     )
 
                     if has_empty_after:
@@ -1939,6 +1696,7 @@ class FormatRestorer:
                             new_br = etree.Element(br_tag)
                             new_br.set(f"{{{w_ns['w']}}}type", "page")
                             first_run.insert(0, new_br)
+                            next_record.has_page_break = True
                             synced_count += 1
                     else:
                         # Need to create an empty paragraph BEFORE
@@ -1988,17 +1746,15 @@ class FormatRestorer:
                         new_run.append(new_br)
 
                         # Insert BEFORE the matched paragraph
-                        parent = best_match_para.getparent()
-                        if parent is not None:
-                            index = list(parent).index(best_match_para)
-                            parent.insert(index, new_para)
+                        if best_match_para.getparent() is not None:
+                            index.insert(new_para, before=best_match_para)
                             synced_count += 1
                 else:
                     # Add page break directly to the matched paragraph
                     # Check if target already has page break
-                    existing_break = best_match_para.find(".//w:br[@w:type='page']", namespaces=w_ns)
+                    match_record = index.get(best_match_para)
 
-                    if existing_break is None:
+                    if not match_record.has_page_break:
                         first_run = best_match_para.find("w:r", namespaces=w_ns)
                         if first_run is None:
                             # Create a run if there isn't one
@@ -2011,253 +1767,104 @@ class FormatRestorer:
                         new_br = etree.Element(br_tag)
                         new_br.set(f"{{{w_ns['w']}}}type", "page")
                         first_run.insert(0, new_br)
+                        match_record.has_page_break = True
                         synced_count += 1
 
         return synced_count
 
-    def _clean_direct_formatting(self, target_dir: Path, template_dir: Path = None) -> None:
+    def _clean_direct_formatting(self, ctx: RestoreContext) -> None:
         """
         Clean direct formatting in document.xml to rely on styles instead.
 
         This removes:
-        1. Non-deterministic attributes (rsid, paraId, textId)
-        2. Direct formatting attributes (widowControl, spacing, ind, jc, rPr, etc.)
+        1. Non-deterministic attributes (rsid) and elements (proofErr, lastRenderedPageBreak, ...)
+        2. Direct formatting (rPr, and pPr children other than pStyle, jc and ind)
         The goal is to make the output document as clean as the template, relying only on styles.
 
         Args:
-            target_dir: Extracted target directory
-            template_dir: Extracted template directory (not used currently, kept for compatibility)
+            ctx: Conversion context (output's document.xml is cleaned in place)
         """
-        import sys
-        document_path = target_dir / "word" / "document.xml"
-        if not document_path.exists():
+        tree = ctx.output_tree("word/document.xml")
+        if tree is None:
             return
 
-        # Parse document
-        tree = etree.parse(document_path)
         root = tree.getroot()
-
-        # Remove non-deterministic attributes
         w_ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
 
-        # First pass: collect elements to remove (don't modify during iteration)
-        rpr_elements_to_remove = []
-        ppr_elements_to_clean = []
-        nondeterministic_elements_to_remove = []
-
-        for elem in root.iter():
-            # First, remove non-deterministic attributes
-            attrs_to_remove = []
-            for attr in self.NON_DETERMINISTIC_ATTRS:
-                if attr in elem.attrib:
-                    attrs_to_remove.append(attr)
-            for attr in attrs_to_remove:
-                del elem.attrib[attr]
-
-            # Collect non-deterministic elements to remove
-            if elem.tag in self.NON_DETERMINISTIC_ELEMENTS:
-                nondeterministic_elements_to_remove.append(elem)
-
-            # Collect pPr elements for cleaning (but don't modify yet)
-            if elem.tag == f"{{{w_ns['w']}}}pPr":
-                ppr_elements_to_clean.append(elem)
-
-            # Collect rPr elements to remove (but don't modify yet)
-            if elem.tag == f"{{{w_ns['w']}}}rPr":
-                rpr_elements_to_remove.append(elem)
-
-        # Second pass: actually remove elements
-        # Clean pPr elements - keep pStyle and ind (only if no pStyle)
-        # If paragraph has a style, don't keep ind (style defines formatting)
-        # If paragraph has no style, keep ind for manual formatting
-        for elem in ppr_elements_to_clean:
-            children_to_remove = []
-            has_pStyle = False
-
-            # First pass: check if paragraph has pStyle
-            for child in elem:
-                if child.tag == f"{{{w_ns['w']}}}pStyle":
-                    has_pStyle = True
-                    break
-
-            # Second pass: decide what to keep/remove
-            for child in elem:
-                child_tag = child.tag
-                # Always keep pStyle
-                if child_tag == f"{{{w_ns['w']}}}pStyle":
-                    continue
-
-                # Keep ind only if there's no pStyle
-                if child_tag == f"{{{w_ns['w']}}}ind":
-                    if has_pStyle:
-                        children_to_remove.append(child)
-                    continue
-
-                # Keep jc (alignment) - this is important for preserving paragraph alignment
-                if child_tag == f"{{{w_ns['w']}}}jc":
-                    continue
-
-                # Remove all other direct formatting
-                children_to_remove.append(child)
-
-            for child in children_to_remove:
-                elem.remove(child)
-
-        # Remove all rPr elements
-        for elem in rpr_elements_to_remove:
-            parent = elem.getparent()
-            if parent is not None:
-                parent.remove(elem)
-
-        # Remove non-deterministic elements
-        for elem in nondeterministic_elements_to_remove:
-            parent = elem.getparent()
-            if parent is not None:
-                parent.remove(elem)
+        removed_count = self._clean_tree(root)
+        ctx.report.count("removed_paragraph_properties", removed_count)
+        if removed_count > 0:
+            logger.debug("Removed %s direct formatting paragraph properties", removed_count)
 
         # Merge adjacent runs that have no formatting
         # This reduces run fragmentation caused by removing direct formatting
         merged_count = self._merge_adjacent_runs(root, w_ns)
-
-        # Write back
-        tree.write(
-            document_path,
-            xml_declaration=True,
-            encoding='UTF-8',
-            standalone=True
-        )
-
-        if len(rpr_elements_to_remove) > 0:
-            print(f"[DEBUG] Removed {len(rpr_elements_to_remove)} rPr elements (direct formatting)", file=sys.stderr)
-        if len(nondeterministic_elements_to_remove) > 0:
-            print(f"[DEBUG] Removed {len(nondeterministic_elements_to_remove)} non-deterministic elements", file=sys.stderr)
+        ctx.report.count("merged_runs", merged_count)
         if merged_count > 0:
-            print(f"[DEBUG] Merged {merged_count} adjacent runs", file=sys.stderr)
+            logger.debug("Merged %s adjacent runs", merged_count)
 
-    def _merge_adjacent_runs(self, root, w_ns: dict) -> int:
+    def _clean_tree(self, root) -> int:
         """
-        Merge adjacent runs that have the same formatting (or no formatting).
+        Apply every cleanup rule to a document tree.
 
-        When direct formatting is removed, we often end up with adjacent runs
-        that have identical formatting (e.g., both have no rPr). These should
-        be merged to match template structure.
+        Attribute and element rules (NON_DETERMINISTIC_ATTRS, NON_DETERMINISTIC_ELEMENTS,
+        DIRECT_FORMATTING_ELEMENTS) run inside lxml; the pPr rule
+        (KEPT_PARAGRAPH_PROPERTIES) then visits only the w:pPr elements that are left.
 
         Args:
-            root: XML root element
-            w_ns: Word namespace dictionary
+            root: XML root element to clean
 
         Returns:
-            Number of merges performed
+            Number of paragraph property elements removed
         """
-        merged_count = 0
-
-        # Process each paragraph
-        for para in root.findall(".//w:p", namespaces=w_ns):
-            runs = para.findall("w:r", namespaces=w_ns)
-            if len(runs) < 2:
-                continue
+        w = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+        pStyle_tag, ind_tag = f"{w}pStyle", f"{w}ind"
+        kept = self.KEPT_PARAGRAPH_PROPERTIES
 
-            i = 0
-            while i < len(runs) - 1:
-                current_run = runs[i]
-                next_run = runs[i + 1]
+        etree.strip_attributes(root, *self.NON_DETERMINISTIC_ATTRS)
+        etree.strip_elements(root, *self.DIRECT_FORMATTING_ELEMENTS, *self.NON_DETERMINISTIC_ELEMENTS)
 
-                # Check if both runs can be merged
-                if self._can_merge_runs(current_run, next_run, w_ns):
-                    # Merge next_run into current_run
-                    self._merge_run_text(current_run, next_run, w_ns)
-
-                    # Remove next_run from paragraph
-                    para.remove(next_run)
-
-                    # Update runs list
-                    runs = para.findall("w:r", namespaces=w_ns)
-                    merged_count += 1
-                    # Don't increment i - check if we can merge with the new next run
-                else:
-                    i += 1
-
-        return merged_count
+        removed_count = 0
+        for pPr in root.iter(f"{w}pPr"):
+            # If paragraph has a style, don't keep ind (style defines formatting)
+            # If paragraph has no style, keep ind for manual formatting
+            has_pStyle = pPr.find(pStyle_tag) is not None
+            children_to_remove = [
+                child for child in pPr
+                if child.tag not in kept or (has_pStyle and child.tag == ind_tag)
+            ]
+            for child in children_to_remove:
+                pPr.remove(child)
+            removed_count += len(children_to_remove)
+        return removed_count
 
-    def _can_merge_runs(self, run1, run2, w_ns: dict) -> bool:
+    def _merge_adjacent_runs(self, root, w_ns: dict) -> int:
         """
-        Check if two runs can be merged.
+        Merge adjacent runs that have the same formatting (or no formatting).
 
-        Two runs can be merged if they have the same formatting (both have
-        identical rPr or both have no rPr).
+        When direct formatting is removed, we often end up with adjacent runs
+        that have identical formatting (e.g., both have no rPr). These should
+        be merged to match template structure.
 
         Args:
-            run1: First run element
-            run2: Second run element
+            root: XML root element
             w_ns: Word namespace dictionary
 
         Returns:
-            True if runs can be merged, False otherwise
-        """
-        # Don't merge if either run has special elements (tab, br, etc.)
-        # These should be preserved as separate runs
-        for run in [run1, run2]:
-            if run.find("w:tab", namespaces=w_ns) is not None:
-                return False
-            if run.find("w:br", namespaces=w_ns) is not None:
-                # Check if it's a page break (don't merge) or just line break (maybe merge)
-                br = run.find("w:br", namespaces=w_ns)
-                if br.get(f"{{{w_ns['w']}}}type") == "page":
-                    return False
-
-        # Get rPr elements
-        rpr1 = run1.find("w:rPr", namespaces=w_ns)
-        rpr2 = run2.find("w:rPr", namespaces=w_ns)
-
-        # If both have no rPr, they can be merged
-        if rpr1 is None and rpr2 is None:
-            return True
-
-        # If both have rPr, check if they're identical
-        if rpr1 is not None and rpr2 is not None:
-            # Compare rPr elements as strings
-            str1 = etree.tostring(rpr1, method='c14n')
-            str2 = etree.tostring(rpr2, method='c14n')
-            return str1 == str2
-
-        # One has rPr, one doesn't - can't merge
-        return False
-
-    def _merge_run_text(self, target_run, source_run, w_ns: dict) -> None:
+            Number of merges performed
         """
-        Merge text from source_run into target_run.
+        tab_tag = f"{{{w_ns['w']}}}tab"
+        br_tag = f"{{{w_ns['w']}}}br"
+        type_attr = f"{{{w_ns['w']}}}type"
 
-        Concatenates all w:t elements from source_run into target_run.
+        def is_separate(run) -> bool:
+            # Runs with special elements (tab, page break) are preserved as separate runs
+            if run.find(tab_tag) is not None:
+                return True
+            br = run.find(br_tag)
+            return br is not None and br.get(type_attr) == "page"
 
-        Args:
-            target_run: Run to merge into (will be kept)
-            source_run: Run to merge from (will be removed)
-            w_ns: Word namespace dictionary
-        """
-        # Find all text elements in both runs
-        target_texts = target_run.findall("w:t", namespaces=w_ns)
-        source_texts = source_run.findall("w:t", namespaces=w_ns)
-
-        if not target_texts:
-            # Target run has no text, just move source texts
-            for text_elem in source_texts:
-                target_run.append(text_elem)
-        elif not source_texts:
-            # Source run has no text, nothing to do
-            return
-        else:
-            # Both have text - concatenate the last target text with first source text
-            last_target = target_texts[-1]
-            first_source = source_texts[0]
-
-            if last_target.text and first_source.text:
-                last_target.text = last_target.text + first_source.text
-            elif first_source.text:
-                last_target.text = first_source.text
-
-            # Move remaining source texts
-            for text_elem in source_texts[1:]:
-                target_run.append(text_elem)
+        return merge_adjacent_runs(root, isolate=is_separate)
 
     def restore_batch(
         self,
@@ -0,0 +1,424 @@
+"""
+Paragraph index for WordprocessingML documents.
+
+This module provides the DocumentIndex class, which walks a document tree once and
+records, for every paragraph, the facts the restoration pipeline keeps asking for
+(text, paragraph style, table cell membership, drawings, page breaks, position), so
+stages read them from compact records instead of searching each paragraph again.
+It also provides :func:`table_fingerprint`, the structural key tables are matched by,
+and :func:`merge_adjacent_runs`, the run merging shared by restoration and comparison.
+"""
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from lxml import etree
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_P = _W + "p"
+_R = _W + "r"
+_RPR = _W + "rPr"
+_T = _W + "t"
+_TC = _W + "tc"
+_TR = _W + "tr"
+_GRIDCOL = _W + "gridCol"
+_TBLGRID = _W + "tblGrid"
+_TBL = _W + "tbl"
+_BR = _W + "br"
+_DRAWING = _W + "drawing"
+_PPR = _W + "pPr"
+_PSTYLE = _W + "pStyle"
+_TCPR = _W + "tcPr"
+_VMERGE = _W + "vMerge"
+_VAL = _W + "val"
+_TYPE = _W + "type"
+
+
+def table_fingerprint(tbl) -> Tuple[int, int, int, str]:
+    """
+    Compute the structural fingerprint of a table.
+
+    Column widths are left out on purpose: they are what table syncing changes.
+
+    Args:
+        tbl: w:tbl element
+
+    Returns:
+        (row count, cells in the first row, grid column count, header row text)
+    """
+    rows = tbl.findall(_TR)
+    grid = tbl.find(_TBLGRID)
+    header_cells = len(rows[0].findall(_TC)) if rows else 0
+    header_text = "".join([t.text for t in rows[0].iter(_T) if t.text]) if rows else ""
+    grid_columns = len(grid.findall(_GRIDCOL)) if grid is not None else 0
+    return len(rows), header_cells, grid_columns, header_text
+
+
+def merge_adjacent_runs(
+    root,
+    isolate: Optional[Callable[[etree._Element], bool]] = None,
+    carry: Optional[Callable[[etree._Element], bool]] = None,
+) -> int:
+    """
+    Merge adjacent runs with identical formatting (same w:rPr, or none) in every paragraph.
+
+    Each paragraph is merged in a single pass: a run's rPr signature is computed once,
+    and the text appended to a run is joined once per w:t element instead of once per
+    merged run.
+
+    When a run is merged into the previous one, its first w:t is appended to the
+    previous run's last w:t (its other w:t elements are moved over), and the run is
+    removed along with any other children not kept by ``carry``.
+
+    Args:
+        root: Element containing the paragraphs
+        isolate: Optional predicate; runs it accepts are never merged with a neighbour
+        carry: Optional predicate; non-text children it accepts are moved, after the
+               text, into the run they are merged into (default: none are moved)
+
+    Returns:
+        Number of runs merged away
+    """
+    merged_count = 0
+
+    for para in list(root.iterdescendants(_P)):
+        runs = para.findall(_R)
+        if len(runs) < 2:
+            continue
+
+        head = head_signature = last_text = None
+        pending: List[str] = []  # Text waiting to be appended to last_text
+
+        for run in runs:
+            rPr = run.find(_RPR)
+            signature = etree.tostring(rPr, method="c14n") if rPr is not None else None
+            isolated = isolate is not None and isolate(run)
+
+            if head is None or isolated or signature != head_signature:
+                if pending:
+                    last_text.text = (last_text.text or "") + "".join(pending)
+                    pending = []
+                head = None if isolated else run
+                head_signature = signature
+                if head is not None:
+                    texts = head.findall(_T)
+                    last_text = texts[-1] if texts else None
+                continue
+
+            texts = run.findall(_T)
+            carried = [child for child in run if child.tag != _T and carry(child)] if carry else []
+            if last_text is None:
+                head.extend(texts)
+                if texts:
+                    last_text = texts[-1]
+            elif texts:
+                if texts[0].text:
+                    pending.append(texts[0].text)
+                if len(texts) > 1:
+                    # The head's last w:t changes, so its pending text is written now
+                    if pending:
+                        last_text.text = (last_text.text or "") + "".join(pending)
+                        pending = []
+                    head.extend(texts[1:])
+                    last_text = texts[-1]
+            head.extend(carried)
+
+            para.remove(run)
+            merged_count += 1
+
+        if pending:
+            last_text.text = (last_text.text or "") + "".join(pending)
+
+    return merged_count
+
+
+class ParagraphRecord:
+    """
+    Facts about one paragraph, as of the last index update.
+
+    Attributes:
+        element: The w:p element
+        position: Index in document order among all paragraphs
+        sibling_position: Index among the children of the element's parent (as of
+                          the last index update; editing non-paragraph siblings
+                          outside the index does not renumber it)
+        text: Joined text of all w:t descendants
+        text_nodes: The w:t descendants, in document order
+        style: Paragraph style ID (w:pPr/w:pStyle/@w:val), or None
+        in_table_cell: True if the paragraph is inside a table cell
+        vmerge_restart: True if the nearest enclosing cell starts a vertical merge
+        has_drawing: True if the paragraph contains a drawing
+        has_table: True if the paragraph contains a table
+        has_page_break: True if the paragraph contains a page break
+
+    Inside :meth:`DocumentIndex.batch`, positions are only brought up to date when
+    the batch ends.
+    """
+
+    __slots__ = (
+        "element", "position", "sibling_position", "text", "text_nodes", "style",
+        "in_table_cell", "vmerge_restart", "has_drawing", "has_table", "has_page_break",
+    )
+
+    def __init__(self, element, position: int, sibling_position: int):
+        self.element = element
+        self.position = position
+        self.sibling_position = sibling_position
+        self.text = ""
+        self.text_nodes: List[etree._Element] = []
+        self.style: Optional[str] = None
+        self.in_table_cell = False
+        self.vmerge_restart = False
+        self.has_drawing = False
+        self.has_table = False
+        self.has_page_break = False
+
+
+class DocumentIndex:
+    """
+    Paragraph records of a document, built in a single traversal.
+
+    Stages that change what a record describes keep it current: text edits are
+    picked up with :meth:`refresh_texts`, style changes by setting
+    :attr:`ParagraphRecord.style`, and paragraphs are added or dropped through
+    :meth:`insert` and :meth:`remove`, which update the tree and the records together.
+    Stages inserting many paragraphs wrap the inserts in :meth:`batch`, so positions
+    are renumbered once instead of after every insert.
+    """
+
+    def __init__(self, root):
+        """
+        Index every paragraph under ``root``.
+
+        Args:
+            root: Document root element (or any element containing paragraphs)
+        """
+        self.root = root
+        self.paragraphs: List[ParagraphRecord] = self._scan(root, False, False)
+        self._records: Dict[etree._Element, ParagraphRecord] = {}
+        self._add_records(self.paragraphs)
+
+        # Inserts not yet merged into self.paragraphs: reference record -> new records
+        # placed right before it, in insertion order (see batch())
+        self._pending: Dict[ParagraphRecord, List[ParagraphRecord]] = {}
+        self._pending_parents: Dict[int, etree._Element] = {}
+        self._batch_depth = 0
+
+    def __len__(self) -> int:
+        return len(self.paragraphs)
+
+    def __iter__(self) -> Iterator[ParagraphRecord]:
+        return iter(self.paragraphs)
+
+    def get(self, paragraph) -> Optional[ParagraphRecord]:
+        """
+        Get the record of a paragraph element.
+
+        Args:
+            paragraph: w:p element
+
+        Returns:
+            ParagraphRecord, or None if the element is not an indexed paragraph
+        """
+        return self._records.get(paragraph)
+
+    def refresh_texts(self) -> None:
+        """Re-join the text of every paragraph after w:t nodes were edited in place."""
+        for record in self.paragraphs:
+            record.text = "".join([t.text for t in record.text_nodes if t.text])
+
+    @contextmanager
+    def batch(self):
+        """
+        Defer the position bookkeeping of :meth:`insert` calls until the block ends.
+
+        The tree and :meth:`get` are updated immediately; :attr:`paragraphs` and the
+        record positions are rebuilt once, in a single pass, when the batch ends.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._flush()
+
+    def insert(self, paragraph, before) -> ParagraphRecord:
+        """
+        Insert a new paragraph into the tree, right before an indexed paragraph.
+
+        Args:
+            paragraph: New w:p element (not yet in the tree)
+            before: Indexed paragraph element the new one precedes
+
+        Returns:
+            Record of the inserted paragraph
+        """
+        reference = self._records[before]
+        # Inserting next to the reference needs no lookup of its index in the parent
+        before.addprevious(paragraph)
+
+        # The new paragraph shares the reference's parent, hence its enclosing cell
+        records = self._scan(paragraph, reference.in_table_cell, reference.vmerge_restart)
+        for record in records:
+            record.position = reference.position
+            self._records[record.element] = record
+            parent = record.element.getparent()
+            self._pending_parents[id(parent)] = parent
+        self._pending.setdefault(reference, []).extend(records)
+        self._refresh_enclosing(paragraph)
+
+        if not self._batch_depth:
+            self._flush()
+        return records[0]
+
+    def remove(self, paragraphs: Iterable) -> int:
+        """
+        Remove paragraphs from the tree, along with the records of them and of any
+        paragraphs nested inside them.
+
+        Args:
+            paragraphs: Indexed paragraph elements
+
+        Returns:
+            Number of paragraphs removed from the tree
+        """
+        self._flush()
+
+        removed = set()
+        parents = {}
+        count = 0
+        for paragraph in paragraphs:
+            parent = paragraph.getparent()
+            if parent is None:
+                continue
+            removed.update(paragraph.iter(_P))
+            parent.remove(paragraph)
+            parents[id(parent)] = parent
+            count += 1
+
+        if removed:
+            self.paragraphs = [record for record in self.paragraphs if record.element not in removed]
+            for element in removed:
+                self._records.pop(element, None)
+            self._renumber(0)
+            for parent in parents.values():
+                self._renumber_siblings(parent)
+                self._refresh_enclosing(parent)
+        return count
+
+    def _flush(self) -> None:
+        """Merge pending inserts into :attr:`paragraphs` and renumber positions."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        parents, self._pending_parents = self._pending_parents, {}
+
+        def place(record: ParagraphRecord) -> None:
+            # Paragraphs inserted before a record come first (they may have their own)
+            for inserted in pending.pop(record, ()):
+                place(inserted)
+            paragraphs.append(record)
+
+        paragraphs: List[ParagraphRecord] = []
+        for record in self.paragraphs:
+            place(record)
+        self.paragraphs = paragraphs
+        self._renumber(0)
+        for parent in parents.values():
+            self._renumber_siblings(parent)
+
+    def _refresh_enclosing(self, element) -> None:
+        """Re-derive the content facts of indexed paragraphs enclosing ``element`` (text boxes)."""
+        for ancestor in element.iterancestors(_P):
+            record = self._records.get(ancestor)
+            if record is None:
+                continue
+            record.text_nodes = list(ancestor.iter(_T))
+            record.text = "".join([t.text for t in record.text_nodes if t.text])
+            record.has_drawing = next(ancestor.iter(_DRAWING), None) is not None
+            record.has_table = next(ancestor.iter(_TBL), None) is not None
+            record.has_page_break = any(br.get(_TYPE) == "page" for br in ancestor.iter(_BR))
+
+    def _add_records(self, records: List[ParagraphRecord]) -> None:
+        """Register records and number their siblings (once per distinct parent)."""
+        parents = {}
+        for record in records:
+            self._records[record.element] = record
+            parent = record.element.getparent()
+            if parent is not None:
+                parents[id(parent)] = parent
+        for parent in parents.values():
+            self._renumber_siblings(parent)
+
+    def _renumber(self, start: int) -> None:
+        paragraphs = self.paragraphs
+        for position in range(start, len(paragraphs)):
+            paragraphs[position].position = position
+
+    def _renumber_siblings(self, parent) -> None:
+        records = self._records
+        for sibling_position, child in enumerate(parent):
+            record = records.get(child)
+            if record is not None:
+                record.sibling_position = sibling_position
+
+    @staticmethod
+    def _scan(root, in_table_cell: bool, vmerge_restart: bool) -> List[ParagraphRecord]:
+        """
+        Walk ``root`` once and build the records of the paragraphs it contains.
+
+        Args:
+            root: Element to walk (may itself be a paragraph)
+            in_table_cell: Whether ``root`` is inside a table cell
+            vmerge_restart: Whether the cell enclosing ``root`` restarts a vertical merge
+
+        Returns:
+            Records in document order (sibling positions are set by the caller)
+        """
+        records: List[ParagraphRecord] = []
+        open_paragraphs: List[ParagraphRecord] = []  # Paragraphs enclosing the current element
+        cells = [vmerge_restart] if in_table_cell else []  # vMerge restart flag of enclosing cells
+
+        events = etree.iterwalk(root, events=("start", "end"), tag=(_P, _T, _TC, _TBL, _BR, _DRAWING))
+        for event, elem in events:
+            tag = elem.tag
+            if event == "end":
+                if tag == _P:
+                    record = open_paragraphs.pop()
+                    record.text = "".join([t.text for t in record.text_nodes if t.text])
+                elif tag == _TC:
+                    cells.pop()
+                continue
+
+            if tag == _P:
+                record = ParagraphRecord(elem, len(records), 0)
+                pPr = elem.find(_PPR)
+                if pPr is not None:
+                    pStyle = pPr.find(_PSTYLE)
+                    if pStyle is not None:
+                        record.style = pStyle.get(_VAL)
+                if cells:
+                    record.in_table_cell = True
+                    record.vmerge_restart = cells[-1]
+                records.append(record)
+                open_paragraphs.append(record)
+            elif tag == _T:
+                for record in open_paragraphs:
+                    record.text_nodes.append(elem)
+            elif tag == _TC:
+                restart = False
+                tcPr = elem.find(_TCPR)
+                if tcPr is not None:
+                    vMerge = tcPr.find(_VMERGE)
+                    restart = vMerge is not None and vMerge.get(_VAL) == "restart"
+                cells.append(restart)
+            elif tag == _TBL:
+                for record in open_paragraphs:
+                    record.has_table = True
+            elif tag == _DRAWING:
+                for record in open_paragraphs:
+                    record.has_drawing = True
+            elif elem.get(_TYPE) == "page":
+                for record in open_paragraphs:
+                    record.has_page_break = True
+        return records
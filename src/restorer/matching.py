@@ -0,0 +1,863 @@
+"""
+Paragraph matching helpers for Word documents.
+
+This module provides the NgramIndex class, a character bigram inverted index that
+narrows fuzzy paragraph matching down to the few texts that can possibly reach the
+similarity threshold before ``difflib.SequenceMatcher`` scores them, the shared
+similarity helpers (:func:`ratio_above`, :func:`best_match`) that prune the remaining
+comparisons with cheap upper bounds, and the ParagraphAlignment class that computes
+target/template paragraph matches once for all sync stages of a conversion.
+
+When NumPy is installed, the VectorIndex class shortlists candidates for many texts
+at once with blocked matrix multiplies; it is used for large batches of lookups whose
+bigrams are common enough to make the inverted index slow (see
+``ParagraphAlignment.VECTORIZE_MIN_DENSITY``).
+The MinHashIndex class trades exactness for sub-linear lookups on huge templates and
+is only used when enabled (see ``ParagraphAlignment.APPROXIMATE_MIN_PAIRS``).
+"""
+
+import logging
+import zlib
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+def bigrams(text: str) -> Counter:
+    """
+    Count the character bigrams of a text.
+
+    Args:
+        text: Text to split (CJK text is handled per character, so bigrams work
+              without word segmentation)
+
+    Returns:
+        Counter mapping each bigram to its number of occurrences
+    """
+    return Counter(text[i:i + 2] for i in range(len(text) - 1))
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Compute the ``SequenceMatcher`` ratio of two texts.
+
+    Args:
+        a: First text
+        b: Second text
+
+    Returns:
+        Similarity ratio between 0.0 and 1.0
+    """
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class MatcherCache:
+    """
+    SequenceMatcher objects keyed by their second sequence.
+
+    SequenceMatcher indexes its second sequence when it is set; keeping one matcher
+    per reference text lets every comparison against that text reuse the index and
+    only swap the first sequence.
+    """
+
+    def __init__(self):
+        self._matchers: Dict[str, SequenceMatcher] = {}
+
+    def matcher(self, a: str, b: str) -> SequenceMatcher:
+        """
+        Get a matcher comparing ``a`` with ``b``.
+
+        Args:
+            a: First sequence (changes between calls)
+            b: Second sequence (cached)
+
+        Returns:
+            SequenceMatcher with both sequences set
+        """
+        matcher = self._matchers.get(b)
+        if matcher is None:
+            matcher = SequenceMatcher(None, a, b)
+            self._matchers[b] = matcher
+        else:
+            matcher.set_seq1(a)
+        return matcher
+
+
+def ratio_above(a: str, b: str, threshold: float, cache: Optional[MatcherCache] = None) -> float:
+    """
+    Compute the ``SequenceMatcher`` ratio of two texts if it exceeds a threshold.
+
+    The exact ratio is only computed when the cheap upper bounds allow it: the
+    length bound (same as ``real_quick_ratio``), then ``quick_ratio``. The result is
+    identical to ``SequenceMatcher(None, a, b).ratio()`` whenever that exceeds
+    ``threshold``.
+
+    Args:
+        a: First text
+        b: Second text
+        threshold: Ratio that must be exceeded
+        cache: Optional matcher cache keyed by ``b``
+
+    Returns:
+        The ratio, or 0.0 if it does not exceed ``threshold``
+    """
+    if a == b:
+        return 1.0 if threshold < 1.0 else 0.0
+
+    la, lb = len(a), len(b)
+    # real_quick_ratio without building a matcher
+    if 2.0 * min(la, lb) / (la + lb) <= threshold:
+        return 0.0
+
+    matcher = cache.matcher(a, b) if cache is not None else SequenceMatcher(None, a, b)
+    if matcher.quick_ratio() <= threshold:
+        return 0.0
+    ratio = matcher.ratio()
+    return ratio if ratio > threshold else 0.0
+
+
+def best_match(
+    text: str,
+    candidates: Iterable[Tuple[object, str]],
+    threshold: float = 0.9,
+    cache: Optional[MatcherCache] = None,
+    text_first: bool = True,
+) -> Tuple[Optional[object], float]:
+    """
+    Find the candidate most similar to a text.
+
+    The first candidate with the highest ratio wins, as in a plain scan. Candidates
+    that cannot beat the best ratio so far are pruned with :func:`ratio_above`, and
+    the scan stops at the first identical text.
+
+    Args:
+        text: Text to match
+        candidates: (key, candidate text) pairs in preference order
+        threshold: Ratio a match must exceed
+        cache: Optional matcher cache keyed by the second sequence
+        text_first: If True, ``text`` is the matcher's first sequence; otherwise
+                    the candidate is (ratios are not symmetric)
+
+    Returns:
+        (key, ratio) of the best candidate, or (None, 0.0) if none exceeds ``threshold``
+    """
+    best_key, best_ratio = None, 0.0
+    for key, candidate in candidates:
+        floor = max(threshold, best_ratio)
+        if text_first:
+            ratio = ratio_above(text, candidate, floor, cache)
+        else:
+            ratio = ratio_above(candidate, text, floor, cache)
+        if ratio > best_ratio:
+            best_key, best_ratio = key, ratio
+            if ratio == 1.0:
+                break
+    return best_key, best_ratio
+
+
+class NgramIndex:
+    """
+    Character bigram inverted index over a list of texts.
+
+    For two texts of total length T whose ``SequenceMatcher`` ratio is r, the
+    matching blocks cover M = r*T/2 characters. Every character outside those blocks
+    breaks at most two bigrams of the first text, and every boundary between two
+    blocks that touch in the first text implies an unmatched character in the second
+    one, so at least 3M - T - 1 bigrams stay intact and appear in both texts. Hence
+    a text can only exceed the threshold t if it shares at least (1.5t - 1)*T - 1
+    bigrams with the query and the shorter text is at least t*T/2 long.
+    :meth:`candidates` returns exactly the texts that pass both bounds, so scoring
+    only them gives the same result as scoring every text.
+    """
+
+    def __init__(self, texts: Sequence[str], threshold: float = 0.9):
+        """
+        Build the index.
+
+        Args:
+            texts: Texts to index; empty texts are never returned as candidates
+            threshold: Similarity ratio a candidate must be able to exceed
+        """
+        self.texts = texts
+        self.threshold = threshold
+        # Bigram -> [(text index, occurrences in that text)], in index order
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        # Text length -> text indices, for queries too short for the bigram bound
+        self._by_length: Dict[int, List[int]] = defaultdict(list)
+
+        for idx, text in enumerate(texts):
+            if not text:
+                continue
+            self._by_length[len(text)].append(idx)
+            for gram, count in bigrams(text).items():
+                self._postings[gram].append((idx, count))
+
+    def candidates(self, text: str) -> List[int]:
+        """
+        Get the indices of texts whose ratio with ``text`` can exceed the threshold.
+
+        Args:
+            text: Query text
+
+        Returns:
+            Candidate text indices in ascending order
+        """
+        la = len(text)
+        if not la:
+            return []
+
+        threshold = self.threshold
+        # Minimum shared bigrams is slack * T - 1 (small epsilon guards float rounding)
+        slack = 1.5 * threshold - 1
+        shared: Dict[int, int] = defaultdict(int)
+        for gram, count in bigrams(text).items():
+            for idx, other_count in self._postings.get(gram, ()):
+                shared[idx] += min(count, other_count)
+
+        result = []
+        for idx, common in shared.items():
+            lb = len(self.texts[idx])
+            total = la + lb
+            if 2 * min(la, lb) + 1e-9 >= threshold * total and common + 1e-9 >= slack * total - 1:
+                result.append(idx)
+
+        # Very short pairs can exceed the threshold without sharing any bigram
+        # (e.g. two identical single characters), so add them by length
+        if slack * (la + 1) - 1 <= 0:
+            for lb, indices in self._by_length.items():
+                total = la + lb
+                if slack * total - 1 > 0 or 2 * min(la, lb) + 1e-9 < threshold * total:
+                    continue
+                result.extend(idx for idx in indices if idx not in shared)
+
+        result.sort()
+        return result
+
+    def density(self, queries: Sequence[str]) -> float:
+        """
+        Measure how many postings a query visits, per indexed text.
+
+        :meth:`candidates` costs about this many steps per indexed text, while a
+        :class:`VectorIndex` lookup costs a fixed amount per text, so the density
+        tells which of the two is cheaper for similar queries. Latin text, built from
+        few distinct bigrams, typically has densities above 1; CJK text well below.
+
+        Args:
+            queries: Sample of query texts
+
+        Returns:
+            Average postings visited per query, divided by the number of indexed texts
+        """
+        if not len(queries) or not len(self.texts):
+            return 0.0
+        visited = sum(
+            len(self._postings.get(gram, ()))
+            for text in queries
+            for gram in bigrams(text)
+        )
+        return visited / len(queries) / len(self.texts)
+
+    def candidates_each(self, queries: Sequence[str]) -> List[List[int]]:
+        """
+        Get candidate text indices for every query (see :meth:`candidates`).
+
+        Args:
+            queries: Query texts
+
+        Returns:
+            For each query, the candidate text indices in ascending order
+        """
+        return [self.candidates(text) for text in queries]
+
+
+class VectorIndex:
+    """
+    Batch candidate search over hashed bigram vectors (requires NumPy).
+
+    Each text becomes a vector holding the square root of its bigram counts, with
+    bigrams hashed into DIMENSIONS buckets. Since min(a, b) <= sqrt(a*b), and hashing
+    only merges buckets (which cannot lower the dot product of non-negative vectors),
+    the dot product of two vectors is an upper bound of the number of bigrams the
+    texts share. Applying the :class:`NgramIndex` bounds to it therefore never drops
+    a text that could exceed the threshold: the result is a superset of
+    :meth:`NgramIndex.candidates`, and scoring it gives the same matches.
+
+    Queries and texts are processed in blocks of BLOCK_SIZE rows, so memory stays
+    bounded by the block size rather than by the size of the documents.
+
+    The cost of a lookup is proportional to the number of texts whatever their
+    content, whereas :meth:`NgramIndex.candidates` only visits the texts that share
+    a bigram with the query. This index therefore pays off for large batches of
+    queries made of common bigrams (typically Latin text)
+    and loses to the inverted index on sparse ones (most CJK text), which is why
+    ParagraphAlignment picks it by measured density rather than by size alone.
+    """
+
+    DIMENSIONS = 4096
+    BLOCK_SIZE = 512
+
+    def __init__(self, texts: Sequence[str], threshold: float = 0.9):
+        """
+        Encode the texts.
+
+        Args:
+            texts: Texts to index; empty texts are never returned as candidates
+            threshold: Similarity ratio a candidate must be able to exceed
+        """
+        if np is None:
+            raise ImportError("VectorIndex requires NumPy")
+        self.texts = texts
+        self.threshold = threshold
+        self._buckets: Dict[str, int] = {}
+        self._encoded = self._encode(texts)
+
+    @staticmethod
+    def available() -> bool:
+        """Return True if NumPy is installed."""
+        return np is not None
+
+    def candidates_many(self, queries: Sequence[str]) -> List[List[int]]:
+        """
+        Get candidate text indices for every query.
+
+        Args:
+            queries: Query texts
+
+        Returns:
+            For each query, the indices of texts whose ratio with it may exceed the
+            threshold, in ascending order
+        """
+        result: List[List[int]] = [[] for _ in queries]
+        if not len(queries) or not len(self.texts):
+            return result
+
+        threshold = self.threshold
+        slack = 1.5 * threshold - 1
+        block = self.BLOCK_SIZE
+        encoded = self._encode(queries)
+        query_lengths, text_lengths = encoded[3], self._encoded[3]
+
+        for q_start in range(0, len(queries), block):
+            q_end = min(q_start + block, len(queries))
+            q_vectors = self._dense(encoded, q_start, q_end)
+            la = query_lengths[q_start:q_end, None]
+            for t_start in range(0, len(self.texts), block):
+                t_end = min(t_start + block, len(self.texts))
+                lb = text_lengths[None, t_start:t_end]
+                total = la + lb
+                # Length bound first; skip the multiply if no pair in the block passes it
+                mask = (la > 0) & (lb > 0) & (2 * np.minimum(la, lb) + 1e-9 >= threshold * total)
+                if not mask.any():
+                    continue
+                shared = q_vectors @ self._dense(self._encoded, t_start, t_end).T
+                # Float32 rounding is covered by a generous tolerance (the bound only prunes)
+                needed = slack * total - 1
+                mask &= (needed <= 0) | (shared * 1.0001 + 1e-3 >= needed)
+                rows, cols = np.nonzero(mask)
+                for row, col in zip(rows.tolist(), cols.tolist()):
+                    result[q_start + row].append(t_start + col)
+        return result
+
+    def _encode(self, texts: Sequence[str]):
+        """Encode texts as sparse rows: (row offsets, bucket indices, values, lengths)."""
+        buckets = self._buckets
+        mask = self.DIMENSIONS - 1
+        offsets = [0]
+        indices: List[int] = []
+        values: List[float] = []
+        for text in texts:
+            row: Dict[int, int] = defaultdict(int)
+            for gram, count in bigrams(text).items():
+                bucket = buckets.get(gram)
+                if bucket is None:
+                    # crc32 rather than hash(): stable across processes
+                    bucket = zlib.crc32(gram.encode("utf-8")) & mask
+                    buckets[gram] = bucket
+                row[bucket] += count
+            indices.extend(row.keys())
+            values.extend(row.values())
+            offsets.append(len(indices))
+        return (
+            np.array(offsets, dtype=np.int64),
+            np.array(indices, dtype=np.int64),
+            np.sqrt(np.array(values, dtype=np.float32)),
+            np.array([len(text) for text in texts], dtype=np.float64),
+        )
+
+    def _dense(self, encoded, start: int, end: int):
+        """Expand rows [start, end) of an encoding into a dense block."""
+        offsets, indices, values, _ = encoded
+        lo, hi = offsets[start], offsets[end]
+        rows = np.repeat(np.arange(end - start), np.diff(offsets[start:end + 1]))
+        dense = np.zeros((end - start, self.DIMENSIONS), dtype=np.float32)
+        dense[rows, indices[lo:hi]] = values[lo:hi]
+        return dense
+
+
+class MinHashIndex:
+    """
+    Locality-sensitive hashing index over the bigram shingles of a list of texts.
+
+    Every text gets a MinHash signature of BANDS * ROWS values (one-permutation
+    hashing: each shingle is hashed once into one of the signature's bins, and empty
+    bins borrow the value of the next non-empty one). Signatures are cut into BANDS
+    bands of ROWS values, and texts whose band values are identical for at least one
+    band share a bucket. Two texts with shingle Jaccard similarity J become
+    candidates with probability 1 - (1 - J**ROWS)**BANDS, so lookups only touch a
+    few buckets instead of every text.
+
+    Unlike :class:`NgramIndex`, this index is approximate: a text above the ratio
+    threshold is missed with a small probability. More bands raise recall, more rows
+    cut false candidates; ``tests/test_matching.py`` checks the recall of the
+    default settings against the exhaustive matcher.
+    """
+
+    BANDS = 32
+    ROWS = 4
+
+    def __init__(self, texts: Sequence[str], bands: Optional[int] = None, rows: Optional[int] = None):
+        """
+        Build the index.
+
+        Args:
+            texts: Texts to index; empty texts are never returned as candidates
+            bands: Number of bands (defaults to BANDS)
+            rows: Signature values per band (defaults to ROWS)
+        """
+        self.texts = texts
+        self.bands = bands or self.BANDS
+        self.rows = rows or self.ROWS
+        self._hashes: Dict[str, int] = {}
+        # One bucket table per band: band values -> text indices, in index order
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [
+            defaultdict(list) for _ in range(self.bands)
+        ]
+
+        for idx, text in enumerate(texts):
+            if not text:
+                continue
+            for band, key in enumerate(self._band_keys(text)):
+                self._buckets[band][key].append(idx)
+
+    def candidates(self, text: str) -> List[int]:
+        """
+        Get the indices of texts sharing at least one band with ``text``.
+
+        Args:
+            text: Query text
+
+        Returns:
+            Candidate text indices in ascending order
+        """
+        if not text:
+            return []
+        found = set()
+        for band, key in enumerate(self._band_keys(text)):
+            found.update(self._buckets[band].get(key, ()))
+        return sorted(found)
+
+    def signature(self, text: str) -> List[int]:
+        """
+        Compute the MinHash signature of a non-empty text.
+
+        Args:
+            text: Text to sign
+
+        Returns:
+            BANDS * ROWS signature values
+        """
+        size = self.bands * self.rows
+        hashes = self._hashes
+        # Texts shorter than a bigram are their own single shingle
+        shingles = set(text[i:i + 2] for i in range(len(text) - 1)) or {text}
+
+        bins: List[Optional[int]] = [None] * size
+        for shingle in shingles:
+            value = hashes.get(shingle)
+            if value is None:
+                # crc32 rather than hash(): stable across processes
+                value = zlib.crc32(shingle.encode("utf-8"))
+                hashes[shingle] = value
+            slot, rest = value % size, value // size
+            if bins[slot] is None or rest < bins[slot]:
+                bins[slot] = rest
+
+        # Densify: an empty bin takes the next non-empty bin's value, tagged with the
+        # distance so borrowed values only collide with values borrowed the same way
+        signature = [0] * size
+        source = next(slot for slot in range(size) if bins[slot] is not None) + size
+        for slot in range(size - 1, -1, -1):
+            if bins[slot] is not None:
+                source = slot
+            signature[slot] = bins[source % size] * size + (source - slot)
+        return signature
+
+    def _band_keys(self, text: str) -> List[Tuple[int, ...]]:
+        signature = self.signature(text)
+        rows = self.rows
+        return [tuple(signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+
+def _score_positions(
+    text: str,
+    positions: Iterable[int],
+    texts: Sequence[str],
+    threshold: float,
+    cache: Optional[MatcherCache] = None,
+) -> List[Tuple[int, float]]:
+    """Get the (index, ratio) of the texts at ``positions`` whose ratio with ``text`` exceeds the threshold."""
+    scored = []
+    for i in positions:
+        ratio = ratio_above(text, texts[i], threshold, cache)
+        if ratio:
+            scored.append((i, ratio))
+    return scored
+
+
+def _score_windows(
+    entries: Sequence[Tuple[str, int, int]],
+    texts: Sequence[str],
+    threshold: float,
+    shortlist: Callable[[List[str]], List[List[int]]],
+    cache: Optional[MatcherCache] = None,
+) -> List[List[Tuple[int, float]]]:
+    """
+    Score texts against the texts inside their windows, then elsewhere if needed.
+
+    Windows are scored position by position, so their cost does not depend on the
+    size of ``texts``; only the texts with no match inside their window are looked
+    up in an index (``shortlist``), all at once.
+
+    Args:
+        entries: (text, first, last) per text to score (the matchers' first
+                 sequence), with the window's first and last indices, inclusive
+        texts: Texts the windows refer to
+        threshold: Ratio a match must exceed
+        shortlist: Maps query texts to their candidate indices into ``texts``
+                   (ascending; a superset of the indices that can exceed the threshold)
+        cache: Optional matcher cache keyed by the candidate text
+
+    Returns:
+        Per entry, (index, ratio) of the texts inside the window whose ratio exceeds
+        the threshold, or of those outside it if none inside does
+    """
+    results = [
+        _score_positions(text, range(first, last + 1), texts, threshold, cache)
+        for text, first, last in entries
+    ]
+    missing = [n for n, scored in enumerate(results) if not scored]
+    if missing:
+        for n, candidates in zip(missing, shortlist([entries[n][0] for n in missing])):
+            text, first, last = entries[n]
+            outside = (i for i in candidates if not first <= i <= last)
+            results[n] = _score_positions(text, outside, texts, threshold, cache)
+    return results
+
+
+class ParagraphMatch:
+    """
+    Template match candidates of one target paragraph.
+
+    Attributes:
+        paragraph: Target paragraph element
+        text: Paragraph text (joined w:t texts)
+        style: Paragraph style ID, or None
+        exact: Template paragraph positions with identical text inside the search
+               window, in document order
+        window: (first, last) template positions searched first
+    """
+
+    __slots__ = ("paragraph", "position", "text", "style", "exact", "window", "scored")
+
+    def __init__(self, paragraph, position: int, text: str, style: Optional[str]):
+        self.paragraph = paragraph
+        self.position = position
+        self.text = text
+        self.style = style
+        self.exact: Sequence[int] = ()
+        self.window: Tuple[int, int] = (0, -1)
+        # (template position, ratio) of every template paragraph above the threshold,
+        # scored on first use
+        self.scored: Optional[List[Tuple[int, float]]] = None
+
+
+class ParagraphAlignment:
+    """
+    Order-aware similarity matches between target and template paragraphs.
+
+    Computed once per conversion and shared by every sync stage. Paragraphs whose
+    text is unique in both documents are anchors; as in patience diff, the longest
+    run of anchors that appear in the same order in both documents pins those
+    paragraphs to each other. Every other paragraph is searched for between its
+    neighbouring anchors, within SEARCH_RADIUS paragraphs of its interpolated
+    position, and only falls back to the whole document when nothing in that window
+    exceeds the threshold. This keeps matching roughly linear and stops repeated
+    texts (e.g. a "定义" heading) from matching an occurrence far away.
+
+    The alignment only records candidates; each stage applies its own selection rule
+    (style bonus, captions only, ...). Fuzzy scores are computed lazily, so
+    paragraphs resolved by an exact text match never pay for ``SequenceMatcher``.
+    """
+
+    # Paragraphs searched on each side of the interpolated position inside a gap
+    SEARCH_RADIUS = 40
+
+    # Fuzzy candidates of paragraphs with no match inside their window are shortlisted
+    # in one batch with VectorIndex (if NumPy is installed) when there are at least
+    # this many (paragraph x template paragraph) pairs to search, and the template's
+    # NgramIndex visits at least VECTORIZE_MIN_DENSITY postings per template paragraph
+    # for them (see NgramIndex.density); otherwise the NgramIndex is faster
+    VECTORIZE_MIN_PAIRS = 1_000_000
+    VECTORIZE_MIN_DENSITY = 0.15
+
+    # Paragraphs sampled to measure the density
+    DENSITY_SAMPLE = 64
+
+    # Target x template paragraph pairs from which candidates come from the template's
+    # MinHashIndex instead. LSH may miss matches, so this is off (None) by default
+    APPROXIMATE_MIN_PAIRS: Optional[int] = None
+
+    def __init__(self, target, template, threshold: float = 0.9):
+        """
+        Record the target paragraphs and anchor them to the template.
+
+        Args:
+            target: DocumentIndex of the target document (texts and styles are
+                    taken from its records as they are now)
+            template: CompiledTemplate providing template texts and indexes
+            threshold: Ratio a match must exceed
+        """
+        self.template = template
+        self.threshold = threshold
+        self.paragraphs = [record.element for record in target]
+        self.texts: List[str] = []
+        self._matches: Dict[object, ParagraphMatch] = {}
+        self._target_index: Optional[NgramIndex] = None
+        self._target_positions: Dict[str, List[int]] = {}
+        self._best_targets: Dict[int, Optional[Tuple[object, float]]] = {}
+        self._prescored = False
+        # Template texts are always the matchers' second sequence
+        self._matchers = MatcherCache()
+
+        for k, record in enumerate(target):
+            text = record.text
+            self.texts.append(text)
+            if not text:
+                continue
+            self._target_positions.setdefault(text, []).append(k)
+            self._matches[record.element] = ParagraphMatch(record.element, k, text, record.style)
+
+        self._find_anchors()
+
+        for match in self._matches.values():
+            j = self._anchor_by_target.get(match.position)
+            if j is not None:
+                match.exact = [j]
+                match.window = (j, j)
+                match.scored = [(j, 1.0)]
+                continue
+            first, last = self._window(match.position, self._target_anchors, self._template_anchors,
+                                       len(self.paragraphs), len(template.paragraphs))
+            match.window = (first, last)
+            match.exact = [i for i in template.text_positions.get(match.text, ()) if first <= i <= last]
+
+    def get(self, paragraph) -> Optional[ParagraphMatch]:
+        """
+        Get the match record of a target paragraph.
+
+        Args:
+            paragraph: Target paragraph element
+
+        Returns:
+            ParagraphMatch, or None if the paragraph has no text (or is not aligned)
+        """
+        return self._matches.get(paragraph)
+
+    def scored(self, match: ParagraphMatch) -> List[Tuple[int, float]]:
+        """
+        Get every template paragraph whose ratio with the target exceeds the threshold.
+
+        Paragraphs inside the match's window are returned if any of them qualifies;
+        otherwise every template paragraph is considered.
+
+        Args:
+            match: Match record from :meth:`get`
+
+        Returns:
+            (template position, ratio) tuples in template order
+        """
+        if match.scored is None and not self._prescored:
+            self._prescored = True
+            pairs = len(self._matches) * len(self.template.texts)
+            if not self._approximate(pairs):
+                if VectorIndex.available() and pairs >= self.VECTORIZE_MIN_PAIRS:
+                    # Score every window now, so the misses can be shortlisted in one batch
+                    self._score_pending()
+
+        if match.scored is None:
+            first, last = match.window
+            match.scored = _score_windows(
+                [(match.text, first, last)], self.template.texts, self.threshold,
+                self._shortlist, self._matchers,
+            )[0]
+        return match.scored
+
+    def best_target(self, template_position: int) -> Optional[Tuple[object, float]]:
+        """
+        Find the target paragraph that best matches a template paragraph.
+
+        The search runs between the neighbouring anchors first and over the whole
+        target only if nothing there exceeds the threshold. The first target paragraph
+        with the highest ratio wins; identical text is looked up directly.
+
+        Args:
+            template_position: Position of the template paragraph
+
+        Returns:
+            (target paragraph, ratio), or None if no ratio exceeds the threshold
+        """
+        if template_position in self._best_targets:
+            return self._best_targets[template_position]
+
+        template_text = self.template.texts[template_position]
+        best = None
+        k = self._anchor_by_template.get(template_position)
+        if k is not None:
+            best = (self.paragraphs[k], 1.0)
+        elif template_text:
+            first, last = self._window(template_position, self._template_anchors, self._target_anchors,
+                                       len(self.template.paragraphs), len(self.paragraphs))
+            exact = self._target_positions.get(template_text, ())
+            inside_exact = [k for k in exact if first <= k <= last]
+            if inside_exact:
+                best = (self.paragraphs[inside_exact[0]], 1.0)
+            else:
+                k, ratio = self._best(template_text, range(first, last + 1))
+                if k is None:
+                    if exact:
+                        k, ratio = exact[0], 1.0
+                    else:
+                        # Only texts missing from the window need the whole-document index
+                        if self._target_index is None:
+                            self._target_index = NgramIndex(self.texts, self.threshold)
+                        candidates = self._target_index.candidates(template_text)
+                        outside = [k for k in candidates if not first <= k <= last]
+                        k, ratio = self._best(template_text, outside)
+                if k is not None:
+                    best = (self.paragraphs[k], ratio)
+
+        self._best_targets[template_position] = best
+        return best
+
+    def _approximate(self, pairs: int) -> bool:
+        """Return True if candidates come from the (approximate) MinHash index."""
+        return self.APPROXIMATE_MIN_PAIRS is not None and pairs >= self.APPROXIMATE_MIN_PAIRS
+
+    def _score_pending(self) -> None:
+        """Score every paragraph without an exact match, shortlisting window misses together."""
+        pending = [m for m in self._matches.values() if m.scored is None and not m.exact]
+        results = _score_windows(
+            [(m.text, m.window[0], m.window[1]) for m in pending], self.template.texts,
+            self.threshold, self._shortlist, self._matchers,
+        )
+        for match, scored in zip(pending, results):
+            match.scored = scored
+
+    def _shortlist(self, queries: List[str]) -> List[List[int]]:
+        """Get the template positions whose ratio with each query may exceed the threshold."""
+        pairs = len(self._matches) * len(self.template.texts)
+        if self._approximate(pairs):
+            return [self.template.lsh_index.candidates(text) for text in queries]
+
+        index = self.template.text_index
+        if VectorIndex.available() and len(queries) * len(self.template.texts) >= self.VECTORIZE_MIN_PAIRS:
+            step = max(1, len(queries) // self.DENSITY_SAMPLE)
+            density = index.density(queries[::step])
+            logger.debug("Shortlisting %s paragraphs, bigram density %.3f", len(queries), density)
+            if density >= self.VECTORIZE_MIN_DENSITY:
+                return self.template.vector_index.candidates_many(queries)
+        return index.candidates_each(queries)
+
+    def _best(self, template_text: str, positions: Sequence[int]) -> Tuple[Optional[int], float]:
+        """Find the first target paragraph with the best ratio against a template text."""
+        return best_match(
+            template_text,
+            ((k, self.texts[k]) for k in positions),
+            self.threshold,
+            self._matchers,
+            text_first=False,
+        )
+
+    def _find_anchors(self) -> None:
+        """Pin paragraphs with unique text in both documents, keeping the longest in-order run."""
+        template_positions = self.template.text_positions
+        unique = []  # (target position, template position) in target order
+        for text, target_positions in self._target_positions.items():
+            positions = template_positions.get(text, ())
+            if len(target_positions) == 1 and len(positions) == 1:
+                unique.append((target_positions[0], positions[0]))
+        unique.sort()
+
+        # Longest increasing subsequence of template positions (patience sorting)
+        tails: List[int] = []       # tails[n] = smallest template position ending a run of n+1
+        tail_index: List[int] = []  # index into unique of that tail
+        previous = [-1] * len(unique)
+        for idx, (_, j) in enumerate(unique):
+            n = bisect_left(tails, j)
+            if n == len(tails):
+                tails.append(j)
+                tail_index.append(idx)
+            else:
+                tails[n] = j
+                tail_index[n] = idx
+            previous[idx] = tail_index[n - 1] if n > 0 else -1
+
+        anchors = []
+        idx = tail_index[-1] if tail_index else -1
+        while idx >= 0:
+            anchors.append(unique[idx])
+            idx = previous[idx]
+        anchors.reverse()
+
+        self._target_anchors = [k for k, _ in anchors]
+        self._template_anchors = [j for _, j in anchors]
+        self._anchor_by_target = dict(anchors)
+        self._anchor_by_template = {j: k for k, j in anchors}
+
+    def _window(self, position: int, anchors: List[int], other_anchors: List[int],
+                own_length: int, other_length: int) -> Tuple[int, int]:
+        """
+        Get the positions in the other document to search for a non-anchor paragraph.
+
+        Args:
+            position: Paragraph position in its own document
+            anchors: Anchor positions in its own document (ascending)
+            other_anchors: Matching anchor positions in the other document
+            own_length: Number of paragraphs in its own document
+            other_length: Number of paragraphs in the other document
+
+        Returns:
+            (first, last) positions in the other document, inclusive
+        """
+        n = bisect_left(anchors, position)
+        prev_own, prev_other = (anchors[n - 1], other_anchors[n - 1]) if n > 0 else (-1, -1)
+        next_own, next_other = (anchors[n], other_anchors[n]) if n < len(anchors) else (own_length, other_length)
+
+        first, last = prev_other + 1, next_other - 1
+        radius = self.SEARCH_RADIUS
+        if last - first > 2 * radius:
+            # Long gap: search around the position interpolated between the anchors
+            span = max(next_own - prev_own, 1)
+            expected = prev_other + round((position - prev_own) * (next_other - prev_other) / span)
+            first, last = max(first, expected - radius), min(last, expected + radius)
+        return first, last
@@ -0,0 +1,237 @@
+"""
+Package I/O helpers for Word documents.
+
+This module provides the zip-level plumbing used by the restorer to read .docx
+packages lazily and to write them without re-compressing parts that were never
+modified.
+"""
+
+import copy
+import zipfile
+from collections.abc import Mapping, MutableMapping
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Union
+
+# General purpose flag bits (see APPNOTE.TXT 4.4.4)
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DATA_DESCRIPTOR = 0x08
+
+# Private zipfile.ZipFile attributes the raw copy relies on; they are not part of the
+# public API, so their presence is checked before copying raw
+_WRITER_INTERNALS = ("fp", "_lock", "_writing", "_seekable", "_writecheck", "_didModify", "start_dir")
+
+
+class PackageWriter:
+    """
+    Writes a .docx package entry by entry.
+
+    Parts produced by the pipeline are compressed as usual, while parts that are
+    passed through unchanged are copied byte-for-byte from the compressed stream
+    of their source archive, skipping both decompression and re-compression.
+
+    The raw copy uses private ``zipfile`` internals. On Python versions where they
+    are missing, parts are decompressed and written again with their original
+    ZipInfo instead, which produces an equivalent package.
+    """
+
+    def __init__(self, dst: BinaryIO, compression: int = zipfile.ZIP_DEFLATED):
+        """
+        Initialize the writer.
+
+        Args:
+            dst: Writable binary file object that receives the archive
+            compression: Compression method for rewritten parts
+        """
+        self._zip = zipfile.ZipFile(dst, 'w', compression)
+        self._raw_copy = all(hasattr(self._zip, name) for name in _WRITER_INTERNALS)
+
+    def __enter__(self) -> "PackageWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def write(self, name: str, data: bytes) -> None:
+        """
+        Compress and write a part.
+
+        Args:
+            name: Part name inside the package (e.g. 'word/document.xml')
+            data: Uncompressed part bytes
+        """
+        self._zip.writestr(name, data)
+
+    def copy(self, source: zipfile.ZipFile, name: str) -> None:
+        """
+        Copy a part from another archive without recompressing it.
+
+        The local file header is rebuilt from the source's central directory record
+        and the compressed data is streamed as-is, so CRC and sizes stay valid.
+        Encrypted parts, and every part when the zipfile internals are unavailable,
+        are decompressed and recompressed instead.
+
+        Args:
+            source: Open source archive containing the part
+            name: Part name inside the source archive
+        """
+        info = source.getinfo(name)
+        # Encrypted members cannot be copied raw into an unencrypted package
+        if info.flag_bits & _FLAG_ENCRYPTED or not self._raw_copy:
+            self._recompress(source, info)
+            return
+
+        # ZipFile.open() validates the local header and leaves the shared file
+        # positioned at the start of the compressed data
+        with source.open(info) as member:
+            fileobj = getattr(member, "_fileobj", None)
+            raw = fileobj.read(info.compress_size) if fileobj is not None else None
+        if raw is None:
+            self._recompress(source, info)
+            return
+
+        zinfo = copy.copy(info)
+        # Sizes and CRC are known up front, so no trailing data descriptor is needed
+        zinfo.flag_bits &= ~_FLAG_DATA_DESCRIPTOR
+
+        zf = self._zip
+        with zf._lock:
+            if zf._writing:
+                raise ValueError("Can't copy a part while another part is being written")
+            if zf._seekable:
+                zf.fp.seek(zf.start_dir)
+            zinfo.header_offset = zf.fp.tell()
+            zf._writecheck(zinfo)
+            zf._didModify = True
+            zf.fp.write(zinfo.FileHeader())
+            zf.fp.write(raw)
+            zf.start_dir = zf.fp.tell()
+            zf.filelist.append(zinfo)
+            zf.NameToInfo[zinfo.filename] = zinfo
+
+    def _recompress(self, source: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+        """Copy a part through zipfile's public API, keeping its name, date and attributes."""
+        self._zip.writestr(copy.copy(info), source.read(info))
+
+    def close(self) -> None:
+        """Write the central directory and close the archive."""
+        self._zip.close()
+
+
+class DocxPackage(Mapping):
+    """
+    Read-only, lazily loaded view of a .docx package.
+
+    The archive is opened once; a part is decompressed on first access and cached.
+    Parts that are never read stay compressed in the archive and can be copied
+    into an output package as-is.
+    """
+
+    def __init__(self, source: Union[str, Path, BinaryIO]):
+        """
+        Open a package.
+
+        Args:
+            source: Path to the .docx file or a readable binary file object
+        """
+        self.zip = zipfile.ZipFile(source, 'r')
+        self._infos = {
+            info.filename: info
+            for info in self.zip.infolist()
+            if not info.is_dir()
+        }
+        self._cache: Dict[str, bytes] = {}
+
+    def __enter__(self) -> "DocxPackage":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def __getitem__(self, name: str) -> bytes:
+        data = self._cache.get(name)
+        if data is None:
+            data = self.zip.read(self._infos[name])
+            self._cache[name] = data
+        return data
+
+    def __contains__(self, name) -> bool:
+        return name in self._infos
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._infos)
+
+    def __len__(self) -> int:
+        return len(self._infos)
+
+    def is_loaded(self, name: str) -> bool:
+        """Return True if the part has already been decompressed."""
+        return name in self._cache
+
+    def close(self) -> None:
+        """Close the underlying archive."""
+        self.zip.close()
+
+
+class OutputPackage(MutableMapping):
+    """
+    Package assembled from parts of other packages plus rewritten parts.
+
+    Every entry either refers to a part of a source :class:`DocxPackage` or holds
+    bytes produced by the pipeline. Referenced parts are only decompressed if they
+    are read, and are copied raw when the package is saved.
+    """
+
+    def __init__(self, base: DocxPackage):
+        """
+        Start an output package with all parts of ``base``.
+
+        Args:
+            base: Package whose parts (and part order) the output starts from
+        """
+        # Part name -> source package (passthrough) or bytes (rewritten)
+        self._entries: Dict[str, Union[DocxPackage, bytes]] = {name: base for name in base}
+
+    def __getitem__(self, name: str) -> bytes:
+        entry = self._entries[name]
+        if isinstance(entry, DocxPackage):
+            return entry[name]
+        return entry
+
+    def __setitem__(self, name: str, data: bytes) -> None:
+        self._entries[name] = data
+
+    def __delitem__(self, name: str) -> None:
+        del self._entries[name]
+
+    def __contains__(self, name) -> bool:
+        return name in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, package: DocxPackage, name: str) -> None:
+        """
+        Take a part from another package, replacing any existing entry.
+
+        Args:
+            package: Source package
+            name: Part name in the source package
+        """
+        self._entries[name] = package
+
+    def save(self, dst: BinaryIO) -> None:
+        """
+        Write the package as a .docx archive.
+
+        Args:
+            dst: Writable binary file object for the output .docx
+        """
+        with PackageWriter(dst) as writer:
+            for name, entry in self._entries.items():
+                if isinstance(entry, DocxPackage):
+                    writer.copy(entry.zip, name)
+                else:
+                    writer.write(name, entry)
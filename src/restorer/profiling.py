@@ -0,0 +1,159 @@
+"""
+Profiling helpers for diagnosing slow conversions.
+
+This module provides :func:`profiled`, a context manager that runs the enclosed code
+under cProfile and writes the result twice: as a pstats file (for ``python -m pstats``
+or snakeviz) and as collapsed stacks, one ``caller;callee;... microseconds`` line per
+call path (the input format of flamegraph.pl and speedscope). Both files are capped
+in size, so they can be collected from production.
+"""
+
+import cProfile
+import marshal
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+# Default size cap of each profile output file, in bytes
+MAX_PROFILE_BYTES = 16 * 1024 * 1024
+
+# Deepest call path written to the collapsed stacks
+MAX_STACK_DEPTH = 128
+
+
+def collapsed_path(profile_path: Union[str, Path]) -> Path:
+    """
+    Get the path of the collapsed-stack file written next to a pstats file.
+
+    Args:
+        profile_path: Path of the pstats file (e.g. 'out.prof')
+
+    Returns:
+        Path with the suffix replaced (e.g. 'out.collapsed.txt')
+    """
+    path = Path(profile_path)
+    return path.with_name(f"{path.stem}.collapsed.txt")
+
+
+@contextmanager
+def profiled(profile_path: Union[str, Path], max_bytes: int = MAX_PROFILE_BYTES):
+    """
+    Profile the enclosed block and write the results, even if the block raises.
+
+    Args:
+        profile_path: Path of the pstats file; the collapsed stacks are written
+                      next to it (see :func:`collapsed_path`)
+        max_bytes: Size cap of each output file
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        write_profile(profiler, profile_path, max_bytes)
+
+
+def write_profile(profiler: cProfile.Profile, profile_path: Union[str, Path],
+                  max_bytes: int = MAX_PROFILE_BYTES) -> Tuple[Path, Path]:
+    """
+    Write a finished profile as a pstats file and as collapsed stacks.
+
+    When a file would exceed ``max_bytes``, the functions (pstats) or call paths
+    (collapsed stacks) with the least time are left out.
+
+    Args:
+        profiler: Disabled profiler
+        profile_path: Path of the pstats file
+        max_bytes: Size cap of each output file
+
+    Returns:
+        (pstats file path, collapsed-stack file path)
+    """
+    profiler.create_stats()
+    stats = profiler.stats
+
+    path = Path(profile_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(_capped_stats(stats, max_bytes))
+
+    folded = collapsed_path(path)
+    with open(folded, "w", encoding="utf-8") as f:
+        size = 0
+        for line in _collapsed_lines(stats):
+            size += len(line.encode("utf-8")) + 1
+            if size > max_bytes:
+                break
+            f.write(line + "\n")
+    return path, folded
+
+
+def _capped_stats(stats: Dict, max_bytes: int) -> bytes:
+    """Serialize stats like pstats.Stats.dump_stats, keeping the slowest functions that fit."""
+    data = marshal.dumps(stats)
+    ranked = sorted(stats, key=lambda func: stats[func][3], reverse=True)
+    keep = len(ranked)
+    while len(data) > max_bytes and keep > 1:
+        keep //= 2
+        kept = set(ranked[:keep])
+        data = marshal.dumps({
+            func: (cc, nc, tt, ct, {caller: edge for caller, edge in callers.items() if caller in kept})
+            for func, (cc, nc, tt, ct, callers) in stats.items()
+            if func in kept
+        })
+    return data
+
+
+def _frame_name(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":  # Built-in function
+        label = name
+    else:
+        label = f"{name} ({os.path.basename(filename)}:{line})"
+    return label.replace(";", ":")
+
+
+def _collapsed_lines(stats: Dict) -> List[str]:
+    """
+    Rebuild call paths from the caller/callee edges of a profile.
+
+    cProfile records edges, not stacks, so a function's time is split between its
+    call paths in proportion to the cumulative time of each incoming edge.
+
+    Returns:
+        ``frame;frame;... microseconds`` lines, slowest first
+    """
+    children: Dict[Tuple, List[Tuple[Tuple, float]]] = {}
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    weights: Dict[str, int] = {}
+    stack: List[Tuple] = []
+    names: List[str] = []
+
+    def walk(func, cumulative: float) -> None:
+        _, _, tt, ct, _ = stats[func]
+        stack.append(func)
+        names.append(_frame_name(func))
+        share = cumulative / ct if ct else 0.0
+        own = int(tt * share * 1e6)
+        if own > 0:
+            path = ";".join(names)
+            weights[path] = weights.get(path, 0) + own
+        if len(stack) < MAX_STACK_DEPTH:
+            for callee, edge_time in children.get(func, ()):
+                # Skip recursion and paths below a microsecond
+                if callee not in stack and edge_time * share >= 1e-6:
+                    walk(callee, edge_time * share)
+        stack.pop()
+        names.pop()
+
+    for root in roots:
+        walk(root, stats[root][3])
+
+    return [f"{path} {weight}" for path, weight in sorted(weights.items(), key=lambda item: -item[1])]
@@ -0,0 +1,152 @@
+"""
+Per-conversion measurements for the restoration pipeline.
+
+This module provides the RestoreReport class, which records the wall-clock and CPU
+time spent in each pipeline stage of one conversion, together with the element
+counts the stages report and the input/output package sizes, so a slow or unusual
+document can be traced to the stage responsible.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class StageTiming:
+    """
+    Time spent in one pipeline stage.
+
+    Times are exclusive: time spent in a stage nested inside this one is counted
+    for the nested stage only, so the stages of a report add up to its total.
+
+    Attributes:
+        wall: Wall-clock seconds
+        cpu: CPU seconds of this process (worker processes are not included)
+        calls: Number of times the stage was entered
+    """
+
+    __slots__ = ("wall", "cpu", "calls")
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+
+    def to_dict(self) -> dict:
+        return {"wall": self.wall, "cpu": self.cpu, "calls": self.calls}
+
+
+class RestoreReport:
+    """
+    Stage timings, element counts and sizes of one conversion.
+
+    Pass an instance to :meth:`FormatRestorer.restore_format` (or
+    :meth:`~FormatRestorer.restore_bytes` / :meth:`~FormatRestorer.restore_stream`)
+    to have it filled in.
+
+    The ``merge_styles`` stage only scans the target's styles when DEBUG logging is
+    enabled for ``restorer.core``, since the scan only feeds debug output; otherwise
+    the stage is recorded with a near-zero time and the ``merge_styles_skipped`` count.
+
+    Attributes:
+        stages: Stage name -> StageTiming, in the order stages first ran
+        counts: Counter name -> value (paragraphs, synced tables, merged runs, ...)
+        input_size: Size of the target package in bytes, if known
+        output_size: Size of the output package in bytes, if known
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageTiming] = {}
+        self.counts: Dict[str, int] = {}
+        self.input_size: Optional[int] = None
+        self.output_size: Optional[int] = None
+
+        # Time spent in nested stages, per open stage (innermost last)
+        self._nested: List[List[float]] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the enclosed block as pipeline stage ``name``.
+
+        Stages may be nested; the enclosing stage is not charged for the nested one.
+        Entering the same stage again adds to its totals.
+
+        Args:
+            name: Stage name
+        """
+        timing = self.stages.get(name)
+        if timing is None:
+            timing = self.stages[name] = StageTiming()
+
+        nested = [0.0, 0.0]
+        self._nested.append(nested)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            self._nested.pop()
+            if self._nested:
+                self._nested[-1][0] += wall
+                self._nested[-1][1] += cpu
+
+            timing.wall += wall - nested[0]
+            timing.cpu += cpu - nested[1]
+            timing.calls += 1
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Add to a counter.
+
+        Args:
+            name: Counter name
+            value: Amount to add
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @property
+    def wall_time(self) -> float:
+        """Total wall-clock seconds of all stages."""
+        return sum(timing.wall for timing in self.stages.values())
+
+    @property
+    def cpu_time(self) -> float:
+        """Total CPU seconds of all stages."""
+        return sum(timing.cpu for timing in self.stages.values())
+
+    def to_dict(self) -> dict:
+        """
+        Convert the report to plain JSON-serializable data.
+
+        Returns:
+            Dictionary with total times, per-stage times, counts and sizes
+        """
+        return {
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "stages": {name: timing.to_dict() for name, timing in self.stages.items()},
+            "counts": dict(self.counts),
+            "input_size": self.input_size,
+            "output_size": self.output_size,
+        }
+
+    def format(self) -> str:
+        """
+        Render the report as a human-readable table.
+
+        Returns:
+            Multi-line text, one line per stage followed by the counters
+        """
+        # Column widths account for CJK labels taking two columns each
+        lines = [f"{'阶段':<28}{'墙钟(s)':>8}{'CPU(s)':>10}"]
+        for name, timing in self.stages.items():
+            lines.append(f"{name:<30}{timing.wall:>10.4f}{timing.cpu:>10.4f}")
+        lines.append(f"{'总计':<28}{self.wall_time:>10.4f}{self.cpu_time:>10.4f}")
+        if self.input_size is not None or self.output_size is not None:
+            lines.append(f"输入大小: {self.input_size} 字节, 输出大小: {self.output_size} 字节")
+        for name, value in self.counts.items():
+            lines.append(f"  {name}: {value}")
+        return "\n".join(lines)
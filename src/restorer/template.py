@@ -0,0 +1,472 @@
+"""
+Compiled template module for Word documents.
+
+This module provides the CompiledTemplate class, which parses a template document
+once and precomputes everything the restoration pipeline derives from it, so the
+work can be shared by every document restored against the same template.
+
+A compiled template can be saved as a sidecar file next to the template (see
+:meth:`CompiledTemplate.save` and :meth:`CompiledTemplate.load`), so new processes
+start from the precomputed tables instead of deriving them again. Sidecars hold
+plain JSON data only, behind a one-line header that is checked before the rest of
+the file is read. They hold no output parts: parts taken from the template are
+copied from its own compressed streams (see ``PackageWriter.copy`` in
+restorer.package), so they are neither serialized nor compressed again.
+"""
+
+import copy
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from lxml import etree
+
+from restorer.context import parse_part, parse_relationships
+from restorer.document import DocumentIndex, table_fingerprint
+from restorer.matching import MinHashIndex, NgramIndex, VectorIndex
+from restorer.package import DocxPackage
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledTemplate:
+    """
+    Template document parsed once, with all template-side lookups precomputed.
+
+    Every attribute is read-only: pipeline stages read from it but never modify
+    its trees, so one instance can be reused across any number of conversions.
+
+    A sidecar only saves the derived tables, as JSON rather than a memory-mappable
+    format. It stores no serialized or compressed output parts, since the format
+    parts copied from the template are written straight from the template's
+    compressed streams. :meth:`load` still reads and hashes the template and parses
+    document.xml, styles.xml and the document relationships, because the stages read
+    those trees and the sidecar refers to paragraphs and tables by position in them;
+    parsing is most of the remaining load time.
+    """
+
+    W_NS = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
+
+    # Sidecar file format; bump whenever the precomputed tables change
+    SIDECAR_VERSION = 1
+    SIDECAR_SUFFIX = ".compiled"
+    SIDECAR_FORMAT = "formatmaster-compiled-template"
+
+    # Longest sidecar header line read before it is validated
+    SIDECAR_HEADER_BYTES = 1024
+
+    def __init__(self, source: Union[str, Path, bytes]):
+        """
+        Compile a template document.
+
+        Args:
+            source: Path to the template .docx or its raw bytes
+        """
+        self._open(self._read_source(source))
+
+        self._compile_document()
+        self._compile_styles()
+        self._compile_relationships()
+
+    @classmethod
+    def sidecar_path(cls, template_path: Union[str, Path]) -> Path:
+        """
+        Get the sidecar file path for a template.
+
+        Args:
+            template_path: Path to the template .docx
+
+        Returns:
+            Path of the sidecar next to the template (e.g. 'a.docx.compiled')
+        """
+        template_path = Path(template_path)
+        return template_path.with_name(template_path.name + cls.SIDECAR_SUFFIX)
+
+    @classmethod
+    def load(cls, source: Union[str, Path, bytes], sidecar: Optional[Union[str, Path]] = None) -> "CompiledTemplate":
+        """
+        Load a compiled template, using its sidecar file when it is still valid.
+
+        The sidecar is used only if its header names the current format version and
+        the SHA-256 hash of the template; otherwise the template is compiled. The
+        payload is only read once the header has been checked, and is parsed as
+        JSON, so a stale or tampered sidecar cannot run code.
+
+        Args:
+            source: Path to the template .docx or its raw bytes
+            sidecar: Sidecar file path. Defaults to :meth:`sidecar_path` of ``source``
+                     when ``source`` is a path
+
+        Returns:
+            CompiledTemplate for the template
+        """
+        data = cls._read_source(source)
+        if sidecar is None and not isinstance(source, (bytes, bytearray)):
+            sidecar = cls.sidecar_path(source)
+
+        state = None
+        if sidecar is not None and Path(sidecar).exists():
+            try:
+                state = cls._read_sidecar(sidecar, hashlib.sha256(data).hexdigest())
+            except Exception as e:
+                logger.warning("Ignoring unreadable compiled template %s: %s", sidecar, e)
+
+        if state is None:
+            return cls(data)
+
+        compiled = cls.__new__(cls)
+        compiled._open(data)
+        try:
+            compiled._restore_state(state)
+        except (KeyError, IndexError, TypeError, ValueError, etree.XMLSyntaxError) as e:
+            logger.warning("Ignoring invalid compiled template %s: %s", sidecar, e)
+            return cls(data)
+        return compiled
+
+    def save(self, sidecar: Union[str, Path]) -> None:
+        """
+        Write the precomputed tables to a sidecar file.
+
+        Args:
+            sidecar: Sidecar file path (usually :meth:`sidecar_path` of the template)
+        """
+        sidecar = Path(sidecar)
+        header = {"format": self.SIDECAR_FORMAT, "version": self.SIDECAR_VERSION, "sha256": self.sha256}
+        # Write to a temporary file of our own first, so readers never see a partial
+        # sidecar and processes saving the same template do not write over each other
+        tmp_path = sidecar.with_name(f".{sidecar.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'x', encoding='utf-8') as f:
+                f.write(json.dumps(header) + "\n")
+                json.dump(self._state(), f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, sidecar)
+        except BaseException:
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def _read_sidecar(cls, sidecar: Union[str, Path], sha256: str) -> Optional[dict]:
+        """
+        Read a sidecar's state if its header matches the current format and template.
+
+        Args:
+            sidecar: Sidecar file path
+            sha256: SHA-256 hex digest of the template
+
+        Returns:
+            State produced by :meth:`_state`, or None if the header does not match
+        """
+        with open(sidecar, 'rb') as f:
+            line = f.readline(cls.SIDECAR_HEADER_BYTES)
+            if not line.endswith(b"\n"):
+                return None
+            header = json.loads(line)
+            if (
+                not isinstance(header, dict)
+                or header.get("format") != cls.SIDECAR_FORMAT
+                or header.get("version") != cls.SIDECAR_VERSION
+                or header.get("sha256") != sha256
+            ):
+                return None
+            state = json.loads(f.read())
+        return state if isinstance(state, dict) else None
+
+    @staticmethod
+    def _read_source(source: Union[str, Path, bytes]) -> bytes:
+        if isinstance(source, (bytes, bytearray)):
+            return bytes(source)
+        with open(source, 'rb') as f:
+            return f.read()
+
+    def _open(self, data: bytes) -> None:
+        """Open the template package and parse the parts every stage reads."""
+        # Keep the package in memory so no file handle stays open between conversions
+        self.package = DocxPackage(io.BytesIO(data))
+        self.size = len(data)
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self._trees: Dict[str, Optional[etree._ElementTree]] = {}
+        self._text_index: Optional[NgramIndex] = None
+        self._vector_index: Optional[VectorIndex] = None
+        self._lsh_index: Optional[MinHashIndex] = None
+        self._text_positions: Optional[Dict[str, List[int]]] = None
+
+        self.document_tree = self.tree("word/document.xml")
+        self.styles_tree = self.tree("word/styles.xml")
+        self.rels_tree = self.tree("word/_rels/document.xml.rels")
+        self.paragraphs = self.document_tree.getroot().findall(".//w:p", namespaces=self.W_NS)
+
+    def _state(self) -> dict:
+        """
+        Get the precomputed tables as plain data.
+
+        Elements are stored as paragraph indices and resolved against the parsed
+        document again when the state is restored. Only JSON types are used, so
+        tuples and sets become lists.
+        """
+        para_index = {para: i for i, para in enumerate(self.paragraphs)}
+        return {
+            "texts": self.texts,
+            "paragraph_styles": self.paragraph_styles,
+            "trailing_empty": self.trailing_empty,
+            "table_captions": [
+                (para_index[tbl.getprevious()], caption) for tbl, caption in self.table_captions
+            ],
+            "table_keys": self._table_keys,
+            "page_breaks": [
+                (para_index[para], text, is_empty, text_position)
+                for para, text, is_empty, text_position in self.page_breaks
+            ],
+            "image_style": self.image_style,
+            "has_tab_after_image_heading": self.has_tab_after_image_heading,
+            "style_ids": sorted(self.style_ids),
+            "style_name_to_id": self.style_name_to_id,
+            "relationships": self.relationships,
+            "document_shell": etree.tostring(self._document_shell, encoding="unicode"),
+        }
+
+    def _restore_state(self, state: dict) -> None:
+        """Set the precomputed tables from a state produced by :meth:`_state`."""
+        paras = self.paragraphs
+        self.texts = state["texts"]
+        self.paragraph_styles = state["paragraph_styles"]
+        self.trailing_empty = state["trailing_empty"]
+        self.table_captions = [(paras[i].getnext(), caption) for i, caption in state["table_captions"]]
+        self.caption_tables = {i: paras[i].getnext() for i, caption in state["table_captions"]}
+        self._index_tables([(tuple(fingerprint), caption) for fingerprint, caption in state["table_keys"]])
+        self.page_breaks = [
+            (paras[i], text, is_empty, text_position)
+            for i, text, is_empty, text_position in state["page_breaks"]
+        ]
+        self.image_style = state["image_style"]
+        self.has_tab_after_image_heading = state["has_tab_after_image_heading"]
+        self.style_ids = set(state["style_ids"])
+        self.style_name_to_id = state["style_name_to_id"]
+        self.relationships = {rel_id: tuple(rel) for rel_id, rel in state["relationships"].items()}
+        self._document_shell = etree.fromstring(state["document_shell"])
+
+    def tree(self, name: str) -> Optional[etree._ElementTree]:
+        """
+        Get a parsed template part. The tree must not be modified.
+
+        Args:
+            name: Part name (e.g. 'word/styles.xml')
+
+        Returns:
+            Parsed tree, or None if the template has no such part
+        """
+        if name not in self._trees:
+            self._trees[name] = parse_part(self.package[name]) if name in self.package else None
+        return self._trees[name]
+
+    @property
+    def text_positions(self) -> Dict[str, List[int]]:
+        """
+        Template paragraph positions by exact text (built on first use).
+
+        Returns:
+            Dictionary mapping paragraph text to its positions in :attr:`paragraphs`,
+            in document order
+        """
+        if self._text_positions is None:
+            self._text_positions = {}
+            for i, text in enumerate(self.texts):
+                if text:
+                    self._text_positions.setdefault(text, []).append(i)
+        return self._text_positions
+
+    @property
+    def text_index(self) -> NgramIndex:
+        """
+        Bigram index over the template's paragraph texts (built on first use).
+
+        Returns:
+            NgramIndex whose indices are positions in :attr:`paragraphs`
+        """
+        if self._text_index is None:
+            self._text_index = NgramIndex(self.texts)
+        return self._text_index
+
+    @property
+    def vector_index(self) -> VectorIndex:
+        """
+        Hashed bigram vectors of the template's paragraph texts (built on first use).
+
+        Only available when NumPy is installed (see :meth:`VectorIndex.available`).
+
+        Returns:
+            VectorIndex whose indices are positions in :attr:`paragraphs`
+        """
+        if self._vector_index is None:
+            self._vector_index = VectorIndex(self.texts)
+        return self._vector_index
+
+    @property
+    def lsh_index(self) -> MinHashIndex:
+        """
+        MinHash LSH index over the template's paragraph texts (built on first use).
+
+        Returns:
+            MinHashIndex with the default band/row settings, whose indices are
+            positions in :attr:`paragraphs`
+        """
+        if self._lsh_index is None:
+            self._lsh_index = MinHashIndex(self.texts)
+        return self._lsh_index
+
+    def document_shell(self):
+        """
+        Get a fresh copy of the template's document root with an empty body.
+
+        Returns:
+            Root element that keeps the template's namespace declarations
+        """
+        return copy.deepcopy(self._document_shell)
+
+    def _compile_document(self) -> None:
+        """Precompute paragraph, table, page break and image tables of document.xml."""
+        w_ns = self.W_NS
+        w = w_ns['w']
+        root = self.document_tree.getroot()
+
+        # Paragraphs with their joined text and paragraph style
+        index = DocumentIndex(root)
+        self.texts: List[str] = [record.text for record in index]
+        self.paragraph_styles: List[Optional[str]] = [record.style for record in index]
+
+        # Number of trailing empty paragraphs
+        self.trailing_empty = 0
+        for text in reversed(self.texts):
+            if text.strip():
+                break
+            self.trailing_empty += 1
+
+        # Tables with the text of their preceding paragraph (caption/title)
+        self.table_captions: List[Tuple[etree._Element, str]] = []
+        self.caption_tables: Dict[int, etree._Element] = {}  # Caption paragraph position -> table
+        for i, (para, text) in enumerate(zip(self.paragraphs, self.texts)):
+            next_elem = para.getnext()
+            if next_elem is not None and next_elem.tag == f"{{{w}}}tbl":
+                self.table_captions.append((next_elem, text))
+                self.caption_tables[i] = next_elem
+
+        # Every table with its structural fingerprint and caption ("" if none)
+        keys = []
+        for tbl in root.iter(f"{{{w}}}tbl"):
+            previous = tbl.getprevious()
+            record = index.get(previous) if previous is not None else None
+            keys.append((table_fingerprint(tbl), record.text if record is not None else ""))
+        self._index_tables(keys)
+
+        # Paragraphs with page breaks: (paragraph, text to match, is_empty, position of that text)
+        # For an empty paragraph the NEXT paragraph's text is matched (the content after the break)
+        self.page_breaks: List[Tuple[etree._Element, str, bool, int]] = []
+        for i, record in enumerate(index):
+            if not record.has_page_break:
+                continue
+            para = record.element
+            text = self.texts[i]
+            is_empty = (not text)
+            if is_empty and i + 1 < len(self.paragraphs):
+                self.page_breaks.append((para, self.texts[i + 1], True, i + 1))
+            else:
+                self.page_breaks.append((para, text, False, i))
+
+        self._compile_image_style(index)
+
+        # Root element with an empty body, copied for every output document
+        self._document_shell = copy.deepcopy(root)
+        body = self._document_shell.find(".//w:body", namespaces=w_ns)
+        if body is not None:
+            body.clear()
+
+    def _index_tables(self, keys: List[Tuple[tuple, str]]) -> None:
+        """
+        Build the table lookups from (fingerprint, caption) keys in document order.
+
+        Args:
+            keys: One (fingerprint, caption) key per w:tbl of the document
+        """
+        self._table_keys = keys
+        self.tables: List[etree._Element] = list(self.document_tree.getroot().iter(f"{{{self.W_NS['w']}}}tbl"))
+        # Table positions in :attr:`tables` by fingerprint, and by (fingerprint, caption)
+        self.table_fingerprints: Dict[tuple, List[int]] = {}
+        self.table_keys: Dict[Tuple[tuple, str], List[int]] = {}
+        for i, (fingerprint, caption) in enumerate(keys):
+            self.table_fingerprints.setdefault(fingerprint, []).append(i)
+            self.table_keys.setdefault((fingerprint, caption), []).append(i)
+
+    def _compile_image_style(self, index: DocumentIndex) -> None:
+        """Find the paragraph style the template uses for images."""
+        w_ns = self.W_NS
+        self.image_style = None
+
+        # Approach 1: Use lxml to search
+        for record in index:
+            if record.has_drawing:
+                para = record.element
+                pPr = para.find("w:pPr", namespaces=w_ns)
+                if pPr is not None:
+                    pStyle = pPr.find("w:pStyle", namespaces=w_ns)
+                    if pStyle is not None:
+                        style_val = pStyle.get('val')
+                        if style_val:
+                            self.image_style = style_val
+                            logger.debug("Found template image style: %s (via lxml)", self.image_style)
+                            break
+
+        template_xml = None
+
+        # Approach 2: If lxml didn't find it, search the serialized XML
+        if not self.image_style:
+            template_xml = etree.tostring(self.document_tree, encoding='unicode')
+            # For each <w:pStyle w:val="..."/>, check if <w:drawing> appears before the next </w:p>
+            for match in re.finditer(r'<w:pStyle[^>]*w:val="([^"]*)"[^>]*/>', template_xml):
+                style_end = match.end()
+                next_p = template_xml.find('</w:p>', style_end)
+                next_drawing = template_xml.find('<w:drawing>', style_end)
+                if next_drawing > 0 and (next_p < 0 or next_drawing < next_p):
+                    self.image_style = match.group(1)
+                    logger.debug("Found template image style: %s (via regex)", self.image_style)
+                    break
+
+        # Check if template has tab after image + heading pattern
+        # Pattern: image paragraph (style af) -> heading paragraph with <w:tab/>
+        self.has_tab_after_image_heading = False
+        if self.image_style:
+            if template_xml is None:
+                template_xml = etree.tostring(self.document_tree, encoding='unicode')
+            tab_after_af_pattern = r'w:val="af"[^>]*/>.*?</w:p>.*?<w:p[^>]*>.*?<w:r[^>]*>.*?<w:tab/>'
+            self.has_tab_after_image_heading = bool(re.search(tab_after_af_pattern, template_xml, re.DOTALL))
+
+    def _compile_styles(self) -> None:
+        """Precompute style lookups of styles.xml."""
+        w_ns = self.W_NS
+        w = w_ns['w']
+        self.style_ids = set()
+        self.style_name_to_id: Dict[str, str] = {}
+        if self.styles_tree is None:
+            return
+
+        for style in self.styles_tree.getroot().xpath("//w:style", namespaces=w_ns):
+            style_id = style.get(f"{{{w}}}styleId")
+            if style_id:
+                self.style_ids.add(style_id)
+            style_name_elem = style.find("w:name", namespaces=w_ns)
+            if style_name_elem is not None:
+                style_name = style_name_elem.get(f"{{{w}}}val")
+                if style_id and style_name:
+                    self.style_name_to_id[style_name] = style_id
+
+    def _compile_relationships(self) -> None:
+        """Precompute the relationship table of document.xml.rels."""
+        self.relationships: Dict[str, Tuple[str, str]] = {}
+        if self.rels_tree is not None:
+            self.relationships = parse_relationships(self.rels_tree)
@@ -0,0 +1,20 @@
+"""Shared fixtures for the test suite."""
+
+import time
+import types
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def frozen_zip_clock(monkeypatch):
+    """
+    Stamp rewritten package parts with a fixed time.
+
+    Parts written by name get the current time as their zip timestamp, so two
+    conversions only produce identical bytes within the same two-second tick.
+    """
+    fixed = time.mktime((2024, 1, 8, 12, 0, 0, 0, 0, -1))
+    clock = types.SimpleNamespace(time=lambda: fixed, localtime=time.localtime)
+    monkeypatch.setattr(zipfile, "time", clock)
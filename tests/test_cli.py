@@ -0,0 +1,78 @@
+"""Tests for the CLI's --debug switch and the DEBUG-gated diagnostics it enables."""
+
+import io
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+
+from restorer import cli
+from restorer.core import FormatRestorer
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+TEMPLATE = EXAMPLES / "正常格式.docx"
+TARGET = EXAMPLES / "错乱格式.docx"
+
+
+@pytest.fixture
+def restorer_logger():
+    """The restorer logger, with its level and handlers restored after the test."""
+    logger = logging.getLogger("restorer")
+    level, handlers = logger.level, list(logger.handlers)
+    yield logger
+    logger.setLevel(level)
+    logger.handlers[:] = handlers
+
+
+@pytest.fixture
+def merge_styles_calls(monkeypatch):
+    """Count the calls of the debug-only _merge_used_styles stage."""
+    calls = []
+    merge_used_styles = FormatRestorer._merge_used_styles
+
+    def counted(self, ctx):
+        calls.append(ctx)
+        return merge_used_styles(self, ctx)
+
+    monkeypatch.setattr(FormatRestorer, "_merge_used_styles", counted)
+    return calls
+
+
+def debug_records(caplog):
+    return [
+        record for record in caplog.records
+        if record.name.startswith("restorer.") and record.levelno == logging.DEBUG
+    ]
+
+
+@pytest.mark.parametrize("debug", [False, True])
+def test_configure_logging_gates_debug_work(restorer_logger, merge_styles_calls, caplog, debug):
+    cli.configure_logging(debug)
+    assert restorer_logger.isEnabledFor(logging.DEBUG) == debug
+
+    with open(TARGET, "rb") as src:
+        report = FormatRestorer(str(TEMPLATE)).restore_stream(src, io.BytesIO())
+
+    assert len(merge_styles_calls) == (1 if debug else 0)
+    # The stage is always reported; skipped scans are counted
+    assert "merge_styles" in report.stages
+    assert report.counts.get("merge_styles_skipped", 0) == (0 if debug else 1)
+    assert bool(debug_records(caplog)) == debug
+
+
+@pytest.mark.parametrize("debug", [False, True])
+def test_cli_debug_flag(restorer_logger, merge_styles_calls, caplog, monkeypatch, tmp_path, debug):
+    output = tmp_path / "output.docx"
+    argv = ["format-restorer", "restore", str(TEMPLATE), str(TARGET), "-o", str(output)]
+    if debug:
+        argv.insert(1, "--debug")
+    monkeypatch.setattr(sys, "argv", argv)
+
+    cli.main()
+
+    assert output.exists()
+    assert restorer_logger.level == (logging.DEBUG if debug else logging.WARNING)
+    assert len(merge_styles_calls) == (1 if debug else 0)
+    assert bool(debug_records(caplog)) == debug
+
@@ -0,0 +1,196 @@
+"""Tests for the FormatRestorer entry points, checked against restore_format output."""
+
+import io
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+from restorer.core import FormatRestorer
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+TEMPLATE = EXAMPLES / "正常格式.docx"
+TARGET = EXAMPLES / "错乱格式.docx"
+
+
+class NonSeekableStream(io.RawIOBase):
+    """Write-only stream that cannot tell or seek, like a socket or a pipe."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+def parts(data: bytes) -> dict:
+    """Read every part of a package by name."""
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+@pytest.fixture(scope="module")
+def restorer():
+    return FormatRestorer(str(TEMPLATE))
+
+
+@pytest.fixture
+def expected(restorer, tmp_path, frozen_zip_clock):
+    output = tmp_path / "expected.docx"
+    restorer.restore_format(str(TARGET), str(output))
+    return output.read_bytes()
+
+
+def test_restore_bytes_matches_restore_format(restorer, expected):
+    assert restorer.restore_bytes(TARGET.read_bytes()) == expected
+    with open(TARGET, "rb") as src:
+        assert restorer.restore_bytes(src) == expected
+
+
+def test_restore_stream_matches_restore_format(restorer, expected):
+    output = io.BytesIO()
+    with open(TARGET, "rb") as src:
+        report = restorer.restore_stream(src, output)
+
+    assert output.getvalue() == expected
+    assert report.input_size == TARGET.stat().st_size
+    assert report.output_size == len(expected)
+
+
+def test_restore_stream_to_non_seekable_stream(restorer, expected):
+    output = NonSeekableStream()
+    with open(TARGET, "rb") as src:
+        report = restorer.restore_stream(src, output)
+
+    # Entries get data descriptors instead of patched headers, so compare part by part
+    assert parts(output.getvalue()) == parts(expected)
+    assert report.output_size is None
+
+
+def test_failed_restore_leaves_no_files(restorer, tmp_path, monkeypatch):
+    def fail(self, ctx):
+        raise RuntimeError("conversion failed")
+
+    monkeypatch.setattr(FormatRestorer, "_restore_package", fail)
+    target = tmp_path / "target.docx"
+    shutil.copyfile(TARGET, target)
+
+    with pytest.raises(RuntimeError, match="conversion failed"):
+        restorer.restore_format(str(target), str(tmp_path / "output.docx"))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["target.docx"]
+
+
+def test_failed_in_place_restore_keeps_source(restorer, tmp_path, monkeypatch):
+    def fail(self, ctx):
+        raise RuntimeError("conversion failed")
+
+    monkeypatch.setattr(FormatRestorer, "_restore_package", fail)
+    target = tmp_path / "target.docx"
+    shutil.copyfile(TARGET, target)
+
+    with pytest.raises(RuntimeError):
+        restorer.restore_format(str(target), str(target))
+    assert target.read_bytes() == TARGET.read_bytes()
+    assert [path.name for path in tmp_path.iterdir()] == ["target.docx"]
+
+
+# ==================== Cleanup ====================
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+SAMPLE_BODY = f"""
+<w:document xmlns:w="{W_NS}"><w:body>
+  <w:p w:rsidR="00A1" w:rsidRDefault="00A2" w:rsidP="00A3">
+    <w:pPr>
+      <w:pStyle w:val="Heading1"/><w:keepNext/><w:spacing w:after="120"/>
+      <w:ind w:left="420"/><w:jc w:val="center"/><w:rPr><w:b/></w:rPr>
+    </w:pPr>
+    <w:proofErr w:type="spellStart"/>
+    <w:r w:rsidR="00A4" w:rsidRPr="00A5"><w:rPr><w:noProof/><w:color w:val="FF0000"/></w:rPr>
+      <w:lastRenderedPageBreak/><w:t>标题</w:t></w:r>
+    <w:proofErr w:type="spellEnd"/>
+  </w:p>
+  <w:p w:rsidR="00B1">
+    <w:pPr><w:widowControl w:val="0"/><w:ind w:firstLine="420"/><w:jc w:val="both"/>
+      <w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr></w:pPr>
+    <w:r><w:t>正文</w:t></w:r>
+  </w:p>
+  <w:tbl><w:tr w:rsidR="00C1"><w:tc><w:p><w:pPr><w:snapToGrid w:val="0"/></w:pPr>
+    <w:r><w:rPr><w:sz w:val="21"/></w:rPr><w:t>单元格</w:t></w:r></w:p></w:tc></w:tr></w:tbl>
+  <w:sectPr w:rsidR="00D1" w:rsidSect="00D2"/>
+</w:body></w:document>
+"""
+
+
+def reference_clean(root) -> None:
+    """Cleanup as done before the rule-driven pass, one collect-then-remove scan."""
+    rpr_elements, ppr_elements, nondeterministic_elements = [], [], []
+    for elem in root.iter():
+        for attr in FormatRestorer.NON_DETERMINISTIC_ATTRS:
+            if attr in elem.attrib:
+                del elem.attrib[attr]
+        if elem.tag in FormatRestorer.NON_DETERMINISTIC_ELEMENTS:
+            nondeterministic_elements.append(elem)
+        if elem.tag == f"{{{W_NS}}}pPr":
+            ppr_elements.append(elem)
+        if elem.tag == f"{{{W_NS}}}rPr":
+            rpr_elements.append(elem)
+
+    for elem in ppr_elements:
+        has_pStyle = any(child.tag == f"{{{W_NS}}}pStyle" for child in elem)
+        for child in list(elem):
+            if child.tag == f"{{{W_NS}}}pStyle" or child.tag == f"{{{W_NS}}}jc":
+                continue
+            if child.tag == f"{{{W_NS}}}ind" and not has_pStyle:
+                continue
+            elem.remove(child)
+
+    for elem in rpr_elements + nondeterministic_elements:
+        parent = elem.getparent()
+        if parent is not None:
+            parent.remove(elem)
+
+
+def test_clean_tree_matches_reference(restorer):
+    root = etree.fromstring(SAMPLE_BODY)
+    expected = etree.fromstring(SAMPLE_BODY)
+    reference_clean(expected)
+
+    removed = restorer._clean_tree(root)
+    assert etree.tostring(root) == etree.tostring(expected)
+    # keepNext, spacing, ind (styled); widowControl, numPr; snapToGrid. The w:rPr
+    # inside w:pPr is stripped with the other w:rPr elements, so it is not counted
+    assert removed == 6
+
+
+def test_clean_tree_keeps_whitelisted_properties(restorer):
+    root = etree.fromstring(SAMPLE_BODY)
+    restorer._clean_tree(root)
+    ns = {"w": W_NS}
+    styled, plain, cell = root.findall(".//w:pPr", ns)
+
+    assert [child.tag for child in styled] == [f"{{{W_NS}}}pStyle", f"{{{W_NS}}}jc"]
+    assert [child.tag for child in plain] == [f"{{{W_NS}}}ind", f"{{{W_NS}}}jc"]
+    assert len(cell) == 0
+    kept = {child.tag for pPr in (styled, plain) for child in pPr}
+    assert kept <= FormatRestorer.KEPT_PARAGRAPH_PROPERTIES
+
+    removed_tags = (
+        FormatRestorer.DIRECT_FORMATTING_ELEMENTS | FormatRestorer.NON_DETERMINISTIC_ELEMENTS
+    )
+    assert not [elem for elem in root.iter() if elem.tag in removed_tags]
+    assert not [
+        elem for elem in root.iter()
+        if set(elem.attrib) & FormatRestorer.NON_DETERMINISTIC_ATTRS
+    ]
+    assert "".join(root.itertext()).split() == ["标题", "正文", "单元格"]
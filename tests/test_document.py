@@ -0,0 +1,455 @@
+"""Tests for the document index and run helpers, checked against plain tree scans."""
+
+import contextlib
+import io
+import random
+import zipfile
+
+import pytest
+from lxml import etree
+
+from restorer.comparer import FormatComparer
+from restorer.core import FormatRestorer
+from restorer.document import DocumentIndex, merge_adjacent_runs, table_fingerprint
+from restorer.matching import ParagraphAlignment
+from restorer.template import CompiledTemplate
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+NS = {"w": W_NS}
+
+
+def w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+
+def add_paragraph(rng: random.Random, parent, depth: int):
+    """Append a paragraph with random runs, breaks, drawings and nested content."""
+    para = etree.SubElement(parent, w("p"))
+    if rng.random() < 0.5:
+        style = etree.SubElement(etree.SubElement(para, w("pPr")), w("pStyle"))
+        style.set(w("val"), rng.choice(["a", "1", "2", "af"]))
+    for _ in range(rng.randint(0, 4)):
+        run = etree.SubElement(para, w("r"))
+        roll = rng.random()
+        if roll < 0.1:
+            etree.SubElement(run, w("br")).set(w("type"), rng.choice(["page", "column", "textWrapping"]))
+        elif roll < 0.15:
+            etree.SubElement(run, w("br"))
+        elif roll < 0.25 and depth < 2:
+            # A text box, whose content is indexed as nested paragraphs
+            drawing = etree.SubElement(run, w("drawing"))
+            content = etree.SubElement(drawing, w("txbxContent"))
+            add_blocks(rng, content, depth + 1)
+        else:
+            etree.SubElement(run, w("t")).text = rng.choice(["", None, "甲", "text ", "第二段"])
+    return para
+
+
+def add_table(rng: random.Random, parent, depth: int):
+    """Append a table whose cells hold paragraphs and, sometimes, nested tables."""
+    tbl = etree.SubElement(parent, w("tbl"))
+    for _ in range(rng.randint(1, 3)):
+        tr = etree.SubElement(tbl, w("tr"))
+        for _ in range(rng.randint(1, 3)):
+            tc = etree.SubElement(tr, w("tc"))
+            roll = rng.random()
+            if roll < 0.5:
+                vmerge = etree.SubElement(etree.SubElement(tc, w("tcPr")), w("vMerge"))
+                if roll < 0.3:
+                    vmerge.set(w("val"), "restart")
+            add_blocks(rng, tc, depth + 1)
+    return tbl
+
+
+def add_blocks(rng: random.Random, parent, depth: int) -> None:
+    for _ in range(rng.randint(1, 3)):
+        if depth < 3 and rng.random() < 0.3 / (depth + 1):
+            add_table(rng, parent, depth)
+        else:
+            add_paragraph(rng, parent, depth)
+
+
+def random_document(seed: int):
+    rng = random.Random(seed)
+    root = etree.Element(w("document"), nsmap={"w": W_NS})
+    body = etree.SubElement(root, w("body"))
+    for _ in range(30):
+        add_blocks(rng, body, 0)
+    return root
+
+
+def scan(para) -> dict:
+    """Facts about a paragraph, found with one XPath query each."""
+    cells = para.xpath("ancestor::w:tc", namespaces=NS)
+    return {
+        "text": "".join(para.xpath(".//w:t/text()", namespaces=NS)),
+        "style": next(iter(para.xpath("w:pPr/w:pStyle/@w:val", namespaces=NS)), None),
+        "in_table_cell": bool(cells),
+        "vmerge_restart": bool(cells) and bool(cells[-1].xpath("w:tcPr/w:vMerge[@w:val='restart']", namespaces=NS)),
+        "has_drawing": bool(para.xpath(".//w:drawing", namespaces=NS)),
+        "has_table": bool(para.xpath(".//w:tbl", namespaces=NS)),
+        "has_page_break": bool(para.xpath(".//w:br[@w:type='page']", namespaces=NS)),
+    }
+
+
+def record_facts(record) -> dict:
+    return {name: getattr(record, name) for name in scan(record.element)}
+
+
+def assert_index_matches_tree(index: DocumentIndex, root) -> None:
+    """Check every record against a fresh scan of the tree."""
+    paragraphs = list(root.iter(w("p")))
+    assert [record.element for record in index] == paragraphs
+    for position, (record, para) in enumerate(zip(index, paragraphs)):
+        assert index.get(para) is record
+        assert record.position == position
+        assert record.sibling_position == para.getparent().index(para)
+        assert record.text_nodes == para.xpath(".//w:t", namespaces=NS)
+        assert record_facts(record) == scan(para)
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_index_matches_tree_scan(seed):
+    root = random_document(seed)
+    index = DocumentIndex(root)
+
+    assert len(index) == len(root.xpath("//w:p", namespaces=NS))
+    assert_index_matches_tree(index, root)
+
+
+def test_refresh_texts_picks_up_edits():
+    root = random_document(5)
+    index = DocumentIndex(root)
+    for i, node in enumerate(root.iter(w("t"))):
+        node.text = None if i % 3 == 0 else f"新{i}"
+    index.refresh_texts()
+
+    for record in index:
+        assert record.text == scan(record.element)["text"]
+
+
+def make_table(rows, widths):
+    """Build a table with the given cell texts and grid column widths."""
+    tbl = etree.Element(w("tbl"))
+    grid = etree.SubElement(tbl, w("tblGrid"))
+    for width in widths:
+        etree.SubElement(grid, w("gridCol")).set(w("w"), str(width))
+    for cells in rows:
+        tr = etree.SubElement(tbl, w("tr"))
+        for text, width in zip(cells, widths):
+            tc = etree.SubElement(tr, w("tc"))
+            etree.SubElement(etree.SubElement(tc, w("tcPr")), w("tcW")).set(w("w"), str(width))
+            etree.SubElement(etree.SubElement(etree.SubElement(tc, w("p")), w("r")), w("t")).text = text
+    return tbl
+
+
+def make_document(blocks):
+    """Build a document from paragraph texts and table elements, in order."""
+    root = etree.Element(w("document"), nsmap={"w": W_NS})
+    body = etree.SubElement(root, w("body"))
+    for block in blocks:
+        if isinstance(block, str):
+            etree.SubElement(etree.SubElement(etree.SubElement(body, w("p")), w("r")), w("t")).text = block
+        else:
+            body.append(block)
+    return root
+
+
+def build_package(root) -> bytes:
+    package = io.BytesIO()
+    with zipfile.ZipFile(package, "w") as zf:
+        zf.writestr("word/document.xml", etree.tostring(root, xml_declaration=True, encoding="UTF-8"))
+    return package.getvalue()
+
+
+def xpath_fingerprint(tbl):
+    """Table fingerprint computed with XPath queries."""
+    return (
+        int(tbl.xpath("count(w:tr)", namespaces=NS)),
+        int(tbl.xpath("count(w:tr[1]/w:tc)", namespaces=NS)),
+        int(tbl.xpath("count(w:tblGrid/w:gridCol)", namespaces=NS)),
+        "".join(tbl.xpath("w:tr[1]//w:t/text()", namespaces=NS)),
+    )
+
+
+def test_table_fingerprint_matches_xpath():
+    tables = [tbl for seed in (1, 2) for tbl in random_document(seed).iter(w("tbl"))]
+    tables.append(etree.Element(w("tbl")))
+
+    assert tables
+    for tbl in tables:
+        assert table_fingerprint(tbl) == xpath_fingerprint(tbl)
+
+
+def test_table_fingerprint_ignores_widths():
+    rows = [["姓名", "年龄"], ["张三", "30"]]
+    fingerprint = table_fingerprint(make_table(rows, [2000, 3000]))
+
+    assert table_fingerprint(make_table(rows, [4000, 1000])) == fingerprint
+    assert table_fingerprint(make_table(rows + [["李四", "40"]], [2000, 3000])) != fingerprint
+    assert table_fingerprint(make_table([["姓名", "性别"], ["张三", "30"]], [2000, 3000])) != fingerprint
+    assert table_fingerprint(make_table(rows, [2000, 3000, 1000])) != fingerprint
+
+
+TEMPLATE_TABLES = {
+    # Name: (caption paragraph or None, rows)
+    "unique": (None, [["编号", "名称", "备注"], ["1", "甲", ""]]),
+    "twin1": (None, [["序号", "内容"], ["1", "乙"]]),
+    "twin2": (None, [["序号", "内容"], ["2", "丙"]]),
+    "people": ("表1 人员名单", [["姓名", "年龄"], ["张三", "30"]]),
+    "people_extra": ("表1 人员名单", [["姓名", "部门"], ["张三", "研发"]]),
+    "devices": ("表2 设备清单一览", [["设备", "数量"], ["电脑", "2"]]),
+}
+
+
+def template_blocks(tables, widths):
+    blocks = []
+    for name, (caption, rows) in tables.items():
+        if caption is not None:
+            blocks.append(caption)
+        blocks.append(make_table(rows, widths[:len(rows[0])]))
+    return blocks
+
+
+def test_template_table_lookups_match_tree_scan():
+    template = CompiledTemplate(build_package(make_document(template_blocks(TEMPLATE_TABLES, [1000, 2000, 3000]))))
+    tables = list(template.document_tree.getroot().iter(w("tbl")))
+
+    expected_fingerprints, expected_keys = {}, {}
+    for i, tbl in enumerate(tables):
+        previous = tbl.getprevious()
+        caption = scan(previous)["text"] if previous is not None and previous.tag == w("p") else ""
+        expected_fingerprints.setdefault(xpath_fingerprint(tbl), []).append(i)
+        expected_keys.setdefault((xpath_fingerprint(tbl), caption), []).append(i)
+
+    assert template.tables == tables
+    assert template.table_fingerprints == expected_fingerprints
+    assert template.table_keys == expected_keys
+
+
+def test_find_template_table(tmp_path):
+    template_root = make_document(template_blocks(TEMPLATE_TABLES, [1000, 2000, 3000]))
+    template_path = tmp_path / "template.docx"
+    template_path.write_bytes(build_package(template_root))
+    restorer = FormatRestorer(str(template_path))
+    template = restorer.compiled_template
+    by_name = dict(zip(TEMPLATE_TABLES, template.tables))
+
+    target_tables = {
+        # Target table name: (caption, rows, expected template table)
+        "unique": (None, TEMPLATE_TABLES["unique"][1], "unique"),
+        "twin": (None, TEMPLATE_TABLES["twin1"][1], None),
+        # Same caption as two template tables: the structure picks one
+        "people_extra": ("表1 人员名单", [["姓名", "部门"], ["李四", "市场"]], "people_extra"),
+        # Similar caption, different structure: the caption alone matches
+        "devices": ("表2 设备清单一览表", [["设备", "数量"], ["电脑", "2"], ["显示器", "3"]], "devices"),
+        "unknown": ("完全不同的说明文字", [["甲"], ["乙"]], None),
+    }
+    blocks = []
+    for caption, rows, _ in target_tables.values():
+        # Uncaptioned tables are separated by a table, so they have no preceding paragraph
+        blocks.append(caption if caption is not None else make_table([["分隔"]], [500]))
+        blocks.append(make_table(rows, [4000, 500, 500][:len(rows[0])]))
+    root = make_document(blocks)
+    index = DocumentIndex(root)
+    alignment = ParagraphAlignment(index, template)
+
+    tables = [tbl for tbl in root.iter(w("tbl")) if xpath_fingerprint(tbl)[3] != "分隔"]
+    for tbl, (caption, _, expected) in zip(tables, target_tables.values()):
+        previous = tbl.getprevious()
+        match = alignment.get(previous) if previous is not None else None
+        assert (match is None) == (caption is None)
+        found = restorer._find_template_table(template, alignment, tbl, match)
+        assert found is (by_name[expected] if expected else None)
+
+
+def new_paragraph(rng: random.Random):
+    """A paragraph to insert: a page break, some text, or a text box with its own paragraphs."""
+    para = etree.Element(w("p"))
+    run = etree.SubElement(para, w("r"))
+    roll = rng.random()
+    if roll < 0.4:
+        etree.SubElement(run, w("br")).set(w("type"), "page")
+    elif roll < 0.8:
+        etree.SubElement(run, w("t")).text = f"插入{rng.randrange(100)}"
+    else:
+        content = etree.SubElement(etree.SubElement(run, w("drawing")), w("txbxContent"))
+        add_blocks(rng, content, 2)
+    return para
+
+
+def insert_random(rng: random.Random, index: DocumentIndex, count: int) -> None:
+    """Insert paragraphs before random indexed ones, including ones inserted earlier."""
+    references = [record.element for record in index]
+    for _ in range(count):
+        before = rng.choice(references)
+        para = new_paragraph(rng)
+        record = index.insert(para, before)
+
+        assert record.element is para and index.get(para) is record
+        assert record_facts(record) == scan(para)
+        for inserted in para.iter(w("p")):
+            assert index.get(inserted) is not None
+            references.append(inserted)
+        # Now and then, insert again right before the same reference
+        if rng.random() < 0.3:
+            index.insert(new_paragraph(rng), before)
+
+
+def test_inserts_update_records():
+    root = random_document(6)
+    index = DocumentIndex(root)
+    insert_random(random.Random(7), index, 60)
+
+    assert_index_matches_tree(index, root)
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_batch_inserts_match_tree_scan(seed):
+    root = random_document(seed)
+    index = DocumentIndex(root)
+    with index.batch():
+        insert_random(random.Random(seed), index, 100)
+        with index.batch():
+            insert_random(random.Random(seed + 100), index, 20)
+
+    assert_index_matches_tree(index, root)
+
+
+def test_batch_and_single_inserts_agree():
+    results = []
+    for batched in (False, True):
+        root = random_document(6)
+        index = DocumentIndex(root)
+        with index.batch() if batched else contextlib.nullcontext():
+            insert_random(random.Random(7), index, 60)
+        results.append((etree.tostring(root), [record_facts(record) for record in index]))
+
+    assert results[0] == results[1]
+
+
+def test_remove_inside_batch_flushes_inserts():
+    root = random_document(9)
+    index = DocumentIndex(root)
+    with index.batch():
+        insert_random(random.Random(9), index, 30)
+        index.remove([index.paragraphs[5].element])
+        assert_index_matches_tree(index, root)
+        insert_random(random.Random(10), index, 30)
+
+    assert_index_matches_tree(index, root)
+
+
+def test_remove_renumbers_records():
+    rng = random.Random(8)
+    root = random_document(8)
+    index = DocumentIndex(root)
+    paragraphs = [record.element for record in index]
+    removed = rng.sample(paragraphs, 200)
+    # Paragraphs nested in a removed paragraph are dropped with it
+    dropped = {nested for para in removed for nested in para.iter(w("p"))}
+
+    assert index.remove(removed) == len(removed)
+    assert len(dropped) > len(removed)
+    assert_index_matches_tree(index, root)
+    for para in dropped:
+        assert index.get(para) is None
+
+
+def add_runs(rng: random.Random, para, depth: int) -> None:
+    """Append runs with a few rPr variants and assorted children."""
+    for _ in range(rng.randint(0, 8)):
+        run = etree.SubElement(para, w("r"))
+        formatting = rng.choice([None, None, "b", "sz", "sz-swapped"])
+        if formatting == "b":
+            etree.SubElement(etree.SubElement(run, w("rPr")), w("b"))
+        elif formatting is not None:
+            size = etree.SubElement(etree.SubElement(run, w("rPr")), w("sz"))
+            # Attribute order differs, the canonical form does not
+            for name in (["val", "hint"] if formatting == "sz" else ["hint", "val"]):
+                size.set(w(name), "24")
+        for _ in range(rng.randint(0, 3)):
+            roll = rng.random()
+            if roll < 0.6:
+                etree.SubElement(run, w("t")).text = rng.choice(["", None, "ab", "中文", " "])
+            elif roll < 0.7:
+                etree.SubElement(run, w("tab"))
+            elif roll < 0.8:
+                etree.SubElement(run, w("br")).set(w("type"), rng.choice(["page", "column"]))
+            elif roll < 0.9 or depth:
+                etree.SubElement(run, w("lastRenderedPageBreak"))
+            else:
+                # A text box, whose paragraph is merged too
+                content = etree.SubElement(etree.SubElement(run, w("drawing")), w("txbxContent"))
+                add_runs(rng, etree.SubElement(content, w("p")), depth + 1)
+
+
+def random_runs(seed: int):
+    rng = random.Random(seed)
+    root = etree.Element(w("document"), nsmap={"w": W_NS})
+    body = etree.SubElement(root, w("body"))
+    for _ in range(300):
+        add_runs(rng, etree.SubElement(body, w("p")), 0)
+    return root
+
+
+def reference_merge(root, isolate=None, carry=None) -> int:
+    """The former run merge: one pair of runs at a time, listing the runs again after each merge."""
+    def can_merge(run1, run2) -> bool:
+        if isolate is not None and (isolate(run1) or isolate(run2)):
+            return False
+        rpr1, rpr2 = run1.find(w("rPr")), run2.find(w("rPr"))
+        if rpr1 is None or rpr2 is None:
+            return rpr1 is rpr2
+        return etree.tostring(rpr1, method="c14n") == etree.tostring(rpr2, method="c14n")
+
+    def merge_text(target, source) -> None:
+        target_texts, source_texts = target.findall(w("t")), source.findall(w("t"))
+        carried = [child for child in source if child.tag != w("t") and carry(child)] if carry else []
+        if not target_texts:
+            target.extend(source_texts)
+        elif source_texts:
+            last, first = target_texts[-1], source_texts[0]
+            if last.text and first.text:
+                last.text = last.text + first.text
+            elif first.text:
+                last.text = first.text
+            target.extend(source_texts[1:])
+        target.extend(carried)
+
+    merged = 0
+    for para in root.findall(".//w:p", NS):
+        runs = para.findall(w("r"))
+        i = 0
+        while i < len(runs) - 1:
+            if can_merge(runs[i], runs[i + 1]):
+                merge_text(runs[i], runs[i + 1])
+                para.remove(runs[i + 1])
+                runs = para.findall(w("r"))
+                merged += 1
+            else:
+                i += 1
+    return merged
+
+
+def is_separate(run) -> bool:
+    # The predicate the restorer passes: tabs and page breaks stay in their own runs
+    br = run.find(w("br"))
+    return run.find(w("tab")) is not None or (br is not None and br.get(w("type")) == "page")
+
+
+@pytest.mark.parametrize("isolate, carry", [
+    (None, None),
+    (is_separate, None),
+    (None, lambda child: child.tag not in FormatComparer.IGNORE_ELEMENTS),
+    (is_separate, lambda child: True),
+], ids=["plain", "isolate", "carry", "both"])
+@pytest.mark.parametrize("seed", [1, 2])
+def test_merge_adjacent_runs_matches_reference(seed, isolate, carry):
+    expected = random_runs(seed)
+    expected_count = reference_merge(expected, isolate, carry)
+    root = random_runs(seed)
+
+    assert merge_adjacent_runs(root, isolate, carry) == expected_count
+    assert expected_count > 0
+    assert etree.tostring(root) == etree.tostring(expected)
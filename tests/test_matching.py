@@ -0,0 +1,279 @@
+"""Tests for the paragraph matching helpers, checked against brute-force scoring."""
+
+import io
+import itertools
+import random
+import zipfile
+from difflib import SequenceMatcher
+
+import pytest
+from lxml import etree
+
+from restorer.document import DocumentIndex
+from restorer.matching import (
+    MatcherCache, MinHashIndex, NgramIndex, ParagraphAlignment, VectorIndex, best_match, ratio_above,
+)
+from restorer.template import CompiledTemplate
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+CJK = "".join(chr(0x4E00 + i) for i in range(3000))
+
+
+def mutate(rng: random.Random, text: str, alphabet: str, edits: int) -> str:
+    """Apply random substitutions, insertions and deletions to a text."""
+    chars = list(text)
+    for _ in range(edits):
+        op = rng.randrange(3)
+        if op == 0 and chars:
+            chars[rng.randrange(len(chars))] = rng.choice(alphabet)
+        elif op == 1:
+            chars.insert(rng.randrange(len(chars) + 1), rng.choice(alphabet))
+        elif chars:
+            del chars[rng.randrange(len(chars))]
+    return "".join(chars)
+
+
+def near_duplicates(seed: int, count: int, alphabet: str, lengths=(1, 40)):
+    """Texts in families of small edits of one another, so many pairs are close."""
+    rng = random.Random(seed)
+    texts = []
+    while len(texts) < count:
+        base = "".join(rng.choices(alphabet, k=rng.randint(*lengths)))
+        texts.append(base)
+        for _ in range(rng.randint(0, 4)):
+            texts.append(mutate(rng, base, alphabet, rng.randint(0, 3)))
+    return texts[:count]
+
+
+def build_document(texts) -> bytes:
+    """Build a document.xml with one single-run paragraph per text."""
+    root = etree.Element(f"{{{W_NS}}}document", nsmap={"w": W_NS})
+    body = etree.SubElement(root, f"{{{W_NS}}}body")
+    for text in texts:
+        run = etree.SubElement(etree.SubElement(body, f"{{{W_NS}}}p"), f"{{{W_NS}}}r")
+        etree.SubElement(run, f"{{{W_NS}}}t").text = text
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def compile_template(texts) -> CompiledTemplate:
+    package = io.BytesIO()
+    with zipfile.ZipFile(package, "w") as zf:
+        zf.writestr("word/document.xml", build_document(texts))
+    return CompiledTemplate(package.getvalue())
+
+
+def align(template: CompiledTemplate, texts):
+    """Align a target with the given paragraph texts; return the alignment and its index."""
+    index = DocumentIndex(etree.fromstring(build_document(texts)))
+    return ParagraphAlignment(index, template), index
+
+
+def brute_force(query: str, texts, threshold: float):
+    """Indices of non-empty texts whose ratio with the query exceeds the threshold, either way round."""
+    return {
+        i for i, text in enumerate(texts)
+        if text and max(
+            SequenceMatcher(None, query, text).ratio(),
+            SequenceMatcher(None, text, query).ratio(),
+        ) > threshold
+    }
+
+
+@pytest.mark.parametrize("threshold", [0.9, 0.8, 0.7])
+@pytest.mark.parametrize("alphabet", ["abc", "abcdefghij", "的一是在不了有和人这中大为上个国"])
+def test_ngram_candidates_include_every_match(threshold, alphabet):
+    texts = near_duplicates(1, 150, alphabet)
+    index = NgramIndex(texts, threshold)
+
+    for query in near_duplicates(2, 60, alphabet):
+        candidates = index.candidates(query)
+        assert candidates == sorted(set(candidates))
+        assert brute_force(query, texts, threshold) <= set(candidates)
+
+
+@pytest.mark.parametrize("threshold", [0.9, 0.6, 0.5])
+def test_ngram_candidates_short_texts(threshold):
+    # Texts of one to three characters can match without sharing any bigram
+    alphabet = "ab"
+    texts = [""] + ["".join(chars) for n in (1, 2, 3) for chars in itertools.product(alphabet, repeat=n)]
+    index = NgramIndex(texts, threshold)
+
+    for query in texts[1:]:
+        assert brute_force(query, texts, threshold) <= set(index.candidates(query))
+
+
+def test_ngram_candidates_skip_empty():
+    index = NgramIndex(["", "abc", ""], 0.5)
+    assert index.candidates("") == []
+    assert index.candidates("abc") == [1]
+
+
+@pytest.mark.parametrize("threshold", [0.9, 0.7])
+def test_ratio_above_matches_sequence_matcher(threshold):
+    texts = near_duplicates(3, 60, "abcdef")
+    cache = MatcherCache()
+
+    for a in texts[:30]:
+        for b in texts:
+            ratio = SequenceMatcher(None, a, b).ratio()
+            expected = ratio if ratio > threshold else 0.0
+            assert ratio_above(a, b, threshold) == expected
+            assert ratio_above(a, b, threshold, cache) == expected
+
+
+@pytest.mark.parametrize("text_first", [True, False])
+def test_best_match_matches_plain_scan(text_first):
+    texts = near_duplicates(4, 80, "abcdef")
+    cache = MatcherCache()
+
+    for text in near_duplicates(5, 40, "abcdef"):
+        best_key, best_ratio = None, 0.0
+        for key, candidate in enumerate(texts):
+            pair = (text, candidate) if text_first else (candidate, text)
+            ratio = SequenceMatcher(None, *pair).ratio()
+            if ratio > 0.8 and ratio > best_ratio:
+                best_key, best_ratio = key, ratio
+
+        assert best_match(text, enumerate(texts), 0.8, cache, text_first) == (best_key, best_ratio)
+
+
+@pytest.mark.parametrize("alphabet", ["abcdefghij ", CJK], ids=["latin", "cjk"])
+def test_vector_candidates_include_ngram_candidates(alphabet):
+    pytest.importorskip("numpy")
+    texts = near_duplicates(6, 200, alphabet, lengths=(5, 60))
+    queries = near_duplicates(7, 100, alphabet, lengths=(5, 60))
+    ngram = NgramIndex(texts)
+    vector = VectorIndex(texts)
+    # Small blocks exercise the block boundaries
+    vector.BLOCK_SIZE = 48
+
+    missed = 0
+    for query, candidates in zip(queries, vector.candidates_many(queries)):
+        assert candidates == sorted(candidates)
+        missed += len(set(ngram.candidates(query)) - set(candidates))
+        missed += len(brute_force(query, texts, 0.9) - set(candidates))
+    assert missed == 0
+
+
+def test_density_separates_latin_from_cjk():
+    rng = random.Random(8)
+    latin = ["".join(rng.choices("abcdefghij ", k=40)) for _ in range(300)]
+    cjk = ["".join(rng.choices(CJK, k=40)) for _ in range(300)]
+
+    latin_density = NgramIndex(latin).density(latin[:20])
+    cjk_density = NgramIndex(cjk).density(cjk[:20])
+    assert cjk_density < ParagraphAlignment.VECTORIZE_MIN_DENSITY < latin_density
+    assert NgramIndex(latin).density([]) == 0.0
+
+
+@pytest.mark.parametrize("alphabet", ["abcdefghij ", CJK], ids=["latin", "cjk"])
+def test_alignment_results_do_not_depend_on_backend(monkeypatch, alphabet):
+    pytest.importorskip("numpy")
+    rng = random.Random(9)
+    template_texts = near_duplicates(10, 300, alphabet, lengths=(10, 60))
+    target_texts = [mutate(rng, text, alphabet, 2) for text in template_texts]
+    # Move blocks around, so some paragraphs are only found outside their window
+    blocks = [target_texts[i:i + 50] for i in range(0, len(target_texts), 50)]
+    rng.shuffle(blocks)
+    target_texts = [text for block in blocks for text in block]
+    template = compile_template(template_texts)
+
+    def scored_all():
+        alignment, index = align(template, target_texts)
+        return [alignment.scored(alignment.get(record.element)) for record in index if record.text]
+
+    monkeypatch.setattr(ParagraphAlignment, "VECTORIZE_MIN_PAIRS", 10 ** 12)
+    expected = scored_all()
+    monkeypatch.setattr(ParagraphAlignment, "VECTORIZE_MIN_PAIRS", 0)
+    monkeypatch.setattr(ParagraphAlignment, "VECTORIZE_MIN_DENSITY", 0.0)
+    assert scored_all() == expected
+
+
+def test_alignment_scores_match_brute_force():
+    rng = random.Random(11)
+    template_texts = near_duplicates(12, 240, "abcdefgh", lengths=(8, 40))
+    target_texts = [mutate(rng, text, "abcdefgh", rng.randint(0, 2)) for text in template_texts]
+    # Drop, insert and move paragraphs so windows and anchors are uneven
+    del target_texts[30:40]
+    target_texts[100:100] = near_duplicates(13, 15, "abcdefgh", lengths=(8, 40))
+    target_texts[150:190], target_texts[190:230] = target_texts[190:230], target_texts[150:190]
+    alignment, index = align(compile_template(template_texts), target_texts)
+
+    for record in index:
+        match = alignment.get(record.element)
+        if not record.text:
+            assert match is None
+            continue
+        first, last = match.window
+        exact = [j for j, text in enumerate(template_texts) if text == record.text and first <= j <= last]
+        assert list(match.exact) == exact
+        if exact:
+            continue
+
+        ratios = [(j, SequenceMatcher(None, record.text, text).ratio()) for j, text in enumerate(template_texts)]
+        inside = [(j, r) for j, r in ratios if first <= j <= last and r > 0.9]
+        outside = [(j, r) for j, r in ratios if not first <= j <= last and r > 0.9]
+        assert alignment.scored(match) == (inside or outside)
+
+
+def test_alignment_anchors_keep_document_order():
+    template = compile_template(["甲段落", "乙段落", "丙段落", "丁段落"])
+    alignment, index = align(template, ["甲段落", "丙段落", "乙段落", "丁段落"])
+    windows = [alignment.get(record.element).window for record in index]
+
+    # Unique texts are pinned only if they keep their order: 乙 and 丙 cross
+    assert windows[0] == (0, 0) and windows[3] == (3, 3)
+    assert [windows[1] == (2, 2), windows[2] == (1, 1)].count(True) == 1
+
+
+def test_alignment_disambiguates_repeated_headings():
+    template_texts = ["第一章 总则", "定义", "本章正文甲甲甲", "第二章 范围", "定义", "本章正文乙乙乙"]
+    target_texts = ["第一章 总则", "定义", "本章正文甲甲乙", "第二章 范围", "定义", "本章正文乙乙甲"]
+    alignment, index = align(compile_template(template_texts), target_texts)
+    records = list(index)
+
+    assert list(alignment.get(records[1].element).exact) == [1]
+    assert list(alignment.get(records[4].element).exact) == [4]
+    assert alignment.best_target(1) == (records[1].element, 1.0)
+    assert alignment.best_target(4) == (records[4].element, 1.0)
+
+
+def test_alignment_falls_back_outside_the_window():
+    filler = ["填充段落第%d号内容" % i for i in range(200)]
+    moved = "这一段被移动到了文档的另一端位置"
+    template_texts = [moved] + filler
+    target_texts = filler + [moved + "。"]
+    alignment, index = align(compile_template(template_texts), target_texts)
+    match = alignment.get(list(index)[-1].element)
+
+    assert not match.window[0] <= 0 <= match.window[1]
+    assert [j for j, _ in alignment.scored(match)] == [0]
+
+
+# Recall the MinHash LSH index must reach against exhaustive matching
+LSH_MIN_RECALL = 0.99
+
+
+@pytest.mark.parametrize("alphabet", ["abcdefghijklmnop ", CJK], ids=["latin", "cjk"])
+def test_minhash_recall(alphabet):
+    rng = random.Random(14)
+    texts = near_duplicates(14, 600, alphabet, lengths=(20, 120))
+    queries = [mutate(rng, text, alphabet, rng.randint(1, 3)) for text in rng.sample(texts, 200)]
+    lsh = MinHashIndex(texts)
+    exhaustive = NgramIndex(texts)
+
+    expected = found = best_expected = best_found = 0
+    for query in queries:
+        candidates = set(lsh.candidates(query))
+        matches = [(ratio_above(query, texts[i], 0.9), i) for i in exhaustive.candidates(query)]
+        matches = [(ratio, i) for ratio, i in matches if ratio]
+        expected += len(matches)
+        found += sum(1 for _, i in matches if i in candidates)
+        if matches:
+            best_ratio = max(ratio for ratio, _ in matches)
+            best_expected += 1
+            best_found += any(i in candidates for ratio, i in matches if ratio == best_ratio)
+
+    assert expected > len(queries)
+    assert found / expected >= LSH_MIN_RECALL
+    assert best_found / best_expected >= LSH_MIN_RECALL
@@ -0,0 +1,81 @@
+"""Tests for the package I/O helpers."""
+
+import io
+import zipfile
+
+import pytest
+
+from restorer import package as package_module
+from restorer.package import DocxPackage, OutputPackage, PackageWriter
+
+PARTS = {
+    "[Content_Types].xml": b"<Types/>",
+    "word/document.xml": b"<w:document>" + b"<w:p/>" * 500 + b"</w:document>",
+    "word/media/image1.png": bytes(range(256)) * 8,
+}
+
+
+def build_package() -> bytes:
+    """Build a package with deflated and stored parts."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in PARTS.items():
+            compression = zipfile.ZIP_STORED if name.endswith(".png") else zipfile.ZIP_DEFLATED
+            zf.writestr(zipfile.ZipInfo(name, date_time=(2024, 1, 8, 12, 0, 0)), data, compression)
+    return buffer.getvalue()
+
+
+def copy_all(data: bytes) -> bytes:
+    """Copy every part of a package through PackageWriter.copy."""
+    output = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, PackageWriter(output) as writer:
+        for name in source.namelist():
+            writer.copy(source, name)
+    return output.getvalue()
+
+
+def assert_same_parts(original: bytes, copied: bytes) -> None:
+    with zipfile.ZipFile(io.BytesIO(original)) as a, zipfile.ZipFile(io.BytesIO(copied)) as b:
+        assert b.testzip() is None
+        assert b.namelist() == a.namelist()
+        for info in a.infolist():
+            other = b.getinfo(info.filename)
+            assert b.read(other) == a.read(info)
+            assert (other.date_time, other.compress_type) == (info.date_time, info.compress_type)
+
+
+def test_raw_copy_keeps_compressed_bytes():
+    data = build_package()
+    copied = copy_all(data)
+
+    assert_same_parts(data, copied)
+    with zipfile.ZipFile(io.BytesIO(data)) as a, zipfile.ZipFile(io.BytesIO(copied)) as b:
+        for info in a.infolist():
+            assert b.getinfo(info.filename).compress_size == info.compress_size
+
+
+def test_copy_falls_back_without_zipfile_internals(monkeypatch):
+    # Simulate a Python version whose ZipFile lacks the private attributes
+    monkeypatch.setattr(package_module, "_WRITER_INTERNALS", ("_missing_internal",))
+    data = build_package()
+
+    assert_same_parts(data, copy_all(data))
+
+
+@pytest.mark.parametrize("raw_copy", [True, False])
+def test_output_package_round_trip(monkeypatch, raw_copy):
+    if not raw_copy:
+        monkeypatch.setattr(package_module, "_WRITER_INTERNALS", ("_missing_internal",))
+    data = build_package()
+
+    with DocxPackage(io.BytesIO(data)) as package:
+        output = OutputPackage(package)
+        output["word/document.xml"] = b"<w:document/>"
+        saved = io.BytesIO()
+        output.save(saved)
+        assert not package.is_loaded("word/media/image1.png")
+
+    with DocxPackage(io.BytesIO(saved.getvalue())) as result:
+        assert list(result) == list(PARTS)
+        assert result["word/document.xml"] == b"<w:document/>"
+        assert result["word/media/image1.png"] == PARTS["word/media/image1.png"]
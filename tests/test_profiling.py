@@ -0,0 +1,85 @@
+"""Tests for the profiling helpers' size and depth caps."""
+
+import marshal
+import pstats
+
+import pytest
+
+from restorer import profiling
+from restorer.profiling import MAX_STACK_DEPTH, _capped_stats, _collapsed_lines, profiled
+
+
+def func(n: int):
+    return (f"/src/module{n % 7}.py", n, f"function_{n}")
+
+
+def flat_stats(count: int) -> dict:
+    """Stats of `count` functions called from one root, function n taking n ms."""
+    root = func(0)
+    stats = {root: (1, 1, 0.001, count * count / 1000.0, {})}
+    for n in range(1, count):
+        stats[func(n)] = (1, 1, n / 1000.0, n / 1000.0, {root: (1, 1, n / 1000.0, n / 1000.0)})
+    return stats
+
+
+def chain_stats(depth: int) -> dict:
+    """Stats of a call chain `depth` functions deep, each taking 1 ms of its own."""
+    stats = {}
+    for n in range(depth):
+        callers = {func(n - 1): (1, 1, 0.001, (depth - n) / 1000.0)} if n else {}
+        stats[func(n)] = (1, 1, 0.001, (depth - n) / 1000.0, callers)
+    return stats
+
+
+def test_capped_stats_keeps_uncapped_stats_whole():
+    stats = flat_stats(50)
+    assert _capped_stats(stats, 10 ** 9) == marshal.dumps(stats)
+
+
+@pytest.mark.parametrize("max_bytes", [20_000, 5_000, 1_000])
+def test_capped_stats_respects_max_bytes(tmp_path, max_bytes):
+    stats = flat_stats(2000)
+    assert len(marshal.dumps(stats)) > max_bytes
+
+    data = _capped_stats(stats, max_bytes)
+    assert len(data) <= max_bytes
+
+    kept = marshal.loads(data)
+    # The slowest functions are kept, and no edge points at a dropped function
+    slowest = sorted(stats, key=lambda f: stats[f][3], reverse=True)[:len(kept)]
+    assert set(kept) == set(slowest)
+    assert all(set(callers) <= set(kept) for _, _, _, _, callers in kept.values())
+
+    path = tmp_path / "capped.prof"
+    path.write_bytes(data)
+    assert len(pstats.Stats(str(path)).stats) == len(kept)
+
+
+def test_collapsed_lines_truncate_at_max_stack_depth():
+    lines = _collapsed_lines(chain_stats(MAX_STACK_DEPTH + 50))
+
+    depths = [line.rsplit(" ", 1)[0].count(";") + 1 for line in lines]
+    assert max(depths) == MAX_STACK_DEPTH
+    assert len(lines) == MAX_STACK_DEPTH
+
+
+def test_collapsed_lines_follow_call_paths():
+    lines = _collapsed_lines(chain_stats(3))
+
+    assert lines == [
+        "function_0 (module0.py:0) 1000",
+        "function_0 (module0.py:0);function_1 (module1.py:1) 1000",
+        "function_0 (module0.py:0);function_1 (module1.py:1);function_2 (module2.py:2) 1000",
+    ]
+
+
+def test_profiled_caps_both_files(tmp_path):
+    path = tmp_path / "run.prof"
+
+    with pytest.raises(ZeroDivisionError):
+        with profiled(path, max_bytes=2_000):
+            sorted(str(n) for n in range(2000))
+            1 / 0
+
+    assert 0 < path.stat().st_size <= 2_000
+    assert profiling.collapsed_path(path).stat().st_size <= 2_000
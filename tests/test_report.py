@@ -0,0 +1,105 @@
+"""Tests for RestoreReport stage timings and rendering."""
+
+import json
+import time
+import types
+
+import pytest
+
+from restorer import report as report_module
+from restorer.report import RestoreReport
+
+
+class FakeClock:
+    """Wall and CPU clocks that only move when advanced."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+    def install(self, monkeypatch) -> None:
+        clock = types.SimpleNamespace(perf_counter=lambda: self.now, process_time=lambda: self.now)
+        monkeypatch.setattr(report_module, "time", clock)
+
+
+def test_nested_stages_are_exclusive(monkeypatch):
+    clock = FakeClock()
+    clock.install(monkeypatch)
+    report = RestoreReport()
+
+    with report.stage("parent"):
+        clock.advance(1.0)
+        with report.stage("child"):
+            clock.advance(2.0)
+            with report.stage("grandchild"):
+                clock.advance(4.0)
+        clock.advance(8.0)
+        with report.stage("child"):
+            clock.advance(16.0)
+
+    assert {name: timing.wall for name, timing in report.stages.items()} == {
+        "parent": 9.0, "child": 18.0, "grandchild": 4.0,
+    }
+    assert report.stages["child"].calls == 2
+    assert report.stages["parent"].cpu == 9.0
+    assert report.wall_time == report.cpu_time == clock.now
+
+
+def test_nested_stages_add_up_to_wall_time():
+    report = RestoreReport()
+    start = time.perf_counter()
+    with report.stage("parent"):
+        time.sleep(0.02)
+        with report.stage("child"):
+            time.sleep(0.03)
+    elapsed = time.perf_counter() - start
+
+    parent, child = report.stages["parent"].wall, report.stages["child"].wall
+    assert child >= 0.03
+    assert parent >= 0.02
+    assert parent + child == pytest.approx(elapsed, abs=0.005)
+
+
+def test_stage_is_recorded_when_it_raises(monkeypatch):
+    clock = FakeClock()
+    clock.install(monkeypatch)
+    report = RestoreReport()
+
+    with pytest.raises(ValueError):
+        with report.stage("parent"):
+            with report.stage("child"):
+                clock.advance(1.0)
+                raise ValueError("stage failed")
+
+    assert report.stages["child"].wall == 1.0
+    assert report.stages["parent"].wall == 0.0
+    # The stack of open stages is empty again
+    with report.stage("next"):
+        clock.advance(0.5)
+    assert report.stages["parent"].wall == 0.0
+
+
+def test_to_dict_and_format_include_every_stage_and_count():
+    report = RestoreReport()
+    for name in ("extract", "merge_content", "package"):
+        with report.stage(name):
+            pass
+    report.count("paragraphs", 12)
+    report.count("merged_runs", 3)
+    report.count("paragraphs")
+    report.input_size, report.output_size = 2048, 1024
+
+    data = report.to_dict()
+    assert json.loads(json.dumps(data)) == data
+    assert list(data["stages"]) == ["extract", "merge_content", "package"]
+    assert all(stage["calls"] == 1 for stage in data["stages"].values())
+    assert data["counts"] == {"paragraphs": 13, "merged_runs": 3}
+    assert (data["input_size"], data["output_size"]) == (2048, 1024)
+
+    text = report.format()
+    for name in data["stages"]:
+        assert name in text
+    assert "paragraphs: 13" in text and "merged_runs: 3" in text
+    assert "2048" in text and "1024" in text
@@ -0,0 +1,148 @@
+"""Tests for compiled template sidecars, checked against a fresh compile."""
+
+import json
+import logging
+import shutil
+from pathlib import Path
+
+import pytest
+
+from restorer import template as template_module
+from restorer.core import FormatRestorer
+from restorer.template import CompiledTemplate
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+TEMPLATE = EXAMPLES / "正常格式.docx"
+TARGET = EXAMPLES / "错乱格式.docx"
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    path = tmp_path / "template.docx"
+    shutil.copyfile(TEMPLATE, path)
+    return path
+
+
+@pytest.fixture
+def sidecar(template_path):
+    path = CompiledTemplate.sidecar_path(template_path)
+    CompiledTemplate(template_path).save(path)
+    return path
+
+
+def forbid_compile(monkeypatch):
+    """Make compiling fail, so only a sidecar can produce a CompiledTemplate."""
+    def compile_document(self):
+        raise AssertionError("template compiled instead of loaded")
+
+    monkeypatch.setattr(CompiledTemplate, "_compile_document", compile_document)
+
+
+def rewrite_header(sidecar: Path, **changes) -> None:
+    header, payload = sidecar.read_bytes().split(b"\n", 1)
+    header = dict(json.loads(header), **changes)
+    sidecar.write_bytes(json.dumps(header).encode() + b"\n" + payload)
+
+
+def test_sidecar_round_trip(template_path, sidecar, monkeypatch):
+    fresh = CompiledTemplate(template_path)
+    forbid_compile(monkeypatch)
+    loaded = CompiledTemplate.load(template_path)
+
+    assert loaded._state() == fresh._state()
+    assert sorted(path.name for path in template_path.parent.iterdir()) == sorted(
+        ["template.docx", sidecar.name]
+    )
+
+
+def test_sidecar_output_matches_fresh_compile(template_path, sidecar, monkeypatch,
+                                              frozen_zip_clock):
+    target = TARGET.read_bytes()
+    expected = FormatRestorer(str(TEMPLATE)).restore_bytes(target)
+
+    forbid_compile(monkeypatch)
+    assert FormatRestorer(str(template_path)).restore_bytes(target) == expected
+
+
+def test_sidecar_of_other_template_is_ignored(template_path, sidecar, tmp_path):
+    other = tmp_path / "other.docx"
+    shutil.copyfile(TARGET, other)
+    shutil.copyfile(sidecar, CompiledTemplate.sidecar_path(other))
+
+    assert CompiledTemplate._read_sidecar(sidecar, CompiledTemplate(other).sha256) is None
+    assert CompiledTemplate.load(other)._state() == CompiledTemplate(other)._state()
+
+
+@pytest.mark.parametrize("changes", [
+    {"version": CompiledTemplate.SIDECAR_VERSION + 1},
+    {"version": str(CompiledTemplate.SIDECAR_VERSION)},
+    {"format": "pickle"},
+    {"sha256": "0" * 64},
+], ids=["newer-version", "version-type", "format", "sha256"])
+def test_sidecar_with_other_header_is_ignored(template_path, sidecar, changes):
+    rewrite_header(sidecar, **changes)
+    fresh = CompiledTemplate(template_path)
+
+    assert CompiledTemplate._read_sidecar(sidecar, fresh.sha256) is None
+    assert CompiledTemplate.load(template_path)._state() == fresh._state()
+
+
+@pytest.mark.parametrize("header", [b"[1, 2]\n", b'{"format": "x"', b" " * 2048 + b"\n"],
+                         ids=["not-a-dict", "no-newline", "too-long"])
+def test_malformed_header_is_ignored(template_path, sidecar, header):
+    payload = sidecar.read_bytes().split(b"\n", 1)[1]
+    sidecar.write_bytes(header + payload)
+
+    assert CompiledTemplate._read_sidecar(sidecar, CompiledTemplate(template_path).sha256) is None
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda payload: payload[:len(payload) // 2],
+    lambda payload: b"\xff\xfe" + payload,
+    lambda payload: json.dumps({"texts": []}).encode(),
+    lambda payload: json.dumps(
+        dict(json.loads(payload), page_breaks=[[10 ** 9, "", True, 0]])
+    ).encode(),
+], ids=["truncated", "not-utf8", "missing-keys", "bad-position"])
+def test_corrupt_payload_falls_back_to_compiling(template_path, sidecar, corrupt, caplog):
+    header, payload = sidecar.read_bytes().split(b"\n", 1)
+    sidecar.write_bytes(header + b"\n" + corrupt(payload))
+    fresh = CompiledTemplate(template_path)
+
+    with caplog.at_level(logging.WARNING, logger="restorer.template"):
+        loaded = CompiledTemplate.load(template_path)
+    assert loaded._state() == fresh._state()
+    assert "compiled template" in caplog.text
+
+
+def test_failed_save_keeps_sidecar_and_leaves_no_temp_file(template_path, sidecar, monkeypatch):
+    original = sidecar.read_bytes()
+
+    def dump(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(template_module.json, "dump", dump)
+    with pytest.raises(OSError):
+        CompiledTemplate(template_path).save(sidecar)
+
+    assert sidecar.read_bytes() == original
+    assert sorted(path.name for path in template_path.parent.iterdir()) == sorted(
+        ["template.docx", sidecar.name]
+    )
+
+
+def test_saves_use_separate_temp_files(template_path, sidecar, monkeypatch):
+    temp_paths = []
+    replace = template_module.os.replace
+
+    def record_replace(src, dst):
+        temp_paths.append(Path(src))
+        replace(src, dst)
+
+    monkeypatch.setattr(template_module.os, "replace", record_replace)
+    compiled = CompiledTemplate(template_path)
+    compiled.save(sidecar)
+    compiled.save(sidecar)
+
+    assert len(set(temp_paths)) == 2
+    assert all(path.parent == sidecar.parent for path in temp_paths)
@@ -0,0 +1,305 @@
+"""Tests for the web server's template cache, metrics and profiling endpoints."""
+
+import importlib.util
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("aiofiles")
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+TEMPLATE = ROOT / "examples" / "正常格式.docx"
+TARGET = ROOT / "examples" / "错乱格式.docx"
+
+
+def load_web_module():
+    spec = importlib.util.spec_from_file_location("formatmaster_web", ROOT / "web" / "main.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+web = load_web_module()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """The web module with its data directories, template cache and metrics isolated."""
+    monkeypatch.setattr(web, "TEMPLATE_FILES_DIR", tmp_path / "template_files")
+    monkeypatch.setattr(web, "UPLOADS_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(web, "PROFILES_DIR", tmp_path / "profiles")
+    monkeypatch.setattr(web, "TEMPLATES_CONFIG", tmp_path / "templates.json")
+    monkeypatch.setattr(web, "HISTORY_CONFIG", tmp_path / "history.json")
+    monkeypatch.setattr(web, "template_cache", web.TemplateCache())
+    monkeypatch.setattr(web, "metrics", web.create_metrics())
+    for directory in (web.TEMPLATE_FILES_DIR, web.UPLOADS_DIR):
+        directory.mkdir()
+    return web
+
+
+@pytest.fixture
+def client(server):
+    return TestClient(server.app)
+
+
+def add_template(server, source: Path = TEMPLATE) -> str:
+    """Register a copy of a template file and return its ID."""
+    template_id = str(uuid.uuid4())
+    filename = f"{template_id}_{source.name}"
+    shutil.copyfile(source, server.TEMPLATE_FILES_DIR / filename)
+    data = server.load_templates()
+    data["templates"].append({
+        "id": template_id, "name": source.stem, "filename": filename, "is_default": False,
+    })
+    server.save_templates(data)
+    return template_id
+
+
+def template_file(server, template_id: str) -> Path:
+    return next(server.TEMPLATE_FILES_DIR.glob(f"{template_id}_*"))
+
+
+def convert(client, template_id: str, **data):
+    with open(TARGET, "rb") as f:
+        return client.post(
+            "/api/convert",
+            data=dict(template_id=template_id, **data),
+            files={"file": (TARGET.name, f)},
+        )
+
+
+# ==================== 模板缓存 ====================
+
+def test_cache_evicts_by_count(server):
+    cache = server.TemplateCache(max_entries=2)
+    ids = [add_template(server) for _ in range(3)]
+    for template_id in ids:
+        cache.get(template_id, template_file(server, template_id))
+
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+    # The least recently used template was evicted; the newest ones are still cached
+    cache.get(ids[2], template_file(server, ids[2]))
+    cache.get(ids[0], template_file(server, ids[0]))
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_cache_evicts_by_size(server):
+    size = TEMPLATE.stat().st_size
+    cache = server.TemplateCache(max_bytes=size * 3 // 2)
+    ids = [add_template(server) for _ in range(3)]
+    for template_id in ids:
+        cache.get(template_id, template_file(server, template_id))
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (1, size, 2)
+
+
+def test_cache_keeps_entry_when_only_mtime_changes(server):
+    cache = server.TemplateCache()
+    template_id = add_template(server)
+    path = template_file(server, template_id)
+    restorer = cache.get(template_id, path)
+
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.get(template_id, path) is restorer
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # New content behind a new timestamp is loaded again
+    shutil.copyfile(TARGET, path)
+    assert cache.get(template_id, path) is not restorer
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_hashes_outside_the_lock(server, monkeypatch):
+    cache = server.TemplateCache()
+    template_id = add_template(server)
+    path = template_file(server, template_id)
+    cache.get(template_id, path)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    sha256 = server.hashlib.sha256
+    locked = []
+
+    def checked_sha256(*args):
+        locked.append(cache._lock.locked())
+        return sha256(*args)
+
+    monkeypatch.setattr(server.hashlib, "sha256", checked_sha256)
+    cache.get(template_id, path)
+    assert locked == [False]
+
+
+def test_update_and_delete_invalidate_cache(server, client):
+    template_id = add_template(server)
+    server.template_cache.get(template_id, template_file(server, template_id))
+    assert server.template_cache.stats()["entries"] == 1
+
+    assert client.put(f"/api/templates/{template_id}", json={"name": "新名称"}).status_code == 200
+    assert server.template_cache.stats()["entries"] == 0
+
+    path = template_file(server, template_id)
+    server.template_cache.get(template_id, path)
+    assert client.delete(f"/api/templates/{template_id}").status_code == 200
+    assert server.template_cache.stats()["entries"] == 0
+    assert not path.exists()
+
+
+def test_cache_stats_count_hits_and_misses(server, client):
+    template_id = add_template(server)
+    for _ in range(3):
+        assert convert(client, template_id).status_code == 200
+
+    stats = client.get("/api/cache/stats").json()["data"]
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1)
+    assert stats["hit_ratio"] == pytest.approx(2 / 3)
+
+
+def test_history_report_records_skipped_merge_styles(server, client):
+    template_id = add_template(server)
+    assert convert(client, template_id).status_code == 200
+
+    report = server.load_history()["conversions"][0]["report"]
+    assert "merge_styles" in report["stages"]
+    assert report["counts"]["merge_styles_skipped"] == 1
+
+
+# ==================== 监控指标 ====================
+
+def metric_lines(text: str, name: str):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+def sample(text: str, series: str) -> float:
+    """Value of one rendered series (name plus labels)."""
+    lines = (line.rsplit(" ", 1) for line in text.splitlines())
+    values = [value for key, value in lines if key == series]
+    assert len(values) == 1, series
+    return float(values[0])
+
+
+def test_histogram_buckets_are_cumulative(server):
+    registry = server.MetricsRegistry(buckets=(0.1, 1.0, 10.0))
+    registry.describe("latency_seconds", "histogram", "Latency")
+    for value in (0.05, 0.1, 0.5, 1.0, 5.0, 50.0, 500.0):
+        registry.observe("latency_seconds", value, stage="merge")
+
+    text = registry.render()
+    assert text.endswith("\n")
+    assert metric_lines(text, "# ") == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+    ]
+    assert metric_lines(text, "latency_seconds_bucket") == [
+        'latency_seconds_bucket{stage="merge",le="0.1"} 2',
+        'latency_seconds_bucket{stage="merge",le="1.0"} 4',
+        'latency_seconds_bucket{stage="merge",le="10.0"} 5',
+        'latency_seconds_bucket{stage="merge",le="+Inf"} 7',
+    ]
+    assert sample(text, 'latency_seconds_sum{stage="merge"}') == pytest.approx(556.65)
+    assert sample(text, 'latency_seconds_count{stage="merge"}') == 7
+
+
+def test_counters_gauges_and_label_escaping(server):
+    registry = server.MetricsRegistry()
+    registry.describe("errors_total", "counter", "Errors")
+    registry.describe("in_flight", "gauge", "In flight")
+    registry.inc("errors_total", endpoint="convert", type='Bad"Quote')
+    registry.inc("errors_total", 2, endpoint="convert", type='Bad"Quote')
+    registry.inc("errors_total", endpoint="a\\b\nc")
+    registry.inc("in_flight")
+    registry.inc("in_flight", -1)
+
+    text = registry.render()
+    assert sample(text, 'errors_total{endpoint="convert",type="Bad\\"Quote"}') == 3
+    assert sample(text, 'errors_total{endpoint="a\\\\b\\nc"}') == 1
+    assert sample(text, "in_flight") == 0
+    # Every series stays on one line
+    assert all(line.startswith(("#", "errors_total", "in_flight")) for line in text.splitlines())
+
+
+def test_in_flight_gauge_counts_api_requests_only(server, client, monkeypatch):
+    during = []
+    stats = server.template_cache.stats
+
+    def observed_stats():
+        during.append(sample(server.metrics.render(), "formatmaster_requests_in_flight"))
+        return stats()
+
+    monkeypatch.setattr(server.template_cache, "stats", observed_stats)
+    assert client.get("/api/cache/stats").status_code == 200
+    assert during == [1]
+
+    # Neither static files nor the scrape itself are counted
+    assert client.get("/static/does-not-exist.css").status_code == 404
+    assert sample(client.get("/api/metrics").text, "formatmaster_requests_in_flight") == 0
+
+
+def test_cache_counters_increase_at_hits_and_misses(server, client):
+    template_id = add_template(server)
+    for _ in range(3):
+        server.template_cache.get(template_id, template_file(server, template_id))
+    server.template_cache = server.TemplateCache()
+    server.template_cache.get(template_id, template_file(server, template_id))
+
+    text = client.get("/api/metrics").text
+    # A rebuilt cache starts its own stats, but the counters keep counting
+    assert sample(text, "formatmaster_template_cache_hits_total") == 2
+    assert sample(text, "formatmaster_template_cache_misses_total") == 2
+    assert sample(text, "formatmaster_template_cache_entries") == 1
+    assert sample(text, "formatmaster_template_cache_hit_ratio") == 0
+
+
+# ==================== 性能分析 ====================
+
+@pytest.mark.parametrize("admin_token, headers", [
+    (None, {}),
+    (None, {"X-Admin-Token": ""}),
+    ("secret", {}),
+    ("secret", {"X-Admin-Token": "wrong"}),
+], ids=["disabled", "disabled-empty-token", "no-token", "wrong-token"])
+def test_profile_requires_admin_token(server, client, monkeypatch, admin_token, headers):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", admin_token)
+    template_id = add_template(server)
+
+    with open(TARGET, "rb") as f:
+        response = client.post(
+            "/api/convert",
+            data={"template_id": template_id, "profile": "true"},
+            files={"file": (TARGET.name, f)},
+            headers=headers,
+        )
+    assert response.status_code == 403
+    assert not server.PROFILES_DIR.exists()
+    assert not list(server.UPLOADS_DIR.iterdir())
+
+
+def test_failed_profiled_conversions_are_pruned(server, client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(server, "PROFILE_MAX_RUNS", 2)
+
+    def fail(self, *args, **kwargs):
+        raise RuntimeError("conversion failed")
+
+    monkeypatch.setattr(server.FormatRestorer, "restore_format", fail)
+    template_id = add_template(server)
+    for _ in range(4):
+        with open(TARGET, "rb") as f:
+            response = client.post(
+                "/api/convert",
+                data={"template_id": template_id, "profile": "true"},
+                files={"file": (TARGET.name, f)},
+                headers={"X-Admin-Token": "secret"},
+            )
+        assert response.status_code == 500
+
+    assert len(list(server.PROFILES_DIR.glob("*.prof"))) == 2
+    assert len(list(server.PROFILES_DIR.glob("*.collapsed.txt"))) == 2
@@ -41,6 +41,8 @@ a = Analysis(
         'aiofiles',
         'pydantic',
         'pydantic.dataclasses',
+        # restorer以数据文件方式打包，其依赖的标准库模块需显式声明
+        'cProfile',
     ],
     hookspath=['.'],  # 使用当前目录的hooks
     hooksconfig={},
@@ -2,17 +2,23 @@
 Word Format Restorer - Web应用主程序
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Response
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
 from fastapi.responses import RedirectResponse
 import os
+import bisect
 import shutil
 import aiofiles
 import json
 import uuid
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
@@ -60,6 +66,9 @@ else:
 try:
     from restorer.core import FormatRestorer
     from restorer.comparer import FormatComparer
+    from restorer.profiling import MAX_PROFILE_BYTES, collapsed_path, profiled
+    from restorer.report import RestoreReport
+    from restorer.template import CompiledTemplate
 except ImportError:
     print("[ERROR] Failed to import restorer module")
     print(f"sys.frozen: {getattr(sys, 'frozen', False)}")
@@ -89,6 +98,13 @@ DATA_DIR = USER_DATA_PATH / "data"
 UPLOADS_DIR = USER_DATA_PATH / "static" / "uploads"
 TEMPLATES_CONFIG = DATA_DIR / "templates.json"
 HISTORY_CONFIG = DATA_DIR / "history.json"
+PROFILES_DIR = DATA_DIR / "profiles"
+
+# 管理员令牌（通过环境变量配置，未配置时禁用需要管理员权限的功能，如性能分析）
+ADMIN_TOKEN = os.environ.get("FORMATMASTER_ADMIN_TOKEN")
+# 性能分析文件：单个文件大小上限，以及保留的最近分析次数
+PROFILE_MAX_BYTES = MAX_PROFILE_BYTES
+PROFILE_MAX_RUNS = 50
 
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
@@ -152,9 +168,10 @@ def add_conversion_record(
     file_size: int,
     similarity: float,
     processing_time: float,
-    status: str = "success"
+    status: str = "success",
+    report: Optional[dict] = None
 ):
-    """添加转换记录"""
+    """添加转换记录（report为RestoreReport.to_dict()的结果，记录各阶段耗时与计数）"""
     history = load_history()
 
     record = {
@@ -166,6 +183,7 @@ def add_conversion_record(
         "file_size": file_size,
         "similarity": similarity,
         "processing_time": processing_time,
+        "report": report,
         "status": status
     }
 
@@ -173,6 +191,30 @@ def add_conversion_record(
     save_history(history)
 
 
+def compile_template_sidecar(file_path: Path, contents: bytes):
+    """预编译模板并保存到模板文件旁的缓存文件，失败时不影响上传"""
+    try:
+        compiled = CompiledTemplate(contents)
+        compiled.save(CompiledTemplate.sidecar_path(file_path))
+    except Exception as e:
+        print(f"[WARNING] 模板预编译失败: {file_path.name}: {e}", file=sys.stderr)
+
+
+def is_admin(token: Optional[str]) -> bool:
+    """校验管理员令牌"""
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def prune_profiles():
+    """只保留最近PROFILE_MAX_RUNS次的性能分析文件"""
+    runs = sorted(PROFILES_DIR.glob("*.prof"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in runs[PROFILE_MAX_RUNS:]:
+        path.unlink()
+        folded = collapsed_path(path)
+        if folded.exists():
+            folded.unlink()
+
+
 def get_templates() -> List[dict]:
     """获取所有模板"""
     data = load_templates()
@@ -191,6 +233,247 @@ def get_default_template() -> Optional[dict]:
     return None
 
 
+# ==================== 模板缓存 ====================
+
+# 缓存的模板数量上限和总大小上限（按模板文件大小计算）
+TEMPLATE_CACHE_MAX_ENTRIES = 8
+TEMPLATE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class TemplateCache:
+    """
+    模板状态LRU缓存（按模板ID索引）
+
+    缓存已编译好模板的FormatRestorer，同一模板的后续转换不再重复任何模板侧的计算。
+    模板文件的修改时间或大小变化时重新计算内容哈希（在锁外计算），哈希不同则重新加载。
+    """
+
+    def __init__(self, max_entries: int = TEMPLATE_CACHE_MAX_ENTRIES, max_bytes: int = TEMPLATE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # 模板ID -> {"restorer", "stamp", "sha256", "size"}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, template_id: str, template_path: Path) -> FormatRestorer:
+        """获取模板对应的FormatRestorer，未命中时加载并放入缓存"""
+        stat = template_path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(template_id)
+            if entry is not None and entry["stamp"] == stamp:
+                return self._hit(template_id, entry)
+
+        if entry is not None:
+            # 文件时间戳变化：在锁外计算内容哈希（大文件不阻塞其他请求），哈希相同则继续使用缓存
+            with open(template_path, 'rb') as f:
+                sha256 = hashlib.sha256(f.read()).hexdigest()
+            with self._lock:
+                # 计算期间条目可能已被其他请求替换或移除，只处理原来的条目
+                if self._entries.get(template_id) is entry:
+                    if sha256 == entry["sha256"]:
+                        entry["stamp"] = stamp
+                        return self._hit(template_id, entry)
+                    del self._entries[template_id]
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc("formatmaster_template_cache_misses_total")
+
+        # 在锁外加载模板（优先使用预编译缓存文件）
+        restorer = FormatRestorer(str(template_path))
+        compiled = restorer.compiled_template
+
+        with self._lock:
+            self._entries[template_id] = {
+                "restorer": restorer,
+                "stamp": stamp,
+                "sha256": compiled.sha256,
+                "size": compiled.size,
+            }
+            self._entries.move_to_end(template_id)
+            self._evict()
+        return restorer
+
+    def _hit(self, template_id: str, entry: dict) -> FormatRestorer:
+        """记录一次命中并返回缓存的FormatRestorer（调用方需持有锁）"""
+        self._entries.move_to_end(template_id)
+        self.hits += 1
+        metrics.inc("formatmaster_template_cache_hits_total")
+        return entry["restorer"]
+
+    def invalidate(self, template_id: str):
+        """移除模板的缓存（模板更新或删除时调用）"""
+        with self._lock:
+            self._entries.pop(template_id, None)
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry["size"] for entry in self._entries.values()),
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def _evict(self):
+        """淘汰最久未使用的模板，直到数量和大小都在上限内（至少保留最新的一个）"""
+        total_bytes = sum(entry["size"] for entry in self._entries.values())
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or total_bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            total_bytes -= entry["size"]
+            self.evictions += 1
+            metrics.inc("formatmaster_template_cache_evictions_total")
+
+
+template_cache = TemplateCache()
+
+
+# ==================== 监控指标 ====================
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """
+    进程内监控指标，以Prometheus文本格式输出（无需外部服务）
+
+    计数器、仪表和直方图按（指标名, 标签）分别累计，由 /api/metrics 统一输出。
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 指标名 -> (类型, 说明)，按注册顺序输出
+        self._meta = OrderedDict()
+        # 指标名 -> {标签元组: 数值}；直方图的数值为 [各桶计数..., 总和, 次数]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, help_text: str):
+        """注册指标（kind为counter、gauge或histogram）"""
+        self._meta[name] = (kind, help_text)
+        self._values.setdefault(name, {})
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器或仪表加上value（仪表可传负数）"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """设置仪表的值"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[name][key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """向直方图记录一次观测值"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [0] * (len(self.buckets) + 3)
+            data[bisect.bisect_left(self.buckets, value)] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> str:
+        """按Prometheus文本格式（0.0.4）输出全部指标"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self._values[name].items():
+                    if kind != "histogram":
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                        continue
+                    cumulative = 0
+                    bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, value):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {value[-2]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(key) -> str:
+    """将标签元组格式化为 {name="value",...}（按规范转义值中的特殊字符）"""
+    if not key:
+        return ""
+    parts = []
+    for label, value in key:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{label}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def create_metrics() -> MetricsRegistry:
+    """创建并注册本服务的全部监控指标"""
+    registry = MetricsRegistry()
+    registry.describe("formatmaster_conversions_total", "counter", "文档转换次数（按结果）")
+    registry.describe("formatmaster_compares_total", "counter", "文档对比次数（按结果）")
+    registry.describe("formatmaster_conversion_duration_seconds", "histogram", "文档转换总耗时")
+    registry.describe("formatmaster_compare_duration_seconds", "histogram", "文档对比耗时")
+    registry.describe("formatmaster_stage_duration_seconds", "histogram", "格式还原各阶段墙钟耗时（来自RestoreReport）")
+    registry.describe("formatmaster_stage_cpu_seconds_total", "counter", "格式还原各阶段累计CPU耗时")
+    registry.describe("formatmaster_requests_in_flight", "gauge", "正在处理的API请求数（不含 /api/metrics 抓取和静态文件）")
+    registry.set("formatmaster_requests_in_flight", 0)
+    registry.describe("formatmaster_upload_bytes_total", "counter", "上传文件字节数（按接口）")
+    registry.describe("formatmaster_errors_total", "counter", "处理失败次数（按接口和异常类型）")
+    # 缓存计数器在命中/未命中/淘汰处累加，缓存重建也不会回退
+    registry.describe("formatmaster_template_cache_hits_total", "counter", "模板缓存命中次数")
+    registry.describe("formatmaster_template_cache_misses_total", "counter", "模板缓存未命中次数")
+    registry.describe("formatmaster_template_cache_evictions_total", "counter", "模板缓存淘汰次数")
+    registry.describe("formatmaster_template_cache_hit_ratio", "gauge", "模板缓存命中率")
+    registry.describe("formatmaster_template_cache_entries", "gauge", "模板缓存条目数")
+    registry.describe("formatmaster_template_cache_bytes", "gauge", "模板缓存占用字节数（按模板文件大小）")
+    return registry
+
+
+metrics = create_metrics()
+
+
+def record_restore_report(report: RestoreReport):
+    """将一次转换的RestoreReport计入各阶段耗时指标"""
+    for stage, timing in report.stages.items():
+        metrics.observe("formatmaster_stage_duration_seconds", timing.wall, stage=stage)
+        metrics.inc("formatmaster_stage_cpu_seconds_total", timing.cpu, stage=stage)
+
+
+# 不计入在途请求数的API路径（指标抓取本身）
+IN_FLIGHT_EXCLUDED_PATHS = {"/api/metrics"}
+
+
+@app.middleware("http")
+async def track_in_flight_requests(request: Request, call_next):
+    """统计正在处理的API请求数（页面、静态文件和指标抓取不计入）"""
+    path = request.url.path
+    if not path.startswith("/api/") or path in IN_FLIGHT_EXCLUDED_PATHS:
+        return await call_next(request)
+    metrics.inc("formatmaster_requests_in_flight")
+    try:
+        return await call_next(request)
+    finally:
+        metrics.inc("formatmaster_requests_in_flight", -1)
+
+
 # ==================== 页面路由 ====================
 
 @app.get("/", response_class=HTMLResponse)
@@ -248,9 +531,13 @@ async def upload_template(
 
     try:
         contents = await file.read()
+        metrics.inc("formatmaster_upload_bytes_total", len(contents), endpoint="template")
         async with aiofiles.open(file_path, 'wb') as f:
             await f.write(contents)
 
+        # 预编译模板，服务重启或新进程可直接加载
+        compile_template_sidecar(file_path, contents)
+
         # 保存到配置
         template = Template(name=name, filename=filename, is_default=is_default)
         data = load_templates()
@@ -268,9 +555,13 @@ async def upload_template(
             "name": template.name
         }}
     except Exception as e:
+        metrics.inc("formatmaster_errors_total", endpoint="template", type=type(e).__name__)
         # 删除已上传的文件
         if file_path.exists():
             file_path.unlink()
+        sidecar_path = CompiledTemplate.sidecar_path(file_path)
+        if sidecar_path.exists():
+            sidecar_path.unlink()
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 
@@ -299,11 +590,15 @@ async def delete_template(template_id: str):
     # 删除模板
     data["templates"] = [t for t in data["templates"] if t["id"] != template_id]
     save_templates(data)
+    template_cache.invalidate(template_id)
 
-    # 删除文件
+    # 删除文件（包括预编译缓存）
     file_path = TEMPLATE_FILES_DIR / template_to_delete["filename"]
     if file_path.exists():
         file_path.unlink()
+    sidecar_path = CompiledTemplate.sidecar_path(file_path)
+    if sidecar_path.exists():
+        sidecar_path.unlink()
 
     return {"success": True, "message": "模板删除成功"}
 
@@ -362,6 +657,7 @@ async def update_template(template_id: str, request: Request):
     template["name"] = new_name
     template["updated_at"] = datetime.now().isoformat()
     save_templates(data)
+    template_cache.invalidate(template_id)
 
     return {"success": True, "message": "模板名称更新成功"}
 
@@ -390,10 +686,19 @@ async def set_default_template(template_id: str):
 @app.post("/api/convert")
 async def convert_document(
     template_id: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    profile: bool = Form(False),
+    x_admin_token: Optional[str] = Header(None)
 ):
-    """转换文档"""
+    """
+    转换文档
+
+    管理员（请求头X-Admin-Token与FORMATMASTER_ADMIN_TOKEN一致）可设置profile=true，
+    对本次转换进行性能分析，结果按请求ID写入PROFILES_DIR（cProfile统计与折叠栈文件）。
+    """
     import sys  # 在函数开始就导入 sys
+    if profile and not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="性能分析仅限管理员使用")
     # 验证文件类型
     if not file.filename.endswith('.docx'):
         raise HTTPException(status_code=400, detail="仅支持.docx文件")
@@ -417,30 +722,45 @@ async def convert_document(
     # 保存上传的文件
     try:
         contents = await file.read()
+        metrics.inc("formatmaster_upload_bytes_total", len(contents), endpoint="convert")
         async with aiofiles.open(input_path, 'wb') as f:
             await f.write(contents)
     except Exception as e:
+        metrics.inc("formatmaster_errors_total", endpoint="convert", type=type(e).__name__)
         raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
 
     # 执行格式还原
+    output_path = None
     try:
         import time
         from datetime import datetime
         start_time = time.time()
 
         template_path = TEMPLATE_FILES_DIR / template["filename"]
-        restorer = FormatRestorer(str(template_path))
+        restorer = template_cache.get(template["id"], template_path)
 
         # 使用时间戳作为文件名后缀
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_filename = file.filename.replace(".docx", f"_{timestamp}.docx")
         output_path = UPLOADS_DIR / f"{session_id}_{output_filename}"
 
-        # 转换文档
-        restorer.restore_format(str(input_path), str(output_path))
+        # 转换文档（同时记录各阶段耗时与计数）
+        report = RestoreReport()
+        if profile:
+            profile_path = PROFILES_DIR / f"{session_id}.prof"
+            try:
+                with profiled(profile_path, PROFILE_MAX_BYTES):
+                    restorer.restore_format(str(input_path), str(output_path), report=report)
+            finally:
+                # 转换失败时同样会写出分析文件，也需要清理
+                prune_profiles()
+        else:
+            restorer.restore_format(str(input_path), str(output_path), report=report)
 
         # 计算处理时间
         processing_time = time.time() - start_time
+        metrics.observe("formatmaster_conversion_duration_seconds", processing_time)
+        record_restore_report(report)
 
         # 计算相似度（可选）- 暂时禁用以测试
         similarity = 95.0  # 默认值
@@ -460,6 +780,7 @@ async def convert_document(
                 similarity = result.get("overall_similarity", 95.0)
                 print(f"[DEBUG] 相似度计算完成: {similarity}", file=sys.stderr)
         except Exception as e:
+            metrics.inc("formatmaster_errors_total", endpoint="similarity", type=type(e).__name__)
             print(f"[ERROR] Similarity calculation failed: {e}", file=sys.stderr)
             import traceback
             traceback.print_exc(file=sys.stderr)
@@ -481,9 +802,11 @@ async def convert_document(
             file_size=input_path.stat().st_size,
             similarity=similarity,
             processing_time=processing_time,
-            status="success"
+            status="success",
+            report=report.to_dict()
         )
 
+        metrics.inc("formatmaster_conversions_total", status="success")
         print(f"[DEBUG] 准备返回结果: session_id={session_id}, output_filename={output_filename}", file=sys.stderr)
         return {
             "success": True,
@@ -491,17 +814,25 @@ async def convert_document(
                 "session_id": session_id,
                 "output_filename": output_filename,
                 "similarity": similarity,
-                "download_url": f"/api/download/{session_id}/{output_filename}"
+                "download_url": f"/api/download/{session_id}/{output_filename}",
+                "profile": {
+                    "stats": profile_path.name,
+                    "collapsed": collapsed_path(profile_path).name
+                } if profile else None
             }
         }
     except Exception as e:
         # 打印详细错误信息
         import traceback
+        metrics.inc("formatmaster_conversions_total", status="error")
+        metrics.inc("formatmaster_errors_total", endpoint="convert", type=type(e).__name__)
         print(f"[ERROR] Conversion failed: {str(e)}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         # 清理文件
         if input_path.exists():
             input_path.unlink()
+        if output_path is not None and output_path.exists():
+            output_path.unlink()
         raise HTTPException(status_code=500, detail=f"转换失败: {str(e)}")
 
 
@@ -544,6 +875,23 @@ async def health_check():
     return {"success": True, "message": "服务正常"}
 
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """模板缓存统计（命中/未命中次数等）"""
+    return {"success": True, "data": template_cache.stats()}
+
+
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    """监控指标（Prometheus文本格式）"""
+    # 缓存的计数器在命中/未命中处累加，这里只同步仪表
+    stats = template_cache.stats()
+    metrics.set("formatmaster_template_cache_hit_ratio", stats["hit_ratio"])
+    metrics.set("formatmaster_template_cache_entries", stats["entries"])
+    metrics.set("formatmaster_template_cache_bytes", stats["bytes"])
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.post("/api/compare")
 async def compare_documents(file1: UploadFile = File(...), file2: UploadFile = File(...)):
     """比较两个Word文档的格式相似度"""
@@ -568,6 +916,7 @@ async def compare_documents(file1: UploadFile = File(...), file2: UploadFile = F
         # 读取文件内容
         content1 = await file1.read()
         content2 = await file2.read()
+        metrics.inc("formatmaster_upload_bytes_total", len(content1) + len(content2), endpoint="compare")
         print(f"[DEBUG] Read files: {len(content1)} bytes, {len(content2)} bytes")
 
         # 写入文件
@@ -584,11 +933,14 @@ async def compare_documents(file1: UploadFile = File(...), file2: UploadFile = F
         comparer = FormatComparer()
 
         print("[DEBUG] Starting document comparison...")
+        start_time = time.perf_counter()
         result = comparer.compare_documents(
             str(file1_path),
             str(file2_path),
             full_compare=False  # 只对比格式定义文件,与转换功能保持一致
         )
+        metrics.observe("formatmaster_compare_duration_seconds", time.perf_counter() - start_time)
+        metrics.inc("formatmaster_compares_total", status="success")
 
         print(f"[DEBUG] Comparison result: {result}")
 
@@ -600,6 +952,8 @@ async def compare_documents(file1: UploadFile = File(...), file2: UploadFile = F
     except HTTPException:
         raise
     except Exception as e:
+        metrics.inc("formatmaster_compares_total", status="error")
+        metrics.inc("formatmaster_errors_total", endpoint="compare", type=type(e).__name__)
         # 打印详细错误信息到控制台
         print(f"[ERROR] Comparison error: {str(e)}")
         print(traceback.format_exc())